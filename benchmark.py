@@ -0,0 +1,405 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+import tracemalloc
+import numpy as np
+from pathlib import Path
+from typing import List, Dict
+
+from src.retrievers import build_index, configure_index, current_cache_dir
+
+
+def load_evidence_queries(base_dir: Path = Path("test_data")) -> List[str]:
+    """Collect evidence snippets from the reference annotations to use as queries."""
+    queries = []
+    for output_file in sorted((base_dir / "outputs").glob("output*.json")):
+        with open(output_file, "r") as f:
+            queries.extend(x["evidence"] for x in json.load(f)["icd10_codes"])
+    return queries
+
+
+def load_document_embeddings(model, cache_dir: str = "retriever_cache") -> np.ndarray:
+    """Load cached ICD-10 description embeddings, computing them if no cache exists."""
+    embedding_path = os.path.join(current_cache_dir(cache_dir), "embeddings.npy")
+    if os.path.isfile(embedding_path):
+        return np.load(embedding_path).astype(np.float32)
+
+    from src.code_table import load_code_table
+
+    table = load_code_table()
+    descriptions = [table.description(idx) for idx in range(len(table))]
+    return model.encode(descriptions).astype(np.float32)
+
+
+def recall_at_k(approx_indices: np.ndarray, exact_indices: np.ndarray) -> float:
+    """Fraction of the exact top-k neighbours found by the approximate search."""
+    hits = [
+        len(set(approx_row) & set(exact_row)) / len(exact_row)
+        for approx_row, exact_row in zip(approx_indices, exact_indices)
+    ]
+    return float(np.mean(hits))
+
+
+def time_search(index, query_embeddings: np.ndarray, k: int) -> Dict:
+    """Time single-query and batched searches against an index."""
+    start = time.perf_counter()
+    for i in range(len(query_embeddings)):
+        index.search(query_embeddings[i : i + 1], k)
+    single_ms = (time.perf_counter() - start) * 1000 / len(query_embeddings)
+
+    start = time.perf_counter()
+    _, indices = index.search(query_embeddings, k)
+    batch_ms = (time.perf_counter() - start) * 1000
+
+    return {"ms_per_query": single_ms, "batch_ms": batch_ms, "indices": indices}
+
+
+def benchmark_index_types(
+    embeddings: np.ndarray, query_embeddings: np.ndarray, k: int = 10
+) -> List[Dict]:
+    """
+    Compare recall@k and search latency of approximate indexes against the exact flat index.
+
+    Args:
+        embeddings (np.ndarray): Document embeddings.
+        query_embeddings (np.ndarray): Query embeddings.
+        k (int): Number of neighbours to retrieve.
+
+    Returns:
+        List[Dict]: One row per index configuration.
+    """
+    sweeps = [
+        ("flat", {}, [{}]),
+        ("hnsw", {"M": 32}, [{"efSearch": ef} for ef in [16, 32, 64, 128, 256]]),
+        ("ivf", {"nlist": 1024}, [{"nprobe": n} for n in [1, 4, 8, 16, 32, 64]]),
+    ]
+
+    rows = []
+    exact_indices = None
+    for index_type, build_params, search_sweep in sweeps:
+        start = time.perf_counter()
+        index = build_index(embeddings, index_type, build_params)
+        build_s = time.perf_counter() - start
+
+        for search_params in search_sweep:
+            params = {**build_params, **search_params}
+            configure_index(index, index_type, params)
+            timings = time_search(index, query_embeddings, k)
+            if exact_indices is None:
+                exact_indices = timings["indices"]
+            rows.append(
+                {
+                    "index_type": index_type,
+                    "index_params": params,
+                    "build_s": build_s,
+                    f"recall@{k}": recall_at_k(timings["indices"], exact_indices),
+                    "ms_per_query": timings["ms_per_query"],
+                    "batch_ms": timings["batch_ms"],
+                }
+            )
+    return rows
+
+
+def run_index_benchmark(args):
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(args.model_name)
+    embeddings = load_document_embeddings(model, args.cache_dir)
+    queries = load_evidence_queries()
+    query_embeddings = model.encode(queries).astype(np.float32)
+
+    rows = benchmark_index_types(embeddings, query_embeddings, k=args.k)
+
+    print(
+        f"{len(queries)} queries against {len(embeddings)} documents, k={args.k}\n"
+    )
+    print(f"{'index':<6} {'params':<32} {'build s':>8} {'recall':>7} {'ms/query':>9} {'batch ms':>9}")
+    for row in rows:
+        print(
+            f"{row['index_type']:<6} {json.dumps(row['index_params']):<32} "
+            f"{row['build_s']:>8.2f} {row[f'recall@{args.k}']:>7.3f} "
+            f"{row['ms_per_query']:>9.3f} {row['batch_ms']:>9.2f}"
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(rows, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+
+def load_input_notes(base_dir: Path = Path("test_data")) -> List[str]:
+    """Load the sample discharge summaries."""
+    return [
+        input_file.read_text()
+        for input_file in sorted((base_dir / "inputs").glob("input*.txt"))
+    ]
+
+
+def summarize_latencies(latencies: List[float]) -> Dict:
+    """Summarize per-note latencies in milliseconds."""
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "notes": len(latencies),
+        "mean_ms": float(latencies_ms.mean()),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+    }
+
+
+def run_pipeline_benchmark(args):
+    # The app reads its configuration from the environment when it is imported
+    os.environ["LLM_BACKEND"] = "replay"
+    os.environ["LLM_RECORD_DIR"] = args.record_dir
+    os.environ["LLM_REPLAY_LATENCY"] = str(args.latency)
+    os.environ["LLM_CACHE_PATH"] = ""
+    # Repeated passes over the same notes would otherwise be served by the note result cache
+    os.environ["NOTE_CACHE_SIZE"] = "0"
+    os.environ["NOTE_CACHE_PATH"] = ""
+
+    start = time.perf_counter()
+    from src import app as app_module
+    from src.agents import NotesProcessor
+
+    startup_s = time.perf_counter() - start
+    notes = load_input_notes()
+    async_processor = app_module.processor
+    sync_processor = NotesProcessor(
+        coder=async_processor.coder,
+        reviewer=async_processor.reviewer,
+        physician=async_processor.physician,
+        patient=async_processor.patient,
+        adjustor=async_processor.adjustor,
+    )
+
+    def time_notes(process_note):
+        latencies = []
+        for _ in range(args.repeat):
+            for note in notes:
+                start = time.perf_counter()
+                process_note(note)
+                latencies.append(time.perf_counter() - start)
+        return summarize_latencies(latencies)
+
+    from fastapi.testclient import TestClient
+
+    http_client = TestClient(app_module.app)
+
+    def post_note(note):
+        response = http_client.post("/process_note", json={"note": note})
+        response.raise_for_status()
+
+    results = {
+        "startup_s": startup_s,
+        "simulated_llm_latency_s": args.latency,
+        "sync_processor": time_notes(sync_processor.process_note),
+        "async_processor": time_notes(
+            lambda note: asyncio.run(async_processor.process_note(note))
+        ),
+        "http_endpoint": time_notes(post_note),
+    }
+
+    print(f"App startup: {startup_s:.2f} s, simulated LLM latency: {args.latency} s per call\n")
+    print(f"{'path':<16} {'notes':>6} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for name in ["sync_processor", "async_processor", "http_endpoint"]:
+        row = results[name]
+        print(
+            f"{name:<16} {row['notes']:>6} {row['mean_ms']:>9.1f} "
+            f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f}"
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+
+def measure(fn) -> Dict:
+    """Run a function twice: once for wall time, once under tracemalloc for peak memory."""
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": seconds, "peak_mb": peak / 2**20}
+
+
+def run_hierarchy_benchmark(args):
+    from src.process_icd10_hierarchy import (
+        alternative_parser,
+        iter_icd10_xml,
+        parse_icd10_xml,
+        write_indexed_codes,
+    )
+
+    def read_xml():
+        with open(args.xml_file, "r", encoding="utf-8") as f:
+            return f.read()
+
+    parsers = {
+        "parse_icd10_xml": lambda: parse_icd10_xml(read_xml()),
+        "streaming": lambda: write_indexed_codes(
+            iter_icd10_xml(args.xml_file), args.output_records
+        ),
+    }
+    if args.include_alternative:
+        parsers["alternative_parser"] = lambda: alternative_parser(read_xml())
+
+    results = {name: measure(fn) for name, fn in parsers.items()}
+
+    print(f"{'parser':<20} {'seconds':>9} {'peak MB':>9}")
+    for name, row in results.items():
+        print(f"{name:<20} {row['seconds']:>9.2f} {row['peak_mb']:>9.1f}")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+
+def run_embedding_benchmark(args):
+    import faiss
+
+    from src.code_table import load_code_table
+    from src.embeddings import SentenceEmbedder
+
+    table = load_code_table()
+    num_documents = min(args.num_documents or len(table), len(table))
+    descriptions = [table.description(idx) for idx in range(num_documents)]
+    queries = load_evidence_queries()
+
+    rows = []
+    reference = None
+    for backend in args.backends:
+        for num_workers in args.workers:
+            embedder = SentenceEmbedder(
+                args.model_name,
+                backend=backend,
+                batch_size=args.batch_size,
+                num_workers=num_workers,
+            )
+            start = time.perf_counter()
+            embedder.model
+            load_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            embeddings = embedder.encode_documents(descriptions)
+            build_s = time.perf_counter() - start
+
+            embedder.encode(queries[:1])
+            start = time.perf_counter()
+            query_embeddings = np.concatenate([embedder.encode([query]) for query in queries])
+            ms_per_query = (time.perf_counter() - start) * 1000 / len(queries)
+
+            # The first configuration (fp32 torch by default) is the reference for accuracy
+            index = faiss.IndexFlatL2(embeddings.shape[1])
+            index.add(embeddings)
+            _, indices = index.search(query_embeddings, args.k)
+            if reference is None:
+                reference = {"embeddings": embeddings, "indices": indices}
+            cosine = np.sum(embeddings * reference["embeddings"], axis=1) / (
+                np.linalg.norm(embeddings, axis=1) * np.linalg.norm(reference["embeddings"], axis=1)
+            )
+            rows.append(
+                {
+                    "backend": backend,
+                    "num_workers": num_workers,
+                    "load_s": load_s,
+                    "build_s": build_s,
+                    "docs_per_s": num_documents / build_s,
+                    "ms_per_query": ms_per_query,
+                    "mean_cosine": float(cosine.mean()),
+                    f"recall@{args.k}": recall_at_k(indices, reference["indices"]),
+                }
+            )
+
+    print(
+        f"{num_documents} documents, {len(queries)} queries, batch size {args.batch_size}, k={args.k}\n"
+    )
+    print(
+        f"{'backend':<8} {'workers':>7} {'load s':>7} {'build s':>8} {'docs/s':>8} "
+        f"{'ms/query':>9} {'cosine':>7} {'recall':>7}"
+    )
+    for row in rows:
+        print(
+            f"{row['backend']:<8} {row['num_workers']:>7} {row['load_s']:>7.2f} "
+            f"{row['build_s']:>8.2f} {row['docs_per_s']:>8.0f} {row['ms_per_query']:>9.2f} "
+            f"{row['mean_cosine']:>7.4f} {row[f'recall@{args.k}']:>7.3f}"
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(rows, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Performance benchmarks for the ICD-10 coder.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    index_parser = subparsers.add_parser(
+        "index", help="Recall@k vs. latency of approximate FAISS indexes against the flat index."
+    )
+    index_parser.add_argument("--k", type=int, default=10)
+    index_parser.add_argument("--cache-dir", default="retriever_cache")
+    index_parser.add_argument(
+        "--model-name", default="sentence-transformers/all-MiniLM-L6-v2"
+    )
+    index_parser.add_argument("--output", default="index_benchmark.json")
+    index_parser.set_defaults(func=run_index_benchmark)
+
+    pipeline_parser = subparsers.add_parser(
+        "pipeline",
+        help="End-to-end pipeline latency with recorded LLM responses (see LLM_BACKEND=record).",
+    )
+    pipeline_parser.add_argument("--record-dir", default="llm_recordings")
+    pipeline_parser.add_argument(
+        "--latency", type=float, default=0.0, help="Simulated seconds per LLM call."
+    )
+    pipeline_parser.add_argument("--repeat", type=int, default=1)
+    pipeline_parser.add_argument("--output", default="pipeline_benchmark.json")
+    pipeline_parser.set_defaults(func=run_pipeline_benchmark)
+
+    hierarchy_parser = subparsers.add_parser(
+        "hierarchy",
+        help="Runtime and peak memory of the tabular XML parsers.",
+    )
+    hierarchy_parser.add_argument("--xml-file", default="icd10cm_tabular_2025.xml")
+    hierarchy_parser.add_argument(
+        "--output-records", default="icd10_data_files/icd10_codes_with_metadata.jsonl"
+    )
+    hierarchy_parser.add_argument(
+        "--include-alternative",
+        action="store_true",
+        help="Also run alternative_parser, which revisits every code once per ancestor.",
+    )
+    hierarchy_parser.add_argument("--output", default="hierarchy_benchmark.json")
+    hierarchy_parser.set_defaults(func=run_hierarchy_benchmark)
+
+    embedding_parser = subparsers.add_parser(
+        "embeddings",
+        help="Index build time, query latency and accuracy of the embedding backends.",
+    )
+    embedding_parser.add_argument(
+        "--model-name", default="sentence-transformers/all-MiniLM-L6-v2"
+    )
+    embedding_parser.add_argument(
+        "--backends", nargs="+", default=["torch", "int8"], help="torch, int8 and/or onnx."
+    )
+    embedding_parser.add_argument(
+        "--workers", type=int, nargs="+", default=[0], help="Encoding processes to compare."
+    )
+    embedding_parser.add_argument("--batch-size", type=int, default=64)
+    embedding_parser.add_argument(
+        "--num-documents", type=int, help="Only embed the first N codes. Defaults to all."
+    )
+    embedding_parser.add_argument("--k", type=int, default=10)
+    embedding_parser.add_argument("--output", default="embedding_benchmark.json")
+    embedding_parser.set_defaults(func=run_embedding_benchmark)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+# Makes the `src` package importable from the tests without installing it
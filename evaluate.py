@@ -1,7 +1,7 @@
 import json
-import pandas as pd
 from pathlib import Path
 from typing import List, Set, Dict
+from src.code_table import load_code_table
 from src.validator import ICD10Validator
 
 
@@ -67,24 +67,31 @@ def analyze_predictions(validator: ICD10Validator) -> List[Dict]:
         output_only = output_codes - pred_codes
         common_codes = pred_codes.intersection(output_codes)
 
-        # Validate codes
+        # Validate codes, looking up all codes of a file in one call
+        pred_list, output_list = sorted(pred_codes), sorted(output_codes)
+        pred_lookup = validator.validate_many(pred_list)
+        output_lookup = validator.validate_many(output_list)
         invalid_pred_codes = {
-            code for code in pred_codes if not validator.check_code_validity(code)
+            code for code, is_valid in zip(pred_list, pred_lookup["is_valid"]) if not is_valid
         }
         invalid_output_codes = {
-            code for code in output_codes if not validator.check_code_validity(code)
+            code for code, is_valid in zip(output_list, output_lookup["is_valid"]) if not is_valid
         }
 
         # Check billable status for valid codes
         non_billable_pred = {
             code
-            for code in pred_codes - invalid_pred_codes
-            if not validator.check_code_billable(code)
+            for code, is_valid, is_billable in zip(
+                pred_list, pred_lookup["is_valid"], pred_lookup["is_billable"]
+            )
+            if is_valid and not is_billable
         }
         non_billable_output = {
             code
-            for code in output_codes - invalid_output_codes
-            if not validator.check_code_billable(code)
+            for code, is_valid, is_billable in zip(
+                output_list, output_lookup["is_valid"], output_lookup["is_billable"]
+            )
+            if is_valid and not is_billable
         }
 
         # Get details for mismatched codes
@@ -120,10 +127,7 @@ def analyze_predictions(validator: ICD10Validator) -> List[Dict]:
 
 def main():
     # Load ICD10 validator
-    icd10_data = pd.read_csv("icd10_data/icd10_all_codes.tsv", delimiter="\t")[
-        ["code", "description", "is_billable"]
-    ].to_dict(orient="records")
-    validator = ICD10Validator(icd10_data)
+    validator = ICD10Validator(load_code_table())
 
     # Run analysis
     results = analyze_predictions(validator)
@@ -1,50 +1,49 @@
+import asyncio
 import json
-import os
 from collections import defaultdict
 from .schemas import (
     ExplainedOutput,
 )
-from openai import OpenAI
+from .backends import DEFAULT_MODEL, OpenAIBackend
+from .fusion import fuse_results
+from .evidence import verify_evidence
+from .metrics import EVIDENCE_CHECKS, LLM_IN_FLIGHT, record_token_usage, timed
+from .prompts import build_prompt, dedupe_candidates, format_table
 from .utils import setup_loggers, write_json
 
-openai_api_key = os.getenv("OPENAI_API_KEY")
-
 
 logger = setup_loggers()
-client = OpenAI(api_key=openai_api_key)
 
 
-def openai_structured_output(
-    client: OpenAI,
-    system_instructions: str,
-    prompt: str,
-    response_format,
-    openai_params={},
-):
+async def run_stage_graph(stages):
     """
-    Generate structured output using OpenAI's chat API.
+    Run async stages as a dependency graph, starting each stage as soon as its dependencies finish.
 
     Args:
-        client (OpenAI): OpenAI client instance.
-        system_instructions (str): System-level instructions for the model.
-        prompt (str): User input to process.
-        response_format: Expected response format.
-        openai_params (dict): Additional OpenAI API parameters.
+        stages (dict): Maps stage name to a tuple of (dependency names, function). Each function
+            receives the dict of finished stage results and returns an awaitable.
 
     Returns:
-        dict: Parsed JSON output from the API response.
+        dict: Result of every stage, keyed by stage name.
     """
-    completion = client.beta.chat.completions.parse(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system_instructions},
-            {"role": "user", "content": prompt},
-        ],
-        response_format=response_format,
-        **openai_params,
-    )
-    output = json.loads(completion.choices[0].message.parsed.json())
-    return output
+    results = {}
+    tasks = {}
+
+    async def run_stage(name):
+        dependencies, stage_fn = stages[name]
+        await asyncio.gather(*(tasks[dependency] for dependency in dependencies))
+        results[name] = await stage_fn(results)
+
+    for name in stages:
+        tasks[name] = asyncio.ensure_future(run_stage(name))
+
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        raise
+    return results
 
 
 class Agent:
@@ -55,9 +54,16 @@ class Agent:
         role (str): The agent's role.
         responsibilities (str): Description of the agent's responsibilities.
         output_schema: Schema for the expected output.
-        client (OpenAI): OpenAI client instance.
+        client (OpenAI): OpenAI client instance, used when no backend is given.
         validator: Validator instance for checking ICD-10 codes.
         openai_parameters (dict): Parameters for OpenAI API calls.
+        model (str): Name of the OpenAI model.
+        backend (LLMBackend): Backend producing structured output. Defaults to an
+            OpenAIBackend wrapping `client`.
+        prompt_token_budget (int): Maximum prompt tokens. Lowest-ranked candidate codes are
+            trimmed to fit. Defaults to no limit.
+        evidence_mode (str): 'drop' or 'flag' codes whose evidence is not found in the note
+            (see verify_evidence), or None to skip the check.
     """
 
     def __init__(
@@ -68,6 +74,10 @@ class Agent:
         client,
         icd10_validator,
         openai_parameters={"max_tokens": 1024, "temperature": 0.1},
+        model=DEFAULT_MODEL,
+        backend=None,
+        prompt_token_budget=None,
+        evidence_mode=None,
     ):
         self.role = role
         self.responsibilities = responsibilities
@@ -78,10 +88,16 @@ class Agent:
         self.client = client
         self.validator = icd10_validator
         self.openai_parameters = openai_parameters
-
-    def process(self, input_data):
+        self.model = model
+        if backend is None:
+            backend = OpenAIBackend(client=client)
+        self.backend = backend
+        self.prompt_token_budget = prompt_token_budget
+        self.evidence_mode = evidence_mode
+
+    def build_prompt(self, input_data):
         """
-        Abstract method to process input data. Must be implemented by subclasses.
+        Abstract method to build the prompt for input data. Must be implemented by subclasses.
 
         Args:
             input_data: Input data for processing.
@@ -89,7 +105,76 @@ class Agent:
         Raises:
             NotImplementedError: If not implemented in a subclass.
         """
-        raise NotImplementedError("Each agent must implement the process method.")
+        raise NotImplementedError("Each agent must implement the build_prompt method.")
+
+    def render_prompt(self, instructions, sections, candidates=(), candidate_title=""):
+        """
+        Assemble a prompt within this agent's token budget.
+
+        Args:
+            instructions (str): Task instructions.
+            sections (list): (title, body) pairs of the prompt.
+            candidates (list, optional): Ranked candidate codes, trimmed first to fit the budget.
+            candidate_title (str): Title of the candidate section.
+
+        Returns:
+            str: Prompt for the model.
+        """
+        return build_prompt(
+            instructions,
+            sections,
+            candidates=candidates,
+            candidate_title=candidate_title,
+            token_budget=self.prompt_token_budget,
+            model=self.model,
+        )
+
+    @timed("process")
+    def process(self, input_data):
+        """
+        Process input data: build the prompt, query the model and validate the output.
+
+        Args:
+            input_data: Input data for processing, either a note or a dict containing a note.
+
+        Returns:
+            dict: Validated ICD-10 codes.
+        """
+        prompt = self.build_prompt(input_data)
+        structured_output = self.get_structured_output(prompt, self.output_schema)
+        return self.handle_output(input_data, structured_output)
+
+    @timed("process")
+    async def aprocess(self, input_data):
+        """
+        Async variant of `process`. Prompt building (which may retrieve candidate codes) and
+        output validation (which aligns evidence with the note) run in worker threads so
+        that they do not block the event loop.
+
+        Args:
+            input_data: Input data for processing, either a note or a dict containing a note.
+
+        Returns:
+            dict: Validated ICD-10 codes.
+        """
+        prompt = await asyncio.to_thread(self.build_prompt, input_data)
+        structured_output = await self.aget_structured_output(prompt, self.output_schema)
+        return await asyncio.to_thread(self.handle_output, input_data, structured_output)
+
+    def handle_output(self, input_data, structured_output):
+        """
+        Log and validate the structured output of the model.
+
+        Args:
+            input_data: Input data the output was generated from.
+            structured_output (dict): Output from the model.
+
+        Returns:
+            dict: Validated ICD-10 codes.
+        """
+        note = input_data if isinstance(input_data, str) else input_data["note"]
+        self.log(note, structured_output)
+        return self.validate_output(structured_output, note=note)
 
     def log(self, input_data, output_data):
         """
@@ -109,7 +194,7 @@ class Agent:
 
     def get_structured_output(self, prompt, response_format):
         """
-        Retrieve structured output from OpenAI API.
+        Retrieve structured output from the LLM backend.
 
         Args:
             prompt (str): Input prompt for the model.
@@ -118,35 +203,84 @@ class Agent:
         Returns:
             dict: Structured output.
         """
-        return openai_structured_output(
-            self.client,
-            self.system_instructions,
-            prompt,
-            response_format,
-            openai_params=self.openai_parameters,
-        )
+        with LLM_IN_FLIGHT.labels(role=self.role).track_inprogress():
+            return self.backend.structured_output(
+                self.system_instructions,
+                prompt,
+                response_format,
+                openai_params=self.openai_parameters,
+                model=self.model,
+                usage_callback=self.record_usage,
+            )
 
-    def validate_output(self, output):
+    async def aget_structured_output(self, prompt, response_format):
+        """
+        Retrieve structured output from the LLM backend without blocking the event loop.
+
+        Args:
+            prompt (str): Input prompt for the model.
+            response_format: Expected response format.
+
+        Returns:
+            dict: Structured output.
+        """
+        with LLM_IN_FLIGHT.labels(role=self.role).track_inprogress():
+            return await self.backend.astructured_output(
+                self.system_instructions,
+                prompt,
+                response_format,
+                openai_params=self.openai_parameters,
+                model=self.model,
+                usage_callback=self.record_usage,
+            )
+
+    def record_usage(self, prompt_tokens, completion_tokens):
+        """
+        Record the token usage of a completion made by this agent.
+
+        Args:
+            prompt_tokens (int): Number of prompt tokens.
+            completion_tokens (int): Number of completion tokens.
+        """
+        record_token_usage(self.role, prompt_tokens, completion_tokens)
+
+    @timed("validate_output")
+    def validate_output(self, output, note=None):
         """
         Validate ICD-10 codes in the output.
 
+        If a note is given and evidence_mode is set, the evidence of each code is first
+        located in the note, so that codes with unsupported evidence are dropped (or flagged)
+        before they reach later stages.
+
         Args:
             output (dict): Output containing ICD-10 codes.
+            note (str, optional): Note the codes were assigned to.
 
         Returns:
             dict: Validated ICD-10 codes with updated descriptions.
         """
         icd10_codes = output["icd10_codes"]
+        if note is not None and self.evidence_mode:
+            checked = verify_evidence(icd10_codes, note, mode=self.evidence_mode)
+            num_verified = sum(x["evidence_verified"] for x in checked)
+            EVIDENCE_CHECKS.labels(role=self.role, result="verified").inc(num_verified)
+            EVIDENCE_CHECKS.labels(role=self.role, result="unverified").inc(
+                len(icd10_codes) - num_verified
+            )
+            icd10_codes = checked
+        lookup = self.validator.validate_many([x["code"] for x in icd10_codes])
         validated_codes = []
-        for code_with_evidence in icd10_codes:
+        for code_with_evidence, is_valid, new_desc in zip(
+            icd10_codes, lookup["is_valid"], lookup["description"]
+        ):
             code = code_with_evidence["code"]
             description = code_with_evidence["description"]
-            if not self.validator.check_code_validity(code):
+            if not is_valid:
                 logger.info(
                     f"Code {code} with description '{description}' is not a valid ICD10-CM code. Dropping."
                 )
             else:
-                new_desc = self.validator.get_description(code)
                 old_desc = description
                 if new_desc != old_desc:
                     logger.debug(
@@ -163,22 +297,17 @@ class Coder(Agent):
     Agent responsible for assigning ICD-10 codes to clinical notes.
     """
 
-    def process(self, note):
+    def build_prompt(self, note):
         """
-        Assign ICD-10 codes to the given clinical note.
+        Build the prompt to assign ICD-10 codes to the given clinical note.
 
         Args:
             note (str): Clinical note to process.
 
         Returns:
-            dict: Validated ICD-10 codes with evidence and descriptions.
+            str: Prompt for the model.
         """
-        prompt = f"Assign as many ICD10-CM diagnosis codes as possible to this discharge summary. Include a minimal verbatim snippet from the note as evidence for each diagnosis code. Also return a description of each code. Return all output as a JSON with the specified format.\n\nClinical Note:\n{note}"
-
-        structured_output = self.get_structured_output(prompt, self.output_schema)
-        self.log(note, structured_output)
-        validated_output = self.validate_output(structured_output)
-        return validated_output
+        return f"Assign as many ICD10-CM diagnosis codes as possible to this discharge summary. Include a minimal verbatim snippet from the note as evidence for each diagnosis code. Also return a description of each code. Return all output as a JSON with the specified format.\n\nClinical Note:\n{note}"
 
 
 class ReviewerOrAdjustor(Agent):
@@ -187,7 +316,12 @@ class ReviewerOrAdjustor(Agent):
 
     Attributes:
         retriever: Instance to retrieve relevant codes or data from external sources.
-        num_candidates (int): Number of alternative codes to retrieve.
+        num_candidates (int): Number of alternative codes to retrieve per evidence snippet.
+        max_candidates (int): Maximum number of alternative codes after fusing the results
+            of all snippets, or None for no limit.
+        fusion (str): How results of different snippets are fused, 'rrf' or 'max_sim'.
+        max_suggestions (int): Maximum number of billable replacement codes suggested in
+            code_feedback for each invalid or non-billable code.
         reviewed_codes (list): List of reviewed ICD-10 codes.
     """
 
@@ -200,6 +334,13 @@ class ReviewerOrAdjustor(Agent):
         icd10_validator,
         num_candidates=10,
         openai_parameters={"max_tokens": 1024, "temperature": 0.1},
+        model=DEFAULT_MODEL,
+        backend=None,
+        prompt_token_budget=None,
+        evidence_mode=None,
+        max_candidates=None,
+        fusion="rrf",
+        max_suggestions=10,
     ):
         super().__init__(
             role,
@@ -208,41 +349,55 @@ class ReviewerOrAdjustor(Agent):
             client=client,
             icd10_validator=icd10_validator,
             openai_parameters=openai_parameters,
+            model=model,
+            backend=backend,
+            prompt_token_budget=prompt_token_budget,
+            evidence_mode=evidence_mode,
         )
         self.retriever = retriever
         self.num_candidates = num_candidates
+        self.max_candidates = max_candidates
+        self.fusion = fusion
+        self.max_suggestions = max_suggestions
         self.reviewed_codes = []
 
+    @timed("retrieve_codes")
     def retrieve_codes(self, code_list, k=None):
         """
         Retrieve relevant ICD-10 codes from the database.
 
+        The results for all evidence snippets are fused into a single ranked list with one
+        entry per code (see fuse_results), capped at max_candidates.
+
         Args:
             code_list (list): List of codes to retrieve related alternatives for.
-            k (int, optional): Number of alternatives to retrieve. Defaults to num_candidates.
+            k (int, optional): Number of alternatives to retrieve per snippet. Defaults to
+                num_candidates.
 
         Returns:
-            list: Retrieved alternative codes.
+            list: Retrieved alternative codes, best first.
         """
         if not k:
             k = self.num_candidates
-        related_codes = [
-            x
-            for code in code_list
-            for x in self.retriever.retrieve(
-                query=code["evidence"],
-                k=k,
-            )
-        ]
+        queries = [code["evidence"] for code in code_list]
+        results = self.retriever.retrieve_batch(queries, k=k)
+        related_codes = fuse_results(
+            results, method=self.fusion, limit=self.max_candidates
+        )
 
         logger.debug(f"Retrieved codes:\n{related_codes}")
 
         return related_codes
 
+    @timed("code_feedback")
     def code_feedback(self, codes):
         """
         Provide feedback on ICD-10 codes' validity and billability.
 
+        Non-billable codes are listed with the billable codes below them, and invalid codes
+        with the billable codes below their nearest valid prefix (e.g. E11.99 -> E11.9), so
+        the model can pick a concrete replacement.
+
         Args:
             codes (list): List of ICD-10 codes to validate.
 
@@ -251,56 +406,101 @@ class ReviewerOrAdjustor(Agent):
         """
         output = defaultdict(list)
         feedback = ""
-        for code in codes:
-            if not self.validator.check_code_validity(code):
+        lookup = self.validator.validate_many(codes)
+        for code, is_valid, is_billable, description in zip(
+            codes, lookup["is_valid"], lookup["is_billable"], lookup["description"]
+        ):
+            if not is_valid:
                 output["invalid"].append(code)
-            elif not self.validator.check_code_billable(code):
+            elif not is_billable:
                 output["not_billable"].append(code)
             else:
-                output["valid"].append(json.dumps(self.validator.get_all_data(code)))
+                output["valid"].append({"code": code, "description": description})
 
         if "invalid" in output:
-            invalid = output["invalid"]
+            invalid = ", ".join(output["invalid"])
             feedback += f"The following are not valid ICD-10 codes: {invalid}\n\n"
         if "not_billable" in output:
-            not_billable = output["not_billable"]
+            not_billable = ", ".join(output["not_billable"])
             feedback += f"The following ICD-10 codes are valid but not billable: {not_billable}\n\n"
+        suggestions = self.billable_suggestions(output["invalid"] + output["not_billable"])
+        if suggestions:
+            table = format_table(suggestions, ("replaces", "code", "description"))
+            feedback += f"Billable codes that could replace the invalid or non-billable codes:\n{table}\n\n"
         if "valid" in output:
-            valid = output["valid"]
-            joined_valid = "\n".join(valid)
-            feedback += f"Definitions of remaining ICD-10 codes that are both valid and billable:\n{joined_valid}\n"
+            valid = format_table(output["valid"], ("code", "description"))
+            feedback += f"Definitions of remaining ICD-10 codes that are both valid and billable:\n{valid}\n"
 
         return feedback
 
+    def billable_suggestions(self, codes):
+        """
+        Find billable replacements for invalid or non-billable codes.
+
+        Args:
+            codes (list): Invalid or non-billable ICD-10 codes.
+
+        Returns:
+            list: Records with the 'replaces', 'code' and 'description' of each suggested
+                billable code, at most max_suggestions per input code.
+        """
+        suggestions = []
+        for code in codes:
+            parent = code
+            if not self.validator.check_code_validity(code):
+                parent = self.validator.nearest_valid_prefix(code)
+                if parent is None:
+                    continue
+                if self.validator.check_code_billable(parent):
+                    suggestions.append({"replaces": code, "code": parent})
+                    continue
+            for descendant in self.validator.billable_descendants(
+                parent, limit=self.max_suggestions
+            ):
+                suggestions.append({"replaces": code, "code": descendant})
+
+        descriptions = self.validator.validate_many([x["code"] for x in suggestions])["description"]
+        for suggestion, description in zip(suggestions, descriptions):
+            suggestion["description"] = description
+        return suggestions
+
 
 class Reviewer(ReviewerOrAdjustor):
     """
     Agent responsible for reviewing ICD-10 codes and providing feedback.
     """
 
-    def process(self, data, k=10):
+    def build_prompt(self, data):
         """
-        Review and refine ICD-10 codes for a given note.
+        Build the prompt to review and refine ICD-10 codes for a given note.
 
         Args:
             data (dict): Input data containing a clinical note and codes from the Coder.
-            k (int): Number of alternative codes to retrieve. Defaults to 10.
 
         Returns:
-            dict: Validated ICD-10 codes with evidence and descriptions.
+            str: Prompt for the model, including retrieved alternative codes.
         """
         note = data["note"]
         codes_with_evidence = data["coder"]["icd10_codes"]
         code_list = [x["code"] for x in codes_with_evidence]
         code_lookup_feedback = self.code_feedback(code_list)
-        related_codes = self.retrieve_codes(codes_with_evidence, k=k)
-
-        prompt = f"Assign as many ICD10-CM diagnosis codes as possible to this discharge summary. Include a minimal verbatim snippet from the note as evidence for each diagnosis code. Also return a description of each code. Please only use billable codes.\n\nDischarge Summary:\n{note}\n\nCodes from Coder Agent:\n{json.dumps(codes_with_evidence, indent=2)}\n\nFeedback from ICD-10 database lookup of codes: {code_lookup_feedback}\n\nThe following are alternative ICD-10 codes that are related to the diagnoses and evidence presented here. You may consider if any would be a good replacement or addition to those already billed:\n{related_codes}"
+        related_codes = dedupe_candidates(
+            self.retrieve_codes(codes_with_evidence), exclude=code_list
+        )
 
-        structured_output = self.get_structured_output(prompt, self.output_schema)
-        self.log(note, structured_output)
-        validated_output = self.validate_output(structured_output)
-        return validated_output
+        return self.render_prompt(
+            "Assign as many ICD10-CM diagnosis codes as possible to this discharge summary. Include a minimal verbatim snippet from the note as evidence for each diagnosis code. Also return a description of each code. Please only use billable codes.",
+            [
+                ("Discharge Summary", note),
+                (
+                    "Codes from Coder Agent",
+                    format_table(codes_with_evidence, ("code", "description", "evidence")),
+                ),
+                ("Feedback from ICD-10 database lookup of codes", code_lookup_feedback),
+            ],
+            candidates=related_codes,
+            candidate_title="The following are alternative ICD-10 codes that are related to the diagnoses and evidence presented here, best match first. You may consider if any would be a good replacement or addition to those already billed",
+        )
 
 
 class PatientOrPhysician(Agent):
@@ -308,25 +508,31 @@ class PatientOrPhysician(Agent):
     Agent acting as a Patient or Physician to review assigned codes.
     """
 
-    def process(self, data):
+    def build_prompt(self, data):
         """
-        Review the assigned ICD-10 codes for correctness.
+        Build the prompt to review the assigned ICD-10 codes for correctness.
 
         Args:
             data (dict): Input data containing a clinical note and reviewer-assigned codes.
 
         Returns:
-            dict: Validated ICD-10 codes with feedback.
+            str: Prompt for the model.
         """
         note = data["note"]
         assigned_codes = data["reviewer"]["icd10_codes"]
 
-        prompt = f"Review the assigned ICD-10 codes to determine if they are correct or incorrect for the described visit. If incorrect, provide an explanation as to why. Return your answer as a JSON object containing the ICD-10 code, its description, evidence from the discharge summary to support that code, a recommendation to either 'include' or 'reject' the code, and an explanation of your reasoning.\n\nDischarge Summary:\n{note}\n\nReviewer Assigned Codes:\n{assigned_codes}"
-
-        structured_output = self.get_structured_output(prompt, self.output_schema)
-        self.log(note, structured_output)
-        validated_output = self.validate_output(structured_output)
-        return validated_output
+        return self.render_prompt(
+            "Review the assigned ICD-10 codes to determine if they are correct or incorrect for the described visit. If incorrect, provide an explanation as to why. Return your answer as a JSON object containing the ICD-10 code, its description, evidence from the discharge summary to support that code, a recommendation to either 'include' or 'reject' the code, and an explanation of your reasoning.",
+            [
+                ("Discharge Summary", note),
+                (
+                    "Reviewer Assigned Codes",
+                    format_table(
+                        assigned_codes, ("code", "description", "evidence", "explanation")
+                    ),
+                ),
+            ],
+        )
 
 
 class Adjustor(ReviewerOrAdjustor):
@@ -334,15 +540,15 @@ class Adjustor(ReviewerOrAdjustor):
     Agent responsible for final adjustments to ICD-10 codes after review by all parties.
     """
 
-    def process(self, data):
+    def build_prompt(self, data):
         """
-        Process and finalize ICD-10 codes based on inputs from all agents.
+        Build the prompt to finalize ICD-10 codes based on inputs from all agents.
 
         Args:
             data (dict): Input data containing notes and codes from all agents.
 
         Returns:
-            dict: Final validated ICD-10 codes.
+            str: Prompt for the model, including retrieved alternative codes.
         """
         note = data["note"]
         reviewer_codes = data["reviewer"]["icd10_codes"]
@@ -350,17 +556,32 @@ class Adjustor(ReviewerOrAdjustor):
         patient_codes = data["patient"]["icd10_codes"]
         all_codes = reviewer_codes + physician_codes + patient_codes
 
-        unique_codes = list(set([x["code"] for x in all_codes]))
+        # Keep first-seen order so that identical inputs produce identical prompts
+        unique_codes = list(dict.fromkeys(x["code"] for x in all_codes))
         code_lookup_feedback = self.code_feedback(unique_codes)
 
-        related_codes = self.retrieve_codes(all_codes)
-
-        prompt = f"Assign as many ICD10-CM diagnosis codes as possible to this discharge summary. Include a minimal verbatim snippet from the note as evidence for each diagnosis code. Also return a description of each code.\n\nDischarge Summary:\n{note}\n\nReviewed Codes:\n{reviewer_codes}\n\nPhysician comments on codes:\n{physician_codes}\n\nPatient comments on codes:\n{patient_codes}\n\nFeedback from database on codes from all parties:\n{code_lookup_feedback}\n\nThe following are alternative ICD-10 codes that are related to the diagnoses and evidence presented here. You may consider if any would be a good replacement or addition to those already billed:\n{related_codes}"
-
-        structured_output = self.get_structured_output(prompt, self.output_schema)
-        self.log(note, structured_output)
-        validated_output = self.validate_output(structured_output)
-        return validated_output
+        related_codes = dedupe_candidates(
+            self.retrieve_codes(all_codes), exclude=unique_codes
+        )
+        comment_columns = ("code", "recommendation", "explanation")
+
+        return self.render_prompt(
+            "Assign as many ICD10-CM diagnosis codes as possible to this discharge summary. Include a minimal verbatim snippet from the note as evidence for each diagnosis code. Also return a description of each code.",
+            [
+                ("Discharge Summary", note),
+                (
+                    "Reviewed Codes",
+                    format_table(
+                        reviewer_codes, ("code", "description", "evidence", "explanation")
+                    ),
+                ),
+                ("Physician comments on codes", format_table(physician_codes, comment_columns)),
+                ("Patient comments on codes", format_table(patient_codes, comment_columns)),
+                ("Feedback from database on codes from all parties", code_lookup_feedback),
+            ],
+            candidates=related_codes,
+            candidate_title="The following are alternative ICD-10 codes that are related to the diagnoses and evidence presented here, best match first. You may consider if any would be a good replacement or addition to those already billed",
+        )
 
     def postprocess(self, validated_output):
         """
@@ -378,9 +599,12 @@ class Adjustor(ReviewerOrAdjustor):
             code = code_obj["code"]
             evidence = code_obj["evidence"]
             description = code_obj["description"]
-            output["icd10_codes"].append(
-                {"code": code, "evidence": evidence, "description": description}
-            )
+            final_code = {"code": code, "evidence": evidence, "description": description}
+            # Evidence spans let a UI highlight the evidence in the note
+            for field in ("evidence_span", "evidence_verified"):
+                if field in code_obj:
+                    final_code[field] = code_obj[field]
+            output["icd10_codes"].append(final_code)
         return output
 
 
@@ -394,14 +618,57 @@ class NotesProcessor:
         physician (PatientOrPhysician): Physician agent instance.
         patient (PatientOrPhysician): Patient agent instance.
         adjustor (Adjustor): Adjustor agent instance.
+        hierarchy (ICD10Hierarchy): Optional hierarchy used to resolve Excludes1 conflicts
+            between the final codes.
+        conflict_mode (str): 'remove' or 'flag' Excludes1 conflicts (see
+            ICD10Hierarchy.resolve_conflicts).
+        result_cache (NoteResultCache): Optional cache of final results, checked before
+            running the agents.
     """
 
-    def __init__(self, coder, reviewer, physician, patient, adjustor):
+    def __init__(
+        self,
+        coder,
+        reviewer,
+        physician,
+        patient,
+        adjustor,
+        hierarchy=None,
+        conflict_mode="remove",
+        result_cache=None,
+    ):
         self.coder = coder
         self.reviewer = reviewer
         self.physician = physician
         self.patient = patient
         self.adjustor = adjustor
+        self.hierarchy = hierarchy
+        self.conflict_mode = conflict_mode
+        self.result_cache = result_cache
+
+    def finalize(self, adjustor_output):
+        """
+        Format the Adjustor output and resolve Excludes1 conflicts between its codes.
+
+        Args:
+            adjustor_output (dict): Validated output of the Adjustor.
+
+        Returns:
+            dict: Final ICD-10 codes.
+        """
+        final_output = self.adjustor.postprocess(adjustor_output)
+        if self.hierarchy is not None:
+            final_output = self.hierarchy.resolve_conflicts(final_output, self.conflict_mode)
+        return final_output
+
+    def cached_result(self, note):
+        if self.result_cache is None:
+            return None
+        return self.result_cache.get(note)
+
+    def cache_result(self, note, result):
+        if self.result_cache is not None:
+            self.result_cache.put(note, result)
 
     def process_note(self, note):
         """
@@ -413,6 +680,10 @@ class NotesProcessor:
         Returns:
             dict: Final ICD-10 codes from all stages.
         """
+        cached = self.cached_result(note)
+        if cached is not None:
+            return cached
+
         coder_output = self.coder.process(note)
         reviewer_output = self.reviewer.process({"note": note, "coder": coder_output})
         physician_output = self.physician.process(
@@ -430,5 +701,75 @@ class NotesProcessor:
                 "patient": patient_output,
             }
         )
-        final_output = self.adjustor.postprocess(adjustor_output)
-        return final_output
+        result = self.finalize(adjustor_output)
+        self.cache_result(note, result)
+        return result
+
+
+class AsyncNotesProcessor(NotesProcessor):
+    """
+    Async variant of NotesProcessor that runs the agent stages as a dependency graph.
+
+    The physician and patient reviews only depend on the reviewer output and run concurrently.
+    Retrieval of alternative codes for the reviewer's evidence runs alongside them, so that the
+    Adjustor's retrieval is served from the retriever cache once all reviews are in. Result
+    cache lookups and the final formatting run in worker threads.
+    """
+
+    async def process_note(self, note):
+        """
+        Process a clinical note through all agent stages.
+
+        Args:
+            note (str): Clinical note to process.
+
+        Returns:
+            dict: Final ICD-10 codes from all stages.
+        """
+        cached = await asyncio.to_thread(self.cached_result, note)
+        if cached is not None:
+            return cached
+
+        stages = {
+            "coder": ((), lambda results: self.coder.aprocess(note)),
+            "reviewer": (
+                ("coder",),
+                lambda results: self.reviewer.aprocess(
+                    {"note": note, "coder": results["coder"]}
+                ),
+            ),
+            "physician": (
+                ("reviewer",),
+                lambda results: self.physician.aprocess(
+                    {"note": note, "reviewer": results["reviewer"]}
+                ),
+            ),
+            "patient": (
+                ("reviewer",),
+                lambda results: self.patient.aprocess(
+                    {"note": note, "reviewer": results["reviewer"]}
+                ),
+            ),
+            "adjustor_retrieval": (
+                ("reviewer",),
+                lambda results: asyncio.to_thread(
+                    self.adjustor.retrieve_codes, results["reviewer"]["icd10_codes"]
+                ),
+            ),
+            "adjustor": (
+                ("coder", "reviewer", "physician", "patient", "adjustor_retrieval"),
+                lambda results: self.adjustor.aprocess(
+                    {
+                        "note": note,
+                        "coder": results["coder"],
+                        "reviewer": results["reviewer"],
+                        "physician": results["physician"],
+                        "patient": results["patient"],
+                    }
+                ),
+            ),
+        }
+        results = await run_stage_graph(stages)
+        result = await asyncio.to_thread(self.finalize, results["adjustor"])
+        await asyncio.to_thread(self.cache_result, note, result)
+        return result
@@ -1,66 +1,177 @@
+import time
+
+_import_start = time.perf_counter()
+
+import asyncio
+import json
 import os
-import pandas as pd
-from fastapi import FastAPI, HTTPException
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
+from prometheus_client import CONTENT_TYPE_LATEST
 from pydantic import BaseModel
-from openai import OpenAI
 
 from src.schemas import (
     CodeOutput,
     ExplainedOutputWithRecommendation,
 )
-from src.retrievers import FaissDocumentRetriever
-from src.agents import Coder, Reviewer, PatientOrPhysician, Adjustor, NotesProcessor
+from src.bm25 import BM25Index
+from src.code_table import load_code_table
+from src.hierarchy import ICD10Hierarchy
+from src.retrievers import FaissDocumentRetriever, HybridRetriever, current_cache_dir
+from src.result_cache import NoteResultCache, pipeline_fingerprint
+from src.scheduler import Overloaded, PriorityScheduler
+from src.agents import (
+    Coder,
+    Reviewer,
+    PatientOrPhysician,
+    Adjustor,
+    AsyncNotesProcessor,
+)
+from src.backends import make_backend
+from src.cache import SQLiteCache, hash_file
+from src.metrics import (
+    HTTP_IN_FLIGHT,
+    NOTE_LATENCY,
+    NOTES_PROCESSED,
+    STARTUP_SECONDS,
+    format_memory,
+    metrics_exposition,
+    record_process_memory,
+    startup_phase,
+    startup_summary,
+)
 from src.utils import setup_loggers, read_json, write_json
 from src.validator import ICD10Validator
 
-openai_api_key = os.getenv("OPENAI_API_KEY")
+STARTUP_SECONDS.labels(phase="imports").set(time.perf_counter() - _import_start)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Prompt building and retrieval run in this pool (via asyncio.to_thread), sized to the
+    # number of notes processed at a time rather than to the number of CPUs
+    executor = ThreadPoolExecutor(
+        max_workers=pipeline_threads, thread_name_prefix="pipeline"
+    )
+    asyncio.get_running_loop().set_default_executor(executor)
+    yield
+    executor.shutdown(wait=False, cancel_futures=True)
+
 
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
-setup_loggers()
+logger = setup_loggers()
 
 ### Setup ###
 # Helpers
-icd10_data = pd.read_csv("icd10_data/icd10_all_codes.tsv", delimiter="\t")[
-    ["code", "description", "is_billable"]
-].to_dict(orient="records")
-validator = ICD10Validator(icd10_data)
-
-cache_dir = "retriever_cache"
-files_to_check = [
-    os.path.join("retriever_cache", x)
-    for x in ["documents.json", "embeddings.npy", "index.faiss", "model_name.txt"]
-]
-if all(os.path.isfile(x) for x in files_to_check):
-    retriever = FaissDocumentRetriever.load(cache_dir)
-else:
-    model_name = "sentence-transformers/all-MiniLM-L6-v2"
-    retriever = FaissDocumentRetriever(documents=icd10_data, model_name=model_name)
-    retriever.save(save_dir=cache_dir)
+# Versioned caches (see src/update_index.py) load the version named in retriever_cache/CURRENT
+cache_dir = current_cache_dir("retriever_cache")
+index_type = os.getenv("RETRIEVER_INDEX_TYPE", "flat")
+index_params = json.loads(os.getenv("RETRIEVER_INDEX_PARAMS", "{}"))
+query_cache_size = int(os.getenv("RETRIEVER_CACHE_SIZE", "4096"))
+query_cache_ttl = float(os.getenv("RETRIEVER_CACHE_TTL", "0")) or None
+# Inference backend of the embedding model ('torch', 'int8' or 'onnx'). Defaults to the
+# backend the cached index was built with, or 'torch' when building a new index.
+embedding_backend = os.getenv("EMBEDDING_BACKEND") or None
+with startup_phase("retriever"):
+    if FaissDocumentRetriever.cache_exists(cache_dir):
+        retriever = FaissDocumentRetriever.load(
+            cache_dir,
+            cache_size=query_cache_size,
+            cache_ttl=query_cache_ttl,
+            embedding_backend=embedding_backend,
+        )
+        if FaissDocumentRetriever.is_legacy_cache(cache_dir):
+            retriever.save(save_dir=cache_dir)
+    else:
+        model_name = "sentence-transformers/all-MiniLM-L6-v2"
+        retriever = FaissDocumentRetriever(
+            documents=load_code_table(),
+            model_name=model_name,
+            index_type=index_type,
+            index_params=index_params,
+            cache_size=query_cache_size,
+            cache_ttl=query_cache_ttl,
+            embedding_backend=embedding_backend or "torch",
+            batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "64")),
+            num_workers=int(os.getenv("EMBEDDING_WORKERS", "0")),
+        )
+        retriever.save(save_dir=cache_dir)
+
+# The validator shares the retriever's (memory-mapped) code table
+validator = ICD10Validator(retriever.table)
+
+# 'hybrid' fuses the dense results with BM25 keyword matches over the same descriptions
+retriever_mode = os.getenv("RETRIEVER_MODE", "dense")
+if retriever_mode == "hybrid":
+    bm25_dir = os.path.join(cache_dir, "bm25")
+    with startup_phase("bm25"):
+        if BM25Index.exists(bm25_dir):
+            retriever = HybridRetriever(retriever, BM25Index.load(bm25_dir))
+        else:
+            retriever = HybridRetriever.from_dense(retriever)
+            retriever.sparse.save(bm25_dir)
+elif retriever_mode != "dense":
+    raise ValueError(f"Unknown RETRIEVER_MODE '{retriever_mode}'. Expected dense or hybrid.")
 
 # Initialize agents
 agent_definition_dict = read_json("agent_definitions.json")
-client = OpenAI(api_key=openai_api_key)
+# Persistent cache of model responses, disabled by setting LLM_CACHE_PATH to an empty string
+llm_cache_path = os.getenv("LLM_CACHE_PATH", "llm_cache/responses.sqlite")
+llm_cache_max_bytes = int(os.getenv("LLM_CACHE_MAX_BYTES", "0")) or None
+response_cache = None
+if llm_cache_path:
+    with startup_phase("llm_cache"):
+        response_cache = SQLiteCache(
+            llm_cache_path,
+            max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "100000")),
+            max_bytes=llm_cache_max_bytes,
+        )
+
+# LLM backend: 'openai' calls the API, 'record' also writes every response to
+# LLM_RECORD_DIR and 'replay' serves recorded responses offline
+backend = make_backend(
+    mode=os.getenv("LLM_BACKEND", "openai"),
+    record_dir=os.getenv("LLM_RECORD_DIR", "llm_recordings"),
+    latency=float(os.getenv("LLM_REPLAY_LATENCY", "0")),
+    cache=response_cache,
+)
+
+# Codes whose evidence snippet is not found in the note are kept with evidence_verified
+# set to false ('flag') or dropped ('drop'). An empty value disables the check.
+evidence_mode = os.getenv("EVIDENCE_MODE", "flag") or None
 
 # Coder
 coder_definition = agent_definition_dict["coder"]
 coder = Coder(
     role=coder_definition["role"],
     responsibilities=coder_definition["responsibilities"],
+    prompt_token_budget=coder_definition.get("prompt_token_budget"),
     output_schema=CodeOutput,
     icd10_validator=validator,
-    client=client,
+    client=None,
+    backend=backend,
+    evidence_mode=evidence_mode,
 )
 
 reviewer_definition = agent_definition_dict["reviewer"]
 reviewer = Reviewer(
     role=reviewer_definition["role"],
     responsibilities=reviewer_definition["responsibilities"],
+    prompt_token_budget=reviewer_definition.get("prompt_token_budget"),
     icd10_validator=validator,
-    client=client,
+    client=None,
+    backend=backend,
+    evidence_mode=evidence_mode,
     retriever=retriever,
     num_candidates=10,
+    max_candidates=reviewer_definition.get("max_candidates"),
+    fusion=reviewer_definition.get("fusion", "rrf"),
+    max_suggestions=reviewer_definition.get("max_suggestions", 10),
 )
 
 # Patient
@@ -68,9 +179,12 @@ patient_definition = agent_definition_dict["patient"]
 patient = PatientOrPhysician(
     role=patient_definition["role"],
     responsibilities=patient_definition["responsibilities"],
+    prompt_token_budget=patient_definition.get("prompt_token_budget"),
     output_schema=ExplainedOutputWithRecommendation,
     icd10_validator=validator,
-    client=client,
+    client=None,
+    backend=backend,
+    evidence_mode=evidence_mode,
 )
 
 # Physician
@@ -78,22 +192,114 @@ physician_definition = agent_definition_dict["physician"]
 physician = PatientOrPhysician(
     role=physician_definition["role"],
     responsibilities=physician_definition["responsibilities"],
+    prompt_token_budget=physician_definition.get("prompt_token_budget"),
     output_schema=ExplainedOutputWithRecommendation,
     icd10_validator=validator,
-    client=client,
+    client=None,
+    backend=backend,
+    evidence_mode=evidence_mode,
 )
 
 adjustor_definition = agent_definition_dict["adjustor"]
 adjustor = Adjustor(
     role=adjustor_definition["role"],
     responsibilities=adjustor_definition["responsibilities"],
+    prompt_token_budget=adjustor_definition.get("prompt_token_budget"),
     icd10_validator=validator,
-    client=client,
+    client=None,
+    backend=backend,
+    evidence_mode=evidence_mode,
     retriever=retriever,
     num_candidates=10,
+    max_candidates=adjustor_definition.get("max_candidates"),
+    fusion=adjustor_definition.get("fusion", "rrf"),
+    max_suggestions=adjustor_definition.get("max_suggestions", 10),
 )
 
-processor = NotesProcessor(coder, reviewer, patient, physician, adjustor)
+# Maximum number of notes from one batch request processed at the same time
+batch_concurrency = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+# Admission control: at most NOTE_CONCURRENCY notes are processed at a time, of which at
+# most BULK_CONCURRENCY come from the bulk lane, and each lane queues a bounded number of
+# waiting notes before requests are rejected with 429
+note_concurrency = int(os.getenv("NOTE_CONCURRENCY", "16"))
+scheduler = PriorityScheduler(
+    max_concurrency=note_concurrency,
+    max_bulk_concurrency=int(os.getenv("BULK_CONCURRENCY", "0")) or None,
+    max_queue=int(os.getenv("INTERACTIVE_QUEUE_SIZE", "64")),
+    max_bulk_queue=int(os.getenv("BULK_QUEUE_SIZE", "256")),
+)
+pipeline_threads = int(os.getenv("PIPELINE_THREADS", "0")) or 2 * note_concurrency
+
+# Excludes1 notes of the tabular XML, used to drop (or flag) mutually exclusive codes
+hierarchy_path = os.getenv(
+    "HIERARCHY_PATH", "icd10_data_files/icd10_codes_with_metadata.jsonl"
+)
+hierarchy = None
+if hierarchy_path and os.path.isfile(hierarchy_path):
+    with startup_phase("hierarchy"):
+        hierarchy = ICD10Hierarchy.load(hierarchy_path)
+
+excludes1_mode = os.getenv("EXCLUDES1_MODE", "remove")
+
+# Final results of processed notes, keyed by the normalized note. Entries are only reused
+# by the same agent definitions, model, code set, retriever, hierarchy and settings; the
+# on-disk store at NOTE_CACHE_PATH (disabled by default) is cleared when any of these change.
+note_cache_size = int(os.getenv("NOTE_CACHE_SIZE", "1024"))
+note_cache_path = os.getenv("NOTE_CACHE_PATH", "")
+result_cache = None
+if note_cache_size or note_cache_path:
+    with startup_phase("note_cache"):
+        dense_retriever = getattr(retriever, "dense", retriever)
+        result_cache = NoteResultCache(
+            pipeline_fingerprint(
+                agent_definition_dict,
+                coder.model,
+                validator.table.fingerprint(),
+                evidence_mode=evidence_mode,
+                retriever_mode=retriever_mode,
+                embedding_model=dense_retriever.model_name,
+                embedding_backend=dense_retriever.embedder.backend,
+                index_type=dense_retriever.index_type,
+                index_params=dense_retriever.index_params,
+                hierarchy=hash_file(hierarchy_path) if hierarchy is not None else None,
+                excludes1_mode=excludes1_mode if hierarchy is not None else None,
+            ),
+            maxsize=note_cache_size,
+            ttl=float(os.getenv("NOTE_CACHE_TTL", "0")) or None,
+            path=note_cache_path or None,
+            max_entries=int(os.getenv("NOTE_CACHE_MAX_ENTRIES", "100000")),
+        )
+
+processor = AsyncNotesProcessor(
+    coder=coder,
+    reviewer=reviewer,
+    physician=physician,
+    patient=patient,
+    adjustor=adjustor,
+    hierarchy=hierarchy,
+    conflict_mode=excludes1_mode,
+    result_cache=result_cache,
+)
+
+STARTUP_SECONDS.labels(phase="total").set(time.perf_counter() - _import_start)
+logger.info(
+    "Startup phases: "
+    + ", ".join(f"{phase} {seconds:.2f} s" for phase, seconds in startup_summary().items())
+)
+logger.info(f"Memory after startup: {format_memory(record_process_memory())}")
+
+
+def preload():
+    """
+    Loads everything that is otherwise loaded on first use, so that a server forking its
+    workers after calling this (see src/serve.py) shares these pages between them.
+    """
+    with startup_phase("preload"):
+        # The embedding model is otherwise built when the first query is embedded
+        getattr(retriever, "dense", retriever).model
+        # Builds the sorted code array used by validator lookups
+        validator.table.sorted_codes()
 
 
 # Request body model
@@ -101,19 +307,225 @@ class NoteInput(BaseModel):
     note: str
 
 
+async def process_note(note, priority="interactive", reserved=False):
+    """
+    Process a note through the agent pipeline once the scheduler admits it, recording its
+    latency and outcome.
+
+    Args:
+        note (str): Clinical note to process.
+        priority (str): Scheduler lane, 'interactive' or 'bulk'.
+        reserved (bool): The note belongs to a batch that reserved queue slots, so it is
+            not rejected when the lane's queue is full.
+
+    Returns:
+        dict: Final ICD-10 codes.
+
+    Raises:
+        Overloaded: If the note is not reserved and the lane's queue is full.
+    """
+
+    async def run():
+        with NOTE_LATENCY.time():
+            return await processor.process_note(note)
+
+    try:
+        result = await scheduler.run(run, lane=priority, reserved=reserved)
+    except Overloaded:
+        raise
+    except Exception:
+        NOTES_PROCESSED.labels(status="error").inc()
+        raise
+    NOTES_PROCESSED.labels(status="success").inc()
+    return result
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Endpoint exposing latency, token and throughput metrics in Prometheus text format.
+
+    Returns:
+        Response: Prometheus exposition of all registered metrics.
+    """
+    record_process_memory()
+    return Response(metrics_exposition(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/cache_stats")
+async def cache_stats_endpoint():
+    """
+    Endpoint reporting hit rates and sizes of the note result, LLM response and retriever
+    caches.
+
+    Returns:
+        dict: Cache statistics.
+    """
+    return {
+        "note_results": result_cache.stats() if result_cache else None,
+        "llm_responses": response_cache.stats() if response_cache else None,
+        "retriever": retriever.cache_info(),
+    }
+
+
+@app.get("/queue_stats")
+async def queue_stats_endpoint():
+    """
+    Endpoint reporting the running and queued notes of each priority lane.
+
+    Returns:
+        dict: Scheduler statistics per lane.
+    """
+    return scheduler.stats()
+
+
+def overloaded_response(error: Overloaded):
+    return HTTPException(
+        status_code=429,
+        detail=str(error),
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
 @app.post("/process_note")
-async def process_note_endpoint(input_data: NoteInput):
+async def process_note_endpoint(input_data: NoteInput, priority: str = "interactive"):
     """
     Endpoint to process a clinical note and return ICD-10 codes.
 
     Args:
         input_data (NoteInput): Input data containing the note.
+        priority (str): Scheduler lane, 'interactive' (default) or 'bulk'.
 
     Returns:
         dict: Final ICD-10 codes and related data.
     """
+    with HTTP_IN_FLIGHT.labels(endpoint="/process_note").track_inprogress():
+        try:
+            scheduler.check_lane(priority)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        try:
+            result = await process_note(input_data.note, priority=priority)
+            return result
+        except Overloaded as e:
+            raise overloaded_response(e)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+def parse_batch_notes(body: bytes, content_type: str):
+    """
+    Parse the notes of a batch request.
+
+    Accepts a JSON list (or an object with a "notes" list) or a JSONL upload with one
+    record per line. Each record is either a note string or an object with a "note"
+    field and an optional "id".
+
+    Args:
+        body (bytes): Raw request body.
+        content_type (str): Content type of the request.
+
+    Returns:
+        list: Records with "id" and "note" fields.
+    """
+    text = body.decode("utf-8")
+    if "ndjson" in content_type or "jsonl" in content_type:
+        records = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        records = json.loads(text)
+        if isinstance(records, dict):
+            records = records["notes"]
+
+    notes = []
+    for index, record in enumerate(records):
+        if isinstance(record, str):
+            record = {"note": record}
+        notes.append({"id": record.get("id", index), "note": record["note"]})
+    return notes
+
+
+async def stream_batch_results(notes, reservation):
+    """
+    Process notes concurrently and yield each result as an NDJSON line as soon as it completes.
+
+    Args:
+        notes (list): Records with "id" and "note" fields.
+        reservation (Reservation): Queue slots reserved in the notes' lane, which bound the
+            number of notes processed at the same time. Released when the stream ends.
+
+    Yields:
+        str: One JSON line per note with either a "result" or an "error" field.
+    """
+    semaphore = asyncio.Semaphore(reservation.slots)
+
+    async def process(index, record):
+        async with semaphore:
+            line = {"index": index, "id": record["id"]}
+            try:
+                line["result"] = await process_note(
+                    record["note"], priority=reservation.lane, reserved=True
+                )
+            except Exception as e:
+                logger.exception(f"Failed to process note {record['id']}")
+                line["error"] = str(e)
+            return line
+
+    in_flight = HTTP_IN_FLIGHT.labels(endpoint="/process_notes")
+    in_flight.inc()
+    tasks = [
+        asyncio.ensure_future(process(index, record))
+        for index, record in enumerate(notes)
+    ]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield json.dumps(await next_result) + "\n"
+    finally:
+        # Stop outstanding work if the client disconnects
+        for task in tasks:
+            task.cancel()
+        reservation.release()
+        in_flight.dec()
+
+
+@app.post("/process_notes")
+async def process_notes_endpoint(
+    request: Request, concurrency: int = None, priority: str = "bulk"
+):
+    """
+    Endpoint to process a batch of clinical notes, streaming results back as NDJSON.
+
+    Results are returned in completion order. Each line contains the note's "index" in
+    the request and its "id", plus either the final ICD-10 codes under "result" or the
+    error message under "error".
+
+    Args:
+        request (Request): JSON list of notes or JSONL upload.
+        concurrency (int, optional): Maximum number of notes processed at the same time,
+            capped at the configured BATCH_CONCURRENCY and at the free queue slots of the
+            lane, which the batch reserves.
+        priority (str): Scheduler lane, 'bulk' (default) or 'interactive'.
+
+    Returns:
+        StreamingResponse: NDJSON stream of per-note results.
+    """
     try:
-        result = processor.process_note(input_data.note)
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        notes = parse_batch_notes(
+            await request.body(), request.headers.get("content-type", "")
+        )
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch request: {e}")
+
+    limit = min(concurrency or batch_concurrency, batch_concurrency, len(notes))
+    try:
+        reservation = scheduler.reserve(priority, max(limit, 1))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Overloaded as e:
+        raise overloaded_response(e)
+
+    return StreamingResponse(
+        stream_batch_results(notes, reservation),
+        media_type="application/x-ndjson",
+        # Also releases the reservation if the client disconnects before the stream starts
+        background=BackgroundTask(reservation.release),
+    )
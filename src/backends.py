@@ -0,0 +1,470 @@
+import asyncio
+import json
+import os
+import random
+import time
+
+from .cache import hash_key
+
+DEFAULT_MODEL = "gpt-4o"
+
+
+def response_cache_key(
+    model, system_instructions, prompt, response_format, openai_params
+) -> str:
+    """
+    Build the content-addressed cache key of an OpenAI structured output request.
+
+    Args:
+        model (str): Name of the OpenAI model.
+        system_instructions (str): System-level instructions for the model.
+        prompt (str): User input to process.
+        response_format: Expected response format.
+        openai_params (dict): Additional OpenAI API parameters.
+
+    Returns:
+        str: Hash of all inputs that determine the response.
+    """
+    return hash_key(
+        model,
+        system_instructions,
+        prompt,
+        response_format.model_json_schema(),
+        openai_params,
+    )
+
+
+def openai_structured_output(
+    client,
+    system_instructions: str,
+    prompt: str,
+    response_format,
+    openai_params={},
+    model=DEFAULT_MODEL,
+    cache=None,
+    usage_callback=None,
+):
+    """
+    Generate structured output using OpenAI's chat API.
+
+    Args:
+        client (OpenAI): OpenAI client instance.
+        system_instructions (str): System-level instructions for the model.
+        prompt (str): User input to process.
+        response_format: Expected response format.
+        openai_params (dict): Additional OpenAI API parameters.
+        model (str): Name of the OpenAI model.
+        cache (SQLiteCache, optional): Response cache checked before calling the API.
+        usage_callback (callable, optional): Called with the prompt and completion token
+            counts of the completion. Not called for cached responses.
+
+    Returns:
+        dict: Parsed JSON output from the API response.
+    """
+    if cache is not None:
+        key = response_cache_key(
+            model, system_instructions, prompt, response_format, openai_params
+        )
+        output = cache.get(key)
+        if output is not None:
+            return output
+
+    completion = client.beta.chat.completions.parse(
+        model=model,
+        messages=[
+            {"role": "system", "content": system_instructions},
+            {"role": "user", "content": prompt},
+        ],
+        response_format=response_format,
+        **openai_params,
+    )
+    output = json.loads(completion.choices[0].message.parsed.json())
+    if usage_callback is not None and completion.usage is not None:
+        usage_callback(completion.usage.prompt_tokens, completion.usage.completion_tokens)
+    if cache is not None:
+        cache.put(key, output)
+    return output
+
+
+async def async_openai_structured_output(
+    client,
+    system_instructions: str,
+    prompt: str,
+    response_format,
+    openai_params={},
+    model=DEFAULT_MODEL,
+    cache=None,
+    usage_callback=None,
+):
+    """
+    Generate structured output using OpenAI's chat API without blocking the event loop.
+
+    Args:
+        client (AsyncOpenAI): Async OpenAI client instance.
+        system_instructions (str): System-level instructions for the model.
+        prompt (str): User input to process.
+        response_format: Expected response format.
+        openai_params (dict): Additional OpenAI API parameters.
+        model (str): Name of the OpenAI model.
+        cache (SQLiteCache, optional): Response cache checked before calling the API.
+        usage_callback (callable, optional): Called with the prompt and completion token
+            counts of the completion. Not called for cached responses.
+
+    Returns:
+        dict: Parsed JSON output from the API response.
+    """
+    if cache is not None:
+        key = response_cache_key(
+            model, system_instructions, prompt, response_format, openai_params
+        )
+        # SQLite reads and writes block, and can wait on the locks of other processes
+        output = await asyncio.to_thread(cache.get, key)
+        if output is not None:
+            return output
+
+    completion = await client.beta.chat.completions.parse(
+        model=model,
+        messages=[
+            {"role": "system", "content": system_instructions},
+            {"role": "user", "content": prompt},
+        ],
+        response_format=response_format,
+        **openai_params,
+    )
+    output = json.loads(completion.choices[0].message.parsed.json())
+    if usage_callback is not None and completion.usage is not None:
+        usage_callback(completion.usage.prompt_tokens, completion.usage.completion_tokens)
+    if cache is not None:
+        await asyncio.to_thread(cache.put, key, output)
+    return output
+
+
+class LLMBackend:
+    """
+    Interface for generating structured output from a language model.
+
+    Agents call `structured_output` (or `astructured_output` from async code), so the model
+    provider can be swapped, e.g. for offline record/replay benchmarking.
+    """
+
+    def structured_output(
+        self,
+        system_instructions,
+        prompt,
+        response_format,
+        openai_params={},
+        model=DEFAULT_MODEL,
+        usage_callback=None,
+    ):
+        """
+        Generate structured output for a prompt.
+
+        Args:
+            system_instructions (str): System-level instructions for the model.
+            prompt (str): User input to process.
+            response_format: Expected response format.
+            openai_params (dict): Additional model parameters.
+            model (str): Name of the model.
+            usage_callback (callable, optional): Called with the prompt and completion token
+                counts when the model reports them.
+
+        Returns:
+            dict: Parsed JSON output.
+        """
+        raise NotImplementedError("Each backend must implement structured_output.")
+
+    async def astructured_output(
+        self,
+        system_instructions,
+        prompt,
+        response_format,
+        openai_params={},
+        model=DEFAULT_MODEL,
+        usage_callback=None,
+    ):
+        """
+        Async variant of `structured_output`. Runs the sync method in a worker thread unless
+        overridden.
+        """
+        return await asyncio.to_thread(
+            self.structured_output,
+            system_instructions,
+            prompt,
+            response_format,
+            openai_params,
+            model,
+            usage_callback,
+        )
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    Backend calling OpenAI's chat API, optionally through a response cache.
+
+    Clients are created on first use, so constructing the backend does not require an API key.
+
+    Attributes:
+        api_key (str): OpenAI API key. Defaults to the OPENAI_API_KEY environment variable.
+        cache (SQLiteCache): Optional cache of model responses.
+    """
+
+    def __init__(self, api_key=None, client=None, async_client=None, cache=None):
+        self.api_key = api_key
+        self._client = client
+        self._async_client = async_client
+        self.cache = cache
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+
+            self._client = OpenAI(api_key=self.api_key or os.getenv("OPENAI_API_KEY"))
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            from openai import AsyncOpenAI
+
+            self._async_client = AsyncOpenAI(
+                api_key=self.api_key or os.getenv("OPENAI_API_KEY")
+            )
+        return self._async_client
+
+    def structured_output(
+        self,
+        system_instructions,
+        prompt,
+        response_format,
+        openai_params={},
+        model=DEFAULT_MODEL,
+        usage_callback=None,
+    ):
+        return openai_structured_output(
+            self.client,
+            system_instructions,
+            prompt,
+            response_format,
+            openai_params=openai_params,
+            model=model,
+            cache=self.cache,
+            usage_callback=usage_callback,
+        )
+
+    async def astructured_output(
+        self,
+        system_instructions,
+        prompt,
+        response_format,
+        openai_params={},
+        model=DEFAULT_MODEL,
+        usage_callback=None,
+    ):
+        return await async_openai_structured_output(
+            self.async_client,
+            system_instructions,
+            prompt,
+            response_format,
+            openai_params=openai_params,
+            model=model,
+            cache=self.cache,
+            usage_callback=usage_callback,
+        )
+
+
+def capture_usage(usage, usage_callback=None):
+    """
+    Build a usage callback that stores the token counts in `usage` and forwards them.
+
+    Args:
+        usage (dict): Dict receiving 'prompt_tokens' and 'completion_tokens'.
+        usage_callback (callable, optional): Callback to forward the token counts to.
+
+    Returns:
+        callable: The usage callback.
+    """
+
+    def callback(prompt_tokens, completion_tokens):
+        usage["prompt_tokens"] = prompt_tokens
+        usage["completion_tokens"] = completion_tokens
+        if usage_callback is not None:
+            usage_callback(prompt_tokens, completion_tokens)
+
+    return callback
+
+
+class RecordingBackend(LLMBackend):
+    """
+    Backend that forwards requests to another backend and writes every response to disk.
+
+    Each response is stored as `<record_dir>/<request key>.json`, where the key is the same
+    content hash used by the response cache, so a ReplayBackend can serve it later.
+
+    Attributes:
+        backend (LLMBackend): Backend that produces the responses.
+        record_dir (str): Directory the responses are written to.
+    """
+
+    def __init__(self, backend, record_dir):
+        self.backend = backend
+        self.record_dir = record_dir
+        os.makedirs(record_dir, exist_ok=True)
+
+    def record(
+        self, system_instructions, prompt, response_format, openai_params, model, output, usage
+    ):
+        key = response_cache_key(
+            model, system_instructions, prompt, response_format, openai_params
+        )
+        record = {
+            "model": model,
+            "system_instructions": system_instructions,
+            "prompt": prompt,
+            "openai_params": openai_params,
+            "output": output,
+            "usage": usage,
+        }
+        path = os.path.join(self.record_dir, f"{key}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
+
+    def structured_output(
+        self,
+        system_instructions,
+        prompt,
+        response_format,
+        openai_params={},
+        model=DEFAULT_MODEL,
+        usage_callback=None,
+    ):
+        usage = {}
+        output = self.backend.structured_output(
+            system_instructions,
+            prompt,
+            response_format,
+            openai_params,
+            model,
+            capture_usage(usage, usage_callback),
+        )
+        self.record(
+            system_instructions, prompt, response_format, openai_params, model, output, usage
+        )
+        return output
+
+    async def astructured_output(
+        self,
+        system_instructions,
+        prompt,
+        response_format,
+        openai_params={},
+        model=DEFAULT_MODEL,
+        usage_callback=None,
+    ):
+        usage = {}
+        output = await self.backend.astructured_output(
+            system_instructions,
+            prompt,
+            response_format,
+            openai_params,
+            model,
+            capture_usage(usage, usage_callback),
+        )
+        self.record(
+            system_instructions, prompt, response_format, openai_params, model, output, usage
+        )
+        return output
+
+
+class ReplayBackend(LLMBackend):
+    """
+    Backend serving responses recorded by a RecordingBackend, without network access.
+
+    Attributes:
+        record_dir (str): Directory containing the recorded responses.
+        latency (float): Simulated seconds per call.
+        latency_jitter (float): Maximum random seconds added to the simulated latency.
+    """
+
+    def __init__(self, record_dir, latency=0.0, latency_jitter=0.0):
+        self.record_dir = record_dir
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+
+    def simulated_latency(self):
+        return self.latency + random.uniform(0, self.latency_jitter)
+
+    def load(
+        self, system_instructions, prompt, response_format, openai_params, model, usage_callback
+    ):
+        key = response_cache_key(
+            model, system_instructions, prompt, response_format, openai_params
+        )
+        path = os.path.join(self.record_dir, f"{key}.json")
+        if not os.path.isfile(path):
+            raise KeyError(f"No recorded response for request {key} in {self.record_dir}")
+        with open(path, "r") as f:
+            record = json.load(f)
+
+        # Replay the recorded token counts so that usage metrics can be benchmarked offline
+        usage = record.get("usage")
+        if usage_callback is not None and usage:
+            usage_callback(usage["prompt_tokens"], usage["completion_tokens"])
+        return record["output"]
+
+    def structured_output(
+        self,
+        system_instructions,
+        prompt,
+        response_format,
+        openai_params={},
+        model=DEFAULT_MODEL,
+        usage_callback=None,
+    ):
+        delay = self.simulated_latency()
+        if delay:
+            time.sleep(delay)
+        return self.load(
+            system_instructions, prompt, response_format, openai_params, model, usage_callback
+        )
+
+    async def astructured_output(
+        self,
+        system_instructions,
+        prompt,
+        response_format,
+        openai_params={},
+        model=DEFAULT_MODEL,
+        usage_callback=None,
+    ):
+        delay = self.simulated_latency()
+        if delay:
+            await asyncio.sleep(delay)
+        return self.load(
+            system_instructions, prompt, response_format, openai_params, model, usage_callback
+        )
+
+
+def make_backend(mode="openai", record_dir="llm_recordings", latency=0.0, cache=None):
+    """
+    Build an LLM backend for the given mode.
+
+    Args:
+        mode (str): 'openai' to call the API, 'record' to call the API and write responses
+            to `record_dir`, or 'replay' to serve recorded responses offline.
+        record_dir (str): Directory of recorded responses.
+        latency (float): Simulated seconds per call in replay mode.
+        cache (SQLiteCache, optional): Response cache used when calling the API.
+
+    Returns:
+        LLMBackend: The backend.
+    """
+    if mode == "openai":
+        return OpenAIBackend(cache=cache)
+    if mode == "record":
+        return RecordingBackend(OpenAIBackend(cache=cache), record_dir)
+    if mode == "replay":
+        return ReplayBackend(record_dir, latency=latency)
+    raise ValueError(f"Unknown LLM backend mode '{mode}'. Expected openai, record or replay.")
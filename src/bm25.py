@@ -0,0 +1,218 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import List
+
+import numpy as np
+
+BM25_FORMAT_VERSION = 1
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits a text into lowercase alphanumeric terms.
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index stored as compressed sparse rows.
+
+    The postings of term `t` are `doc_ids[indptr[t]:indptr[t + 1]]`, sorted by document,
+    with the matching precomputed BM25 term weights in `impacts`. Scoring a query only
+    sums the impacts of its terms' postings, so no document statistics are needed at
+    query time. Arrays are saved as `.npy` files and can be memory-mapped.
+
+    Attributes:
+        terms (Dict[str, int]): Term id of each vocabulary term.
+        indptr (np.ndarray): Start offset of the postings of each term, plus the end offset.
+        doc_ids (np.ndarray): Document ids of all postings.
+        impacts (np.ndarray): BM25 weight of the term in the document, for every posting.
+        num_documents (int): Number of indexed documents.
+        k1 (float): Term frequency saturation parameter.
+        b (float): Document length normalization parameter.
+    """
+
+    files = {
+        "indptr": "indptr.npy",
+        "doc_ids": "doc_ids.npy",
+        "impacts": "impacts.npy",
+    }
+
+    def __init__(self, terms, indptr, doc_ids, impacts, num_documents, k1=1.5, b=0.75):
+        self.terms = terms
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.impacts = impacts
+        self.num_documents = num_documents
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def build(cls, texts: List[str], k1: float = 1.5, b: float = 0.75):
+        """
+        Builds the index over a list of documents.
+
+        Args:
+            texts (List[str]): Document texts, indexed by position.
+            k1 (float): Term frequency saturation parameter.
+            b (float): Document length normalization parameter.
+
+        Returns:
+            BM25Index: The index.
+        """
+        term_counts = [Counter(tokenize(text)) for text in texts]
+        lengths = np.array([sum(counts.values()) for counts in term_counts], dtype=np.float32)
+        avg_length = float(lengths.mean()) if len(lengths) and lengths.mean() > 0 else 1.0
+
+        postings = {}
+        for doc_id, counts in enumerate(term_counts):
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        terms = {term: term_id for term_id, term in enumerate(sorted(postings))}
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(postings[term]) for term in terms], out=indptr[1:])
+        doc_ids = np.empty(indptr[-1], dtype=np.int32)
+        impacts = np.empty(indptr[-1], dtype=np.float32)
+
+        num_documents = len(texts)
+        for term, term_id in terms.items():
+            term_postings = np.array(postings[term], dtype=np.int64)
+            ids, tf = term_postings[:, 0], term_postings[:, 1].astype(np.float32)
+            df = len(ids)
+            idf = math.log(1 + (num_documents - df + 0.5) / (df + 0.5))
+            norm = k1 * (1 - b + b * lengths[ids] / avg_length)
+            start, end = indptr[term_id], indptr[term_id + 1]
+            doc_ids[start:end] = ids
+            impacts[start:end] = idf * tf * (k1 + 1) / (tf + norm)
+
+        return cls(terms, indptr, doc_ids, impacts, num_documents, k1=k1, b=b)
+
+    def search(self, query: str, k: int = 10, common_df: float = 0.05):
+        """
+        Finds the k documents with the highest BM25 score for a query.
+
+        Documents are gathered from the postings of the query's rare terms, then rescored
+        with the impacts of its common terms (those in more than `common_df` of all
+        documents), found by binary search in their doc-sorted postings. This keeps lookups
+        proportional to the rare postings rather than to the corpus. Documents matching only
+        common terms are considered only if the query has no rare term.
+
+        Args:
+            query (str): Query text.
+            k (int): Number of documents to return.
+            common_df (float): Document frequency, as a fraction of all documents, above
+                which a term is only used to rescore candidates.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Scores and document ids, best first. Fewer than k
+                documents are returned if fewer match.
+        """
+        query_terms = Counter(
+            self.terms[term] for term in tokenize(query) if term in self.terms
+        )
+        if not query_terms:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        rare, common = [], []
+        max_df = common_df * self.num_documents
+        for term_id, count in query_terms.items():
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            (common if end - start > max_df else rare).append((start, end, count))
+        if not rare:
+            rare, common = common, []
+
+        # Sum the impacts of the rare terms for each matched document
+        ids = np.concatenate([self.doc_ids[start:end] for start, end, _ in rare])
+        weights = np.concatenate(
+            [self.impacts[start:end] * count for start, end, count in rare]
+        )
+        if len(ids) * 8 < self.num_documents:
+            candidates, positions = np.unique(ids, return_inverse=True)
+            scores = np.bincount(positions, weights=weights)
+        else:
+            # Sorting many postings is slower than accumulating into a dense score array
+            scores = np.bincount(ids, weights=weights, minlength=self.num_documents)
+            candidates = np.flatnonzero(scores)
+            scores = scores[candidates]
+
+        for start, end, count in common:
+            postings = self.doc_ids[start:end]
+            found = np.minimum(np.searchsorted(postings, candidates), len(postings) - 1)
+            hit = postings[found] == candidates
+            scores[hit] += self.impacts[start:end][found[hit]] * count
+
+        if len(candidates) > k:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(candidates))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return scores[top].astype(np.float32), candidates[top].astype(np.int64)
+
+    def save(self, save_dir: str):
+        """
+        Saves the postings arrays as `.npy` files and the vocabulary and parameters as
+        bm25.json in the given directory.
+
+        Args:
+            save_dir (str): Directory to write the index to.
+        """
+        os.makedirs(save_dir, exist_ok=True)
+        for attr, filename in self.files.items():
+            np.save(os.path.join(save_dir, filename), getattr(self, attr))
+
+        # Terms are listed in term id order. Written last so a partial index is never loaded.
+        with open(os.path.join(save_dir, "bm25.json"), "w") as f:
+            json.dump(
+                {
+                    "format_version": BM25_FORMAT_VERSION,
+                    "num_documents": self.num_documents,
+                    "k1": self.k1,
+                    "b": self.b,
+                    "terms": sorted(self.terms, key=self.terms.get),
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, save_dir: str, mmap: bool = True):
+        """
+        Loads an index saved with `save`.
+
+        Args:
+            save_dir (str): Directory containing the index.
+            mmap (bool): Memory-map the postings arrays instead of reading them into memory.
+
+        Returns:
+            BM25Index: The loaded index.
+        """
+        with open(os.path.join(save_dir, "bm25.json"), "r") as f:
+            metadata = json.load(f)
+        if metadata["format_version"] != BM25_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported BM25 index format version {metadata['format_version']} in {save_dir}"
+            )
+
+        mmap_mode = "r" if mmap else None
+        arrays = {
+            attr: np.load(os.path.join(save_dir, filename), mmap_mode=mmap_mode)
+            for attr, filename in cls.files.items()
+        }
+        terms = {term: term_id for term_id, term in enumerate(metadata["terms"])}
+        return cls(
+            terms,
+            num_documents=metadata["num_documents"],
+            k1=metadata["k1"],
+            b=metadata["b"],
+            **arrays,
+        )
+
+    @staticmethod
+    def exists(save_dir: str) -> bool:
+        return os.path.isfile(os.path.join(save_dir, "bm25.json"))
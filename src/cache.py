@@ -0,0 +1,336 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe, bounded least-recently-used cache with optional time-to-live.
+
+    Attributes:
+        maxsize (int): Maximum number of entries kept before the least recently used is evicted.
+        ttl (float): Seconds after which an entry expires, or None to never expire.
+        hits (int): Number of successful lookups.
+        misses (int): Number of lookups that found no live entry.
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Looks up a key, marking it as most recently used.
+
+        Args:
+            key: Hashable cache key.
+            default: Value returned when the key is missing or expired.
+
+        Returns:
+            The cached value, or `default`.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """
+        Stores a value, evicting the least recently used entry if the cache is full.
+
+        Args:
+            key: Hashable cache key.
+            value: Value to store.
+        """
+        if self.maxsize <= 0:
+            return
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """
+        Returns hit/miss counters and the current size of the cache.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+
+def hash_key(*parts) -> str:
+    """
+    Builds a content-addressed cache key from JSON-serializable parts.
+
+    Returns:
+        str: SHA-256 hex digest of the canonical JSON encoding of the parts.
+    """
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Hashes the contents of a file, e.g. to key cached results on a data file they depend on.
+
+    Returns:
+        str: SHA-256 hex digest of the file contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SQLiteCache:
+    """
+    Persistent least-recently-used cache of JSON-serializable values backed by SQLite.
+
+    The database can be shared by several processes. When the number of entries or their
+    total size exceeds the configured caps, the least recently used entries are evicted.
+    The number and total size of the entries are tracked in memory rather than counted on
+    every write, and recounted every `recount_interval` writes to include the writes of
+    other processes.
+
+    Attributes:
+        path (str): Path of the SQLite database file.
+        max_entries (int): Maximum number of entries, or None for no limit.
+        max_bytes (int): Maximum total size of the stored values, or None for no limit.
+        recount_interval (int): Number of writes between recounts of the entries.
+        hits (int): Number of successful lookups by this process.
+        misses (int): Number of lookups by this process that found no entry.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 100_000,
+        max_bytes: int = None,
+        recount_interval: int = 1000,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.recount_interval = recount_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._num_entries = None
+        self._total_bytes = None
+        self._writes_since_recount = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = self._connect()
+        # SQLite connections must not be used across fork, so forked workers open their own
+        cache_ref = weakref.ref(self)
+        os.register_at_fork(
+            after_in_child=lambda: cache_ref() is not None and cache_ref()._reconnect()
+        )
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+
+    def _reconnect(self):
+        # The inherited connection is kept open but unused, as closing it in the child
+        # could release the parent's file locks
+        self._inherited_conn = self._conn
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+        self._num_entries = None
+
+    def get(self, key: str, default=None):
+        """
+        Looks up a key, marking it as most recently used.
+
+        Args:
+            key (str): Cache key.
+            default: Value returned when the key is missing.
+
+        Returns:
+            The cached value, or `default`.
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            self._conn.execute(
+                "UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value):
+        """
+        Stores a value and evicts least recently used entries beyond the size caps.
+
+        Args:
+            key (str): Cache key.
+            value: JSON-serializable value.
+        """
+        payload = json.dumps(value)
+        with self._lock, self._conn:
+            replaced = self._conn.execute(
+                "SELECT size FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, payload, len(payload), time.time()),
+            )
+            self._writes_since_recount += 1
+            if self._num_entries is None or self._writes_since_recount >= self.recount_interval:
+                self._recount()
+            elif replaced is None:
+                self._num_entries += 1
+                self._total_bytes += len(payload)
+            else:
+                self._total_bytes += len(payload) - replaced[0]
+            self._evict()
+
+    def delete(self, key: str):
+        with self._lock, self._conn:
+            deleted = self._conn.execute(
+                "SELECT size FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if deleted is None:
+                return
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            if self._num_entries is not None:
+                self._num_entries -= 1
+                self._total_bytes -= deleted[0]
+
+    def get_meta(self, key: str, default=None):
+        """
+        Looks up a metadata value, such as the version of the cached entries. Metadata is
+        not subject to eviction.
+
+        Args:
+            key (str): Metadata key.
+            default: Value returned when the key is missing.
+
+        Returns:
+            The stored value, or `default`.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set_meta(self, key: str, value):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value))
+            )
+
+    def _recount(self):
+        self._num_entries, self._total_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        self._writes_since_recount = 0
+
+    def _evict(self):
+        evict = []
+        if self.max_entries is not None and self._num_entries > self.max_entries:
+            evict = self._conn.execute(
+                "SELECT key, size FROM entries ORDER BY last_access LIMIT ?",
+                (self._num_entries - self.max_entries,),
+            ).fetchall()
+        excess = 0
+        if self.max_bytes is not None:
+            excess = self._total_bytes - sum(size for _, size in evict) - self.max_bytes
+        if excess > 0:
+            # Continue along the access order past the entries already evicted
+            rows = self._conn.execute(
+                "SELECT key, size FROM entries ORDER BY last_access LIMIT -1 OFFSET ?",
+                (len(evict),),
+            )
+            for key, size in rows:
+                if excess <= 0:
+                    break
+                evict.append((key, size))
+                excess -= size
+        if evict:
+            self._conn.executemany(
+                "DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evict]
+            )
+            self._num_entries -= len(evict)
+            self._total_bytes -= sum(size for _, size in evict)
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries")
+            self._num_entries, self._total_bytes = 0, 0
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def stats(self) -> dict:
+        """
+        Returns hit/miss counters of this process and the current size of the cache.
+        """
+        with self._lock:
+            num_entries, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": num_entries,
+            "bytes": total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+        }
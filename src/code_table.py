@@ -0,0 +1,279 @@
+import csv
+import hashlib
+import json
+import os
+from typing import List, Dict
+
+import numpy as np
+
+CODE_TABLE_FORMAT_VERSION = 1
+
+# Codes are at most 8 characters long with the dot, e.g. S72.001A
+CODE_ID_WIDTH = 8
+
+
+def encode_code_ids(codes) -> np.ndarray:
+    """
+    Derives a stable int64 id from each code by reading its ASCII bytes, padded to 8, as a
+    big-endian integer. Ids do not depend on the row of the code, so they stay the same
+    across releases, and they sort in the same order as the codes.
+
+    Args:
+        codes (List[str] | np.ndarray): Codes, as strings or a fixed-width byte array.
+
+    Returns:
+        np.ndarray: int64 id of each code.
+    """
+    codes = np.asarray(codes, dtype="S")
+    if codes.dtype.itemsize > CODE_ID_WIDTH:
+        raise ValueError(f"Codes longer than {CODE_ID_WIDTH} characters cannot be encoded as ids")
+    padded = np.ascontiguousarray(codes, dtype=f"S{CODE_ID_WIDTH}")
+    return padded.view(">i8").astype(np.int64)
+
+
+def decode_code_ids(ids: np.ndarray) -> np.ndarray:
+    """
+    Returns the fixed-width byte codes of ids created by `encode_code_ids`.
+    """
+    return np.ascontiguousarray(ids, dtype=">i8").view(f"S{CODE_ID_WIDTH}")
+
+
+class CodeTable:
+    """
+    Compact, column-oriented table of ICD-10 codes.
+
+    Codes are stored as a fixed-width byte array, billability as a packed bitmask and
+    descriptions as a single UTF-8 buffer with offsets. Every column is saved as a
+    `.npy` file so that a table can be memory-mapped and shared between processes.
+
+    Attributes:
+        codes (np.ndarray): Fixed-width ASCII codes, e.g. b"E11.9".
+        billable_bits (np.ndarray): Billable flags packed with `np.packbits`.
+        description_buffer (np.ndarray): Concatenated UTF-8 encoded descriptions.
+        description_offsets (np.ndarray): Start offset of each description, plus the end offset.
+    """
+
+    files = {
+        "codes": "codes.npy",
+        "billable_bits": "billable_bits.npy",
+        "description_buffer": "description_buffer.npy",
+        "description_offsets": "description_offsets.npy",
+    }
+
+    def __init__(self, codes, billable_bits, description_buffer, description_offsets):
+        self.codes = codes
+        self.billable_bits = billable_bits
+        self.description_buffer = description_buffer
+        self.description_offsets = description_offsets
+        self._sort_order = None
+        self._sorted_codes = None
+
+    @classmethod
+    def from_records(cls, records: List[Dict]):
+        """
+        Builds a table from records with 'code', 'description' and 'is_billable' fields.
+
+        Args:
+            records (List[Dict]): Code records, e.g. rows of icd10_all_codes.tsv.
+
+        Returns:
+            CodeTable: The table, with rows in the order of the records.
+        """
+        codes = np.array([record["code"] for record in records], dtype="S")
+        billable = np.array([bool(record["is_billable"]) for record in records], dtype=bool)
+        encoded = [record["description"].encode("utf-8") for record in records]
+
+        description_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(x) for x in encoded], out=description_offsets[1:])
+        description_buffer = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+        return cls(codes, np.packbits(billable), description_buffer, description_offsets)
+
+    @classmethod
+    def from_tsv(cls, path: str):
+        """
+        Builds a table from a TSV file with 'code', 'description' and 'is_billable' columns,
+        e.g. icd10_data/icd10_all_codes.tsv, without going through pandas.
+
+        Args:
+            path (str): Path of the TSV file.
+
+        Returns:
+            CodeTable: The table, with rows in the order of the file.
+        """
+        with open(path, "r", newline="") as f:
+            records = [
+                {
+                    "code": row["code"],
+                    "description": row["description"],
+                    "is_billable": row["is_billable"].strip().lower() in ("true", "1"),
+                }
+                for row in csv.DictReader(f, delimiter="\t")
+            ]
+        return cls.from_records(records)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def code(self, idx: int) -> str:
+        return self.codes[idx].decode("ascii")
+
+    def description(self, idx: int) -> str:
+        start, end = self.description_offsets[idx], self.description_offsets[idx + 1]
+        return self.description_buffer[start:end].tobytes().decode("utf-8")
+
+    def is_billable(self, idx: int) -> bool:
+        return bool((self.billable_bits[idx >> 3] >> (7 - (idx & 7))) & 1)
+
+    def billable_mask(self, indices: np.ndarray) -> np.ndarray:
+        """
+        Returns the billable flags of several rows at once.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        return ((self.billable_bits[indices >> 3] >> (7 - (indices & 7))) & 1).astype(bool)
+
+    def sorted_codes(self):
+        """
+        Returns the codes in sorted order and the row index of each, computed on first use.
+        """
+        if self._sort_order is None:
+            sort_order = np.argsort(self.codes, kind="stable").astype(np.int32)
+            self._sorted_codes = self.codes[sort_order]
+            self._sort_order = sort_order
+        return self._sorted_codes, self._sort_order
+
+    def find(self, codes: List[str]) -> np.ndarray:
+        """
+        Looks up the rows of several codes with a binary search over the sorted codes.
+
+        Args:
+            codes (List[str] | np.ndarray): Codes to look up, as strings or a fixed-width
+                byte array.
+
+        Returns:
+            np.ndarray: Row index of each code, or -1 for codes not in the table.
+        """
+        if not len(codes):
+            return np.empty(0, dtype=np.int64)
+        sorted_codes, sort_order = self.sorted_codes()
+        if isinstance(codes, np.ndarray) and codes.dtype.kind == "S":
+            queries = codes
+        else:
+            # Non-ASCII characters are replaced so that such codes never match
+            queries = np.array([code.encode("ascii", "replace") for code in codes])
+        positions = np.searchsorted(sorted_codes, queries)
+        positions[positions == len(sorted_codes)] = 0
+        found = sorted_codes[positions] == queries
+        return np.where(found, sort_order[positions], -1).astype(np.int64)
+
+    def prefix_rows(self, prefix: str) -> np.ndarray:
+        """
+        Returns the rows of all codes starting with a prefix, in code order.
+
+        Codes sharing a prefix are contiguous in the sorted codes, so the sorted array acts
+        as a flattened prefix trie: a subtree is found with two binary searches.
+
+        Args:
+            prefix (str): Code prefix, e.g. 'E87.2'.
+
+        Returns:
+            np.ndarray: Row index of each code with the prefix, including the prefix itself.
+        """
+        sorted_codes, sort_order = self.sorted_codes()
+        encoded = prefix.encode("ascii", "replace")
+        start, end = np.searchsorted(sorted_codes, [encoded, encoded + b"\xff"])
+        return sort_order[start:end].astype(np.int64)
+
+    def record(self, idx: int) -> Dict:
+        """
+        Returns a single row as a dict with 'code', 'description' and 'is_billable' fields.
+        """
+        return {
+            "code": self.code(idx),
+            "description": self.description(idx),
+            "is_billable": self.is_billable(idx),
+        }
+
+    def records(self) -> List[Dict]:
+        return [self.record(idx) for idx in range(len(self))]
+
+    def fingerprint(self) -> str:
+        """
+        Returns a hash of the table's contents, identifying the ICD-10-CM release it holds.
+        """
+        digest = hashlib.sha256()
+        for attr in self.files:
+            digest.update(np.ascontiguousarray(getattr(self, attr)).tobytes())
+        return digest.hexdigest()
+
+    def save(self, save_dir: str):
+        """
+        Saves each column of the table as a `.npy` file in the given directory.
+
+        Args:
+            save_dir (str): Directory to write the table to.
+        """
+        os.makedirs(save_dir, exist_ok=True)
+        for attr, filename in self.files.items():
+            np.save(os.path.join(save_dir, filename), getattr(self, attr))
+        with open(os.path.join(save_dir, "code_table.json"), "w") as f:
+            json.dump({"format_version": CODE_TABLE_FORMAT_VERSION, "size": len(self)}, f)
+
+    @classmethod
+    def load(cls, save_dir: str, mmap: bool = True):
+        """
+        Loads a table saved with `save`.
+
+        Args:
+            save_dir (str): Directory containing the table.
+            mmap (bool): Memory-map the columns instead of reading them into memory.
+
+        Returns:
+            CodeTable: The loaded table.
+        """
+        with open(os.path.join(save_dir, "code_table.json"), "r") as f:
+            metadata = json.load(f)
+        if metadata["format_version"] != CODE_TABLE_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported code table format version {metadata['format_version']} in {save_dir}"
+            )
+
+        mmap_mode = "r" if mmap else None
+        columns = {
+            attr: np.load(os.path.join(save_dir, filename), mmap_mode=mmap_mode)
+            for attr, filename in cls.files.items()
+        }
+        return cls(**columns)
+
+    @staticmethod
+    def exists(save_dir: str) -> bool:
+        return os.path.isfile(os.path.join(save_dir, "code_table.json"))
+
+
+def load_code_table(
+    tsv_path: str = "icd10_data/icd10_all_codes.tsv",
+    table_dir: str = "icd10_data/code_table",
+    mmap: bool = True,
+) -> CodeTable:
+    """
+    Loads the prebuilt code table, building it from the TSV file if it is missing or older
+    than the TSV file.
+
+    Args:
+        tsv_path (str): Path of the TSV file with all codes.
+        table_dir (str): Directory of the prebuilt table.
+        mmap (bool): Memory-map the columns of the prebuilt table.
+
+    Returns:
+        CodeTable: The table.
+    """
+    if CodeTable.exists(table_dir) and (
+        not os.path.isfile(tsv_path)
+        or os.path.getmtime(os.path.join(table_dir, "code_table.json"))
+        >= os.path.getmtime(tsv_path)
+    ):
+        return CodeTable.load(table_dir, mmap=mmap)
+
+    table = CodeTable.from_tsv(tsv_path)
+    table.save(table_dir)
+    return table
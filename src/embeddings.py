@@ -0,0 +1,144 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import numpy as np
+
+from .utils import setup_loggers
+
+logger = setup_loggers()
+
+# Inference backends for SentenceTransformer models:
+#   'torch': fp32 PyTorch (the SentenceTransformer default)
+#   'int8':  PyTorch with the linear layers dynamically quantized to int8
+#   'onnx':  ONNX Runtime, which requires the `onnxruntime` and `optimum` packages
+EMBEDDING_BACKENDS = ("torch", "int8", "onnx")
+
+
+class SentenceEmbedder:
+    """
+    Encodes texts with a SentenceTransformer model using a configurable inference backend.
+
+    Queries are encoded in the calling process. Large document sets, as encoded when a
+    retriever index is built, can be spread over a pool of worker processes.
+
+    Attributes:
+        model_name (str): Name or path of the SentenceTransformer model.
+        backend (str): One of EMBEDDING_BACKENDS.
+        batch_size (int): Number of texts per forward pass.
+        num_workers (int): Number of processes encoding documents, or 0 to encode them in
+            the calling process.
+        onnx_file_name (str): ONNX file of the model to load with the 'onnx' backend, e.g.
+            'onnx/model_qint8_avx512_vnni.onnx' for a quantized export. Defaults to the
+            model's 'onnx/model.onnx', which is exported on first use if missing.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        backend: str = "torch",
+        batch_size: int = 64,
+        num_workers: int = 0,
+        onnx_file_name: str = None,
+    ):
+        if backend not in EMBEDDING_BACKENDS:
+            raise ValueError(
+                f"Unknown embedding backend '{backend}'. Expected one of {EMBEDDING_BACKENDS}."
+            )
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.onnx_file_name = onnx_file_name
+        self._model = None
+
+    @property
+    def model(self):
+        """
+        The SentenceTransformer, built on first use.
+        """
+        if self._model is None:
+            self._model = self.load_model()
+        return self._model
+
+    def load_model(self):
+        # Imported on first use, as torch dominates the import time of the app
+        from sentence_transformers import SentenceTransformer
+
+        if self.backend == "onnx":
+            model_kwargs = {"file_name": self.onnx_file_name} if self.onnx_file_name else None
+            return SentenceTransformer(
+                self.model_name, backend="onnx", model_kwargs=model_kwargs
+            )
+
+        model = SentenceTransformer(self.model_name, device="cpu")
+        if self.backend == "int8":
+            import torch
+
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        return model
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Encodes texts in the calling process.
+
+        Args:
+            texts (List[str]): Texts to encode.
+
+        Returns:
+            np.ndarray: float32 embedding matrix, one row per text.
+        """
+        return self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        ).astype(np.float32)
+
+    def encode_documents(self, texts: List[str]) -> np.ndarray:
+        """
+        Encodes a large set of texts, spread over `num_workers` processes if set.
+
+        Args:
+            texts (List[str]): Texts to encode.
+
+        Returns:
+            np.ndarray: float32 embedding matrix, one row per text.
+        """
+        if self.num_workers <= 1 or self.backend == "onnx":
+            # ONNX Runtime already runs a single session on all cores
+            return self.encode(texts)
+
+        logger.info(f"Encoding {len(texts)} documents with {self.num_workers} processes.")
+        # Each worker loads its own copy of the model. Workers are spawned rather than
+        # forked, as forking after torch has started its thread pool can deadlock.
+        num_threads = max(1, (os.cpu_count() or 1) // self.num_workers)
+        chunk_size = max(self.batch_size, -(-len(texts) // (4 * self.num_workers)))
+        chunks = [texts[i : i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        with ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.model_name, self.backend, self.batch_size, num_threads),
+        ) as pool:
+            embeddings = list(pool.map(_encode_in_worker, chunks))
+        return np.concatenate(embeddings).astype(np.float32)
+
+
+# Embedder of a document encoding worker process
+_worker_embedder = None
+
+
+def _init_worker(model_name: str, backend: str, batch_size: int, num_threads: int):
+    global _worker_embedder
+    import torch
+
+    torch.set_num_threads(num_threads)
+    _worker_embedder = SentenceEmbedder(model_name, backend=backend, batch_size=batch_size)
+
+
+def _encode_in_worker(texts: List[str]) -> np.ndarray:
+    return _worker_embedder.encode(texts)
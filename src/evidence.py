@@ -0,0 +1,171 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+from .utils import setup_loggers
+
+logger = setup_loggers()
+
+# Ways to handle codes whose evidence cannot be found in the note
+EVIDENCE_MODES = ("drop", "flag")
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> Tuple[str, List[int]]:
+    """
+    Lowercases a text and collapses whitespace runs to single spaces, keeping track of where
+    each character came from.
+
+    Args:
+        text (str): Text to normalize.
+
+    Returns:
+        Tuple[str, List[int]]: The normalized text and, for each of its characters, the
+            offset of the corresponding character in `text`.
+    """
+    chunks, offsets = [], []
+    position = 0
+    for match in WHITESPACE.finditer(text):
+        lower_with_offsets(text[position : match.start()], position, chunks, offsets)
+        chunks.append(" ")
+        offsets.append(match.start())
+        position = match.end()
+    lower_with_offsets(text[position:], position, chunks, offsets)
+    return "".join(chunks), offsets
+
+
+def lower_with_offsets(chunk: str, start: int, chunks: List[str], offsets: List[int]):
+    """
+    Appends a lowercased chunk of text and the offset of each of its characters.
+
+    Lowercasing can change the length of a text (e.g. 'İ' becomes 'i̇'), in which case each
+    character is lowercased on its own and its offset repeated for every character it
+    expands to.
+    """
+    lowered = chunk.lower()
+    if len(lowered) == len(chunk):
+        chunks.append(lowered)
+        offsets.extend(range(start, start + len(chunk)))
+        return
+    for i, char in enumerate(chunk):
+        lowered = char.lower()
+        chunks.append(lowered)
+        offsets.extend([start + i] * len(lowered))
+
+
+class EvidenceMatcher:
+    """
+    Locates evidence snippets in a note.
+
+    A snippet is first searched verbatim in the normalized note (case and whitespace
+    insensitive). Snippets that are not found are aligned with rapidfuzz's partial ratio,
+    which tolerates small edits such as dropped punctuation or typos. The alignment is
+    bounded to snippets of at most `max_fuzzy_length` characters, so its cost stays linear
+    in the length of the note.
+
+    Attributes:
+        note (str): Original note.
+        text (str): Normalized note.
+        offsets (List[int]): Offset in `note` of each character of `text`.
+        min_score (float): Minimum partial ratio (0-100) of a fuzzy match.
+        max_fuzzy_length (int): Longest snippet that is aligned fuzzily.
+    """
+
+    def __init__(self, note: str, min_score: float = 90, max_fuzzy_length: int = 200):
+        self.note = note
+        self.text, self.offsets = normalize_text(note)
+        self.min_score = min_score
+        self.max_fuzzy_length = max_fuzzy_length
+        self._spans = {}
+
+    def locate(self, snippet: str) -> Optional[Dict]:
+        """
+        Finds a snippet in the note.
+
+        Args:
+            snippet (str): Evidence snippet.
+
+        Returns:
+            Optional[Dict]: 'start' and 'end' character offsets of the match in the original
+                note and its 'score' (100 for an exact match), or None if it was not found.
+        """
+        if snippet not in self._spans:
+            self._spans[snippet] = self._locate(snippet)
+        return self._spans[snippet]
+
+    def _locate(self, snippet: str) -> Optional[Dict]:
+        query = normalize_text(snippet)[0].strip()
+        if not query:
+            return None
+
+        start = self.text.find(query)
+        if start >= 0:
+            return self._span(start, start + len(query), 100.0)
+
+        # partial_ratio aligns the shorter string inside the longer one, so a snippet longer
+        # than the note would score the whole note as a match
+        if len(query) > self.max_fuzzy_length or len(query) > len(self.text):
+            return None
+        from rapidfuzz import fuzz
+
+        alignment = fuzz.partial_ratio_alignment(
+            query, self.text, score_cutoff=self.min_score
+        )
+        if alignment is None or alignment.dest_end <= alignment.dest_start:
+            return None
+        return self._span(alignment.dest_start, alignment.dest_end, alignment.score)
+
+    def _span(self, start: int, end: int, score: float) -> Dict:
+        return {
+            "start": self.offsets[start],
+            "end": self.offsets[end - 1] + 1,
+            "score": round(float(score), 1),
+        }
+
+
+def verify_evidence(
+    icd10_codes: List[Dict],
+    note: str,
+    mode: str = "drop",
+    min_score: float = 90,
+    max_fuzzy_length: int = 200,
+) -> List[Dict]:
+    """
+    Checks that the evidence of each code appears in the note, attaching the character span
+    of the evidence to codes where it was found.
+
+    Args:
+        icd10_codes (List[Dict]): Codes with an 'evidence' field.
+        note (str): Note the codes were assigned to.
+        mode (str): 'drop' to remove codes whose evidence was not found, or 'flag' to keep
+            them with 'evidence_verified' set to False.
+        min_score (float): Minimum partial ratio (0-100) of a fuzzy match.
+        max_fuzzy_length (int): Longest snippet that is aligned fuzzily.
+
+    Returns:
+        List[Dict]: The codes, with 'evidence_span' ([start, end] offsets in the note) and
+            'evidence_verified' fields.
+    """
+    if mode not in EVIDENCE_MODES:
+        raise ValueError(f"Unknown evidence mode '{mode}'. Expected one of {EVIDENCE_MODES}.")
+
+    matcher = EvidenceMatcher(note, min_score=min_score, max_fuzzy_length=max_fuzzy_length)
+    verified = []
+    for code_with_evidence in icd10_codes:
+        span = matcher.locate(code_with_evidence.get("evidence") or "")
+        if span is None:
+            if mode == "drop":
+                logger.info(
+                    f"Evidence '{code_with_evidence.get('evidence')}' of code {code_with_evidence['code']} was not found in the note. Dropping."
+                )
+                continue
+            verified.append({**code_with_evidence, "evidence_verified": False})
+        else:
+            verified.append(
+                {
+                    **code_with_evidence,
+                    "evidence_span": [span["start"], span["end"]],
+                    "evidence_verified": True,
+                }
+            )
+    return verified
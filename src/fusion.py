@@ -0,0 +1,51 @@
+from typing import Dict, List
+
+# Constant damping the contribution of low ranks in reciprocal rank fusion
+RRF_K = 60
+
+
+def fuse_results(
+    results: List[List[Dict]], method: str = "rrf", limit: int = None, rrf_k: int = RRF_K
+) -> List[Dict]:
+    """
+    Merges several ranked result lists into one ranked list with one entry per code.
+
+    With 'rrf' (reciprocal rank fusion), a code scores the sum of 1 / (rrf_k + rank) over
+    the lists it appears in, so codes retrieved for several queries rank higher. With
+    'max_sim', a code scores its best similarity to any query, i.e. its smallest distance.
+
+    Args:
+        results (List[List[Dict]]): Result lists, best first, as returned by retrieve_batch.
+        method (str): Fusion method, 'rrf' or 'max_sim'.
+        limit (int, optional): Maximum number of fused results. Defaults to no limit.
+        rrf_k (int): Rank damping constant for 'rrf'.
+
+    Returns:
+        List[Dict]: Unique results, best first, with a fused 'score' (higher is better) and
+            the smallest 'distance' over the lists.
+    """
+    if method not in ("rrf", "max_sim"):
+        raise ValueError(f"Unknown fusion method '{method}'. Expected 'rrf' or 'max_sim'.")
+
+    fused = {}
+    for result_list in results:
+        for rank, doc in enumerate(result_list, start=1):
+            distance = doc.get("distance", float("inf"))
+            if method == "rrf":
+                score = 1.0 / (rrf_k + rank)
+            else:
+                score = -distance
+
+            entry = fused.get(doc["code"])
+            if entry is None:
+                fused[doc["code"]] = {**doc, "score": score}
+                continue
+            entry["distance"] = min(entry.get("distance", float("inf")), distance)
+            if method == "rrf":
+                entry["score"] += score
+            else:
+                entry["score"] = max(entry["score"], score)
+
+    # Stable sort keeps codes first seen in earlier lists ahead on ties
+    ranked = sorted(fused.values(), key=lambda doc: -doc["score"])
+    return ranked[:limit] if limit is not None else ranked
@@ -0,0 +1,214 @@
+import re
+from typing import Dict, Iterable, List, Tuple
+
+from .utils import setup_loggers
+
+logger = setup_loggers()
+
+# A code reference in a note, e.g. A00, K52.- or R10.1, optionally a range such as A00-A09
+# Anchored so that parenthesized tokens which are not codes, e.g. '(H1N1)', are not parsed
+CODE_PATTERN = r"(?<![0-9A-Za-z])[A-Z][0-9][0-9A-Z](?:\.[0-9A-Z]{0,4})?(?![0-9A-Za-z])"
+CODE_RANGE = re.compile(rf"({CODE_PATTERN})(?:-?\s*-\s*({CODE_PATTERN}))?-?")
+PARENTHESES = re.compile(r"\(([^)]*)\)")
+
+# Ways to resolve a pair of mutually exclusive codes
+CONFLICT_MODES = ("remove", "flag")
+
+
+def normalize_reference(code: str) -> str:
+    """
+    Strips the wildcard suffix of a code reference, e.g. 'K52.-' -> 'K52'.
+    """
+    return code.rstrip("-").rstrip(".")
+
+
+def parse_code_ranges(note: str) -> List[Tuple[str, str]]:
+    """
+    Resolves the code references in the parentheses of a note to code prefix ranges.
+
+    Args:
+        note (str): Note text, e.g. 'intestinal infections (A00-A09)' or 'gastritis (K29.-)'.
+
+    Returns:
+        List[Tuple[str, str]]: (first, last) prefixes of each referenced range. A single
+            code or category is a range with equal bounds.
+    """
+    ranges = []
+    for group in PARENTHESES.findall(note):
+        for first, last in CODE_RANGE.findall(group):
+            first = normalize_reference(first)
+            last = normalize_reference(last) if last else first
+            ranges.append((first, last))
+    return ranges
+
+
+def in_range(code: str, code_range: Tuple[str, str]) -> bool:
+    """
+    Checks whether a code falls within a prefix range, e.g. 'A05.1' in ('A00', 'A09').
+    """
+    first, last = code_range
+    return code[: len(first)] >= first and code[: len(last)] <= last
+
+
+class ICD10Hierarchy:
+    """
+    Parent/child links and Excludes1/Excludes2 notes of ICD-10-CM codes, resolved to code
+    ranges.
+
+    Excludes1 marks codes that must never be reported together with a code (or with any
+    code below it). Excludes2 marks conditions that are not part of the code but may be
+    reported alongside it.
+
+    Attributes:
+        parents (Dict[str, str]): Parent of each code that has one.
+        children (Dict[str, List[str]]): Direct children of each code that has any.
+        excludes1 (Dict[str, List[Tuple[str, str]]]): Excludes1 ranges of each code that has any.
+        excludes2 (Dict[str, List[Tuple[str, str]]]): Excludes2 ranges of each code that has any.
+    """
+
+    def __init__(self, parents, children, excludes1, excludes2):
+        self.parents = parents
+        self.children = children
+        self.excludes1 = excludes1
+        self.excludes2 = excludes2
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict]):
+        """
+        Builds the hierarchy from records with 'code' and optional 'excludes_1' and
+        'excludes_2' note lists, as written by process_icd10_hierarchy.py.
+
+        A code's parent is its longest proper prefix that is itself a code, e.g.
+        A00.0 -> A00.
+
+        Args:
+            records (Iterable[Dict]): Code records.
+
+        Returns:
+            ICD10Hierarchy: The hierarchy.
+        """
+        codes = set()
+        excludes1, excludes2 = {}, {}
+        for record in records:
+            code = record["code"]
+            codes.add(code)
+            for field, excludes in (("excludes_1", excludes1), ("excludes_2", excludes2)):
+                ranges = [r for note in record.get(field) or [] for r in parse_code_ranges(note)]
+                if ranges:
+                    excludes.setdefault(code, []).extend(ranges)
+
+        parents, children = {}, {}
+        for code in codes:
+            prefix = code[:-1].rstrip(".")
+            while prefix and prefix not in codes:
+                prefix = prefix[:-1].rstrip(".")
+            if prefix:
+                parents[code] = prefix
+                children.setdefault(prefix, []).append(code)
+        for siblings in children.values():
+            siblings.sort()
+
+        return cls(parents, children, excludes1, excludes2)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Loads the hierarchy from the JSON lines file written by process_icd10_hierarchy.py.
+        """
+        from .process_icd10_hierarchy import CodeMetadataFile
+
+        hierarchy = cls.from_records(CodeMetadataFile(path))
+        logger.info(
+            f"Loaded ICD-10 hierarchy of {len(hierarchy.parents)} child codes with "
+            f"{len(hierarchy.excludes1)} Excludes1 and {len(hierarchy.excludes2)} Excludes2 notes."
+        )
+        return hierarchy
+
+    def ancestors(self, code: str) -> List[str]:
+        """
+        Returns the parent, grandparent, ... of a code.
+        """
+        ancestors = []
+        while code in self.parents:
+            code = self.parents[code]
+            ancestors.append(code)
+        return ancestors
+
+    def excludes1_ranges(self, code: str) -> List[Tuple[str, str]]:
+        """
+        Returns the Excludes1 ranges of a code, including those inherited from its ancestors.
+        """
+        ranges = list(self.excludes1.get(code, ()))
+        for ancestor in self.ancestors(code):
+            ranges.extend(self.excludes1.get(ancestor, ()))
+        return ranges
+
+    def excludes(self, code: str, other: str) -> bool:
+        """
+        Checks whether `other` falls within the Excludes1 notes of `code` or its ancestors.
+        """
+        return any(in_range(other, code_range) for code_range in self.excludes1_ranges(code))
+
+    def find_conflicts(self, codes: List[str]) -> List[Tuple[str, str]]:
+        """
+        Finds the pairs of codes that must not be reported together under Excludes1.
+
+        Args:
+            codes (List[str]): Codes, in order of priority.
+
+        Returns:
+            List[Tuple[str, str]]: (kept, conflicting) pairs, where `kept` comes first in `codes`.
+        """
+        ranges = {code: self.excludes1_ranges(code) for code in codes}
+        conflicts = []
+        for i, code in enumerate(codes):
+            for other in codes[i + 1 :]:
+                if other == code:
+                    continue
+                if any(in_range(other, r) for r in ranges[code]) or any(
+                    in_range(code, r) for r in ranges[other]
+                ):
+                    conflicts.append((code, other))
+        return conflicts
+
+    def resolve_conflicts(self, output: Dict, mode: str = "remove") -> Dict:
+        """
+        Resolves Excludes1 conflicts in a final output, keeping the earlier listed code of
+        each conflicting pair.
+
+        Args:
+            output (Dict): Output with an 'icd10_codes' list, as returned by Adjustor.postprocess.
+            mode (str): 'remove' to drop the later code of each conflicting pair, or 'flag' to
+                keep every code and list its conflicts under 'excludes1_conflicts'.
+
+        Returns:
+            Dict: The output with conflicts resolved.
+        """
+        if mode not in CONFLICT_MODES:
+            raise ValueError(f"Unknown conflict mode '{mode}'. Expected one of {CONFLICT_MODES}.")
+
+        icd10_codes = output["icd10_codes"]
+        conflicts = self.find_conflicts([x["code"] for x in icd10_codes])
+        if not conflicts:
+            return output
+
+        if mode == "flag":
+            flagged = {}
+            for code, other in conflicts:
+                flagged.setdefault(code, []).append(other)
+                flagged.setdefault(other, []).append(code)
+            return {
+                "icd10_codes": [
+                    {**x, "excludes1_conflicts": flagged[x["code"]]} if x["code"] in flagged else x
+                    for x in icd10_codes
+                ]
+            }
+
+        # Drop codes in priority order, so a code that was already dropped cannot
+        # cause a later code to be dropped as well
+        removed = set()
+        for code, other in conflicts:
+            if code not in removed and other not in removed:
+                logger.info(f"Dropping {other}, which is mutually exclusive with {code} (Excludes1).")
+                removed.add(other)
+        return {"icd10_codes": [x for x in icd10_codes if x["code"] not in removed]}
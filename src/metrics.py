@@ -0,0 +1,237 @@
+import asyncio
+import functools
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Buckets covering both sub-millisecond local stages and multi-second LLM calls
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    20.0,
+    40.0,
+    80.0,
+)
+
+STAGE_LATENCY = Histogram(
+    "icd10_stage_latency_seconds",
+    "Latency of pipeline stages, labelled by stage and agent role.",
+    ["stage", "role"],
+    buckets=LATENCY_BUCKETS,
+)
+NOTE_LATENCY = Histogram(
+    "icd10_note_latency_seconds",
+    "End-to-end latency of processing one note.",
+    buckets=LATENCY_BUCKETS,
+)
+NOTES_PROCESSED = Counter(
+    "icd10_notes_processed_total",
+    "Number of notes processed, labelled by outcome.",
+    ["status"],
+)
+NOTE_CACHE_LOOKUPS = Counter(
+    "icd10_note_cache_lookups_total",
+    "Lookups of final results in the note result cache, labelled by result (hit or miss).",
+    ["result"],
+)
+LLM_TOKENS = Counter(
+    "icd10_llm_tokens_total",
+    "Tokens used by LLM calls, labelled by agent role and token type (prompt or completion).",
+    ["role", "type"],
+)
+EVIDENCE_CHECKS = Counter(
+    "icd10_evidence_checks_total",
+    "Evidence snippets checked against the note, labelled by agent role and result (verified or unverified).",
+    ["role", "result"],
+)
+LLM_IN_FLIGHT = Gauge(
+    "icd10_llm_requests_in_flight",
+    "Number of LLM calls currently awaiting a response, labelled by agent role.",
+    ["role"],
+    multiprocess_mode="livesum",
+)
+STARTUP_SECONDS = Gauge(
+    "icd10_startup_phase_seconds",
+    "Duration of each phase of the app startup, labelled by phase.",
+    ["phase"],
+    multiprocess_mode="max",
+)
+PROCESS_MEMORY = Gauge(
+    "icd10_process_memory_bytes",
+    "Memory of each worker process from /proc/self/smaps_rollup, labelled by kind (rss, pss, shared, private).",
+    ["kind"],
+    multiprocess_mode="liveall",
+)
+SCHEDULER_RUNNING = Gauge(
+    "icd10_scheduler_running",
+    "Number of notes being processed, labelled by priority lane.",
+    ["lane"],
+    multiprocess_mode="livesum",
+)
+SCHEDULER_QUEUED = Gauge(
+    "icd10_scheduler_queued",
+    "Number of notes waiting for a processing slot, labelled by priority lane.",
+    ["lane"],
+    multiprocess_mode="livesum",
+)
+SCHEDULER_REJECTED = Counter(
+    "icd10_scheduler_rejected_total",
+    "Number of requests rejected with 429 because their lane's queue was full, labelled by lane.",
+    ["lane"],
+)
+HTTP_IN_FLIGHT = Gauge(
+    "icd10_http_requests_in_flight",
+    "Number of HTTP requests currently being processed, labelled by endpoint.",
+    ["endpoint"],
+    multiprocess_mode="livesum",
+)
+
+
+def timed(stage):
+    """
+    Decorator recording the latency of an agent method in STAGE_LATENCY.
+
+    The decorated method must belong to an object with a `role` attribute, which is used
+    as the role label. Works for both regular and async methods.
+
+    Args:
+        stage (str): Value of the stage label.
+    """
+
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(self, *args, **kwargs):
+                with STAGE_LATENCY.labels(stage=stage, role=self.role).time():
+                    return await fn(self, *args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with STAGE_LATENCY.labels(stage=stage, role=self.role).time():
+                return fn(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_token_usage(role, prompt_tokens, completion_tokens):
+    """
+    Add the token counts of one completion to LLM_TOKENS.
+
+    Args:
+        role (str): Role of the agent that made the call.
+        prompt_tokens (int): Number of prompt tokens.
+        completion_tokens (int): Number of completion tokens.
+    """
+    LLM_TOKENS.labels(role=role, type="prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(role=role, type="completion").inc(completion_tokens)
+
+
+@contextmanager
+def startup_phase(phase):
+    """
+    Context manager recording the duration of a startup phase in STARTUP_SECONDS.
+
+    Args:
+        phase (str): Value of the phase label.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_SECONDS.labels(phase=phase).set(time.perf_counter() - start)
+
+
+def startup_summary() -> dict:
+    """
+    Returns the recorded duration of every startup phase, in seconds.
+    """
+    return {
+        sample.labels["phase"]: sample.value
+        for metric in STARTUP_SECONDS.collect()
+        for sample in metric.samples
+    }
+
+
+def process_memory() -> dict:
+    """
+    Reads the memory of this process from /proc/self/smaps_rollup (Linux only).
+
+    RSS counts every resident page, including pages shared with other workers, such as the
+    memory-mapped index and pages inherited from a preloading parent process. PSS divides
+    each shared page between the processes that map it, so the PSS of all workers adds up
+    to their real footprint. Private pages are those only this worker uses.
+
+    Returns:
+        dict: 'rss', 'pss', 'shared' and 'private' memory in bytes, or an empty dict if
+            smaps_rollup is not available.
+    """
+    try:
+        with open("/proc/self/smaps_rollup", "r") as f:
+            fields = {
+                parts[0].rstrip(":"): int(parts[1]) * 1024
+                for parts in (line.split() for line in f)
+                if len(parts) == 3 and parts[2] == "kB"
+            }
+    except OSError:
+        return {}
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def record_process_memory() -> dict:
+    """
+    Updates PROCESS_MEMORY with the current memory of this process.
+
+    Returns:
+        dict: The memory figures, as returned by process_memory.
+    """
+    memory = process_memory()
+    for kind, value in memory.items():
+        PROCESS_MEMORY.labels(kind=kind).set(value)
+    return memory
+
+
+def format_memory(memory: dict) -> str:
+    return ", ".join(f"{kind} {value / 2**20:.0f} MB" for kind, value in memory.items())
+
+
+def metrics_exposition() -> bytes:
+    """
+    Renders all metrics in the Prometheus text format. When PROMETHEUS_MULTIPROC_DIR is set,
+    as by src/serve.py, the metrics of all worker processes are aggregated.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
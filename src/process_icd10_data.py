@@ -1,5 +1,13 @@
-import pandas as pd
-from .utils import write_json
+import argparse
+import csv
+import json
+import os
+
+import numpy as np
+
+from .code_table import CodeTable
+
+TSV_COLUMNS = ["code", "short_desc", "description", "is_billable"]
 
 
 def process_code(code):
@@ -24,21 +32,100 @@ def read_code_line(line):
         "code": code,
         "short_desc": short_desc.strip(),
         "description": long_desc.strip(),
-        "is_billable": int(is_billable.strip()),
+        "is_billable": bool(int(is_billable.strip())),
     }
 
 
-code_records = []
-for line in open("icd10_data/icd10cm_order_2025.txt").readlines():
-    code_records.append(read_code_line(line))
+def process_order_file(order_path: str, output_dir: str = "icd10_data") -> int:
+    """
+    Converts a CMS ICD-10-CM order file into the data files used by the app, in a single
+    streaming pass over the file.
+
+    Writes to `output_dir`:
+        - icd10_all_codes.tsv: every code with its short and long description and billability
+        - icd10_billable_codes.tsv: the billable codes only
+        - icd10_all_codes.json: long description of every code, keyed by code
+        - code_table/: the binary CodeTable loaded by the app and evaluate.py
+
+    Args:
+        order_path (str): Path of the fixed-width order file, e.g. icd10cm_order_2025.txt.
+        output_dir (str): Directory the data files are written to.
+
+    Returns:
+        int: Number of codes written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    codes = []
+    billable = bytearray()
+    description_offsets = [0]
+    description_chunks = []
+
+    with open(order_path, "r", encoding="utf-8") as order_file, open(
+        os.path.join(output_dir, "icd10_all_codes.tsv"), "w", newline=""
+    ) as all_file, open(
+        os.path.join(output_dir, "icd10_billable_codes.tsv"), "w", newline=""
+    ) as billable_file, open(
+        os.path.join(output_dir, "icd10_all_codes.json"), "w"
+    ) as json_file:
+        all_writer = csv.writer(all_file, delimiter="\t", lineterminator="\n")
+        billable_writer = csv.writer(billable_file, delimiter="\t", lineterminator="\n")
+        all_writer.writerow(TSV_COLUMNS)
+        billable_writer.writerow(TSV_COLUMNS)
+
+        # The JSON object is written one entry at a time, formatted as write_json would
+        json_file.write("{")
+        for line in order_file:
+            if not line.strip():
+                continue
+            record = read_code_line(line)
+            row = [record[column] for column in TSV_COLUMNS]
+            all_writer.writerow(row)
+            if record["is_billable"]:
+                billable_writer.writerow(row)
+
+            separator = "\n" if not codes else ",\n"
+            json_file.write(
+                f"{separator}  {json.dumps(record['code'])}: {json.dumps(record['description'])}"
+            )
+
+            encoded = record["description"].encode("utf-8")
+            codes.append(record["code"].encode("ascii"))
+            billable.append(record["is_billable"])
+            description_chunks.append(encoded)
+            description_offsets.append(description_offsets[-1] + len(encoded))
+        json_file.write("\n}" if codes else "}")
+
+    table = CodeTable(
+        codes=np.array(codes, dtype="S"),
+        billable_bits=np.packbits(np.frombuffer(bytes(billable), dtype=bool)),
+        description_buffer=np.frombuffer(b"".join(description_chunks), dtype=np.uint8),
+        description_offsets=np.array(description_offsets, dtype=np.int64),
+    )
+    table.save(os.path.join(output_dir, "code_table"))
+    return len(codes)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the ICD-10-CM data files from a CMS order file."
+    )
+    parser.add_argument(
+        "--year", type=int, default=2025, help="Release year of the order file."
+    )
+    parser.add_argument(
+        "--order-file",
+        help="Path of the order file. Defaults to <output-dir>/icd10cm_order_<year>.txt.",
+    )
+    parser.add_argument("--output-dir", default="icd10_data")
+    args = parser.parse_args()
+
+    order_path = args.order_file or os.path.join(
+        args.output_dir, f"icd10cm_order_{args.year}.txt"
+    )
+    num_codes = process_order_file(order_path, args.output_dir)
+    print(f"Wrote {num_codes} codes from {order_path} to {args.output_dir}")
 
-full_df = pd.DataFrame.from_records(code_records)
-full_df["is_billable"] = full_df["is_billable"].astype(bool)
-full_df.to_csv("icd10_data/icd10_all_codes.tsv", sep="\t", index=False)
-write_json(
-    full_df[["code", "description"]].set_index("code").to_dict()["description"],
-    "icd10_data/icd10_all_codes.json",
-)
 
-df = full_df.query("is_billable == 1").reset_index(drop=True)
-df.to_csv("icd10_data/icd10_billable_codes.tsv", sep="\t", index=False)
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,18 @@
+import argparse
+import json
+import os
 import xml.etree.ElementTree as ET
-from .utils import write_json
+from typing import Dict, Iterator
+
+import numpy as np
+
+# Note sections of a diag element, and the record field each one is stored in
+NOTE_FIELDS = {
+    "includes": "includes",
+    "inclusionTerm": "includes",
+    "excludes1": "excludes_1",
+    "excludes2": "excludes_2",
+}
 
 
 def process_diagnostic_code(diag_elem):
@@ -112,15 +125,163 @@ def alternative_parser(xml_content):
     return my_codes
 
 
-# Example usage:
-def main():
-    with open("icd10cm_tabular_2025.xml", "r", encoding="utf-8") as file:
-        xml_content = file.read()
+def read_diag(diag_elem) -> Dict:
+    """
+    Extracts the code, description and notes of a diag element from its direct children.
+    Nested diag elements are not searched.
+    """
+    code = diag_elem.findtext("name")
+    desc = diag_elem.findtext("desc")
+    if not code or not desc:
+        return None
 
-    codes = parse_icd10_xml(xml_content)
-    return codes
+    result = {"code": code, "desc": desc}
+    for child in diag_elem:
+        field = NOTE_FIELDS.get(child.tag)
+        if field is None:
+            continue
+        notes = [note.text for note in child.findall("note") if note.text]
+        if notes:
+            result.setdefault(field, []).extend(notes)
+    return result
+
+
+def iter_icd10_xml(xml_path: str) -> Iterator[Dict]:
+    """
+    Streams the codes of an ICD-10-CM tabular XML file in a single linear pass.
+
+    Each diag element is read when it ends and then removed from the tree, together with
+    every finished element outside a diag, so memory stays bounded by the nesting depth of
+    the file rather than its size. Nested codes are yielded before their parents.
+
+    Args:
+        xml_path (str): Path of the tabular XML file, e.g. icd10cm_tabular_2025.xml.
+
+    Yields:
+        Dict: Record with 'code' and 'desc', plus 'includes', 'excludes_1' and
+            'excludes_2' lists of notes when present.
+    """
+    stack = []
+    diag_depth = 0
+    for event, elem in ET.iterparse(xml_path, events=("start", "end")):
+        if event == "start":
+            stack.append(elem)
+            if elem.tag == "diag":
+                diag_depth += 1
+            continue
+
+        stack.pop()
+        if elem.tag == "diag":
+            diag_depth -= 1
+            record = read_diag(elem)
+            if record:
+                yield record
+        # Children of a diag are kept until the diag itself has been read
+        if (elem.tag == "diag" or diag_depth == 0) and stack:
+            elem.clear()
+            stack[-1].remove(elem)
+
+
+def write_indexed_codes(records, output_path: str) -> int:
+    """
+    Writes code records as JSON lines, plus an index of the byte offset of each code.
+
+    The index is saved next to the records as `<output_path>.index.npz`, with the codes
+    sorted for binary search (see CodeMetadataFile).
+
+    Args:
+        records (Iterable[Dict]): Records with a 'code' field.
+        output_path (str): Path of the JSON lines file.
+
+    Returns:
+        int: Number of records written.
+    """
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    codes, offsets = [], []
+    with open(output_path, "wb") as f:
+        for record in records:
+            codes.append(record["code"].encode("ascii"))
+            offsets.append(f.tell())
+            f.write(json.dumps(record).encode("utf-8") + b"\n")
+
+    codes = np.array(codes, dtype="S")
+    order = np.argsort(codes, kind="stable")
+    np.savez(
+        f"{output_path}.index.npz",
+        codes=codes[order],
+        offsets=np.array(offsets, dtype=np.int64)[order],
+    )
+    return len(codes)
+
+
+class CodeMetadataFile:
+    """
+    Random access to the records written by `write_indexed_codes`, without loading the file.
+
+    Attributes:
+        path (str): Path of the JSON lines file.
+        codes (np.ndarray): Sorted codes.
+        offsets (np.ndarray): Byte offset of the record of each code.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with np.load(f"{path}.index.npz") as index:
+            self.codes = index["codes"]
+            self.offsets = index["offsets"]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return self.offset(code) is not None
+
+    def offset(self, code: str):
+        key = code.encode("ascii", "replace")
+        position = np.searchsorted(self.codes, key)
+        if position < len(self.codes) and self.codes[position] == key:
+            return int(self.offsets[position])
+        return None
+
+    def get(self, code: str, default=None):
+        """
+        Reads the record of a code, or returns `default` if the code is not in the file.
+        """
+        offset = self.offset(code)
+        if offset is None:
+            return default
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def __iter__(self):
+        with open(self.path, "rb") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Extract codes and notes from an ICD-10-CM tabular XML file."
+    )
+    parser.add_argument(
+        "--year", type=int, default=2025, help="Release year of the tabular XML file."
+    )
+    parser.add_argument(
+        "--xml-file", help="Path of the XML file. Defaults to icd10cm_tabular_<year>.xml."
+    )
+    parser.add_argument(
+        "--output", default="icd10_data_files/icd10_codes_with_metadata.jsonl"
+    )
+    args = parser.parse_args()
+
+    xml_path = args.xml_file or f"icd10cm_tabular_{args.year}.xml"
+    num_codes = write_indexed_codes(iter_icd10_xml(xml_path), args.output)
+    print(f"Wrote {num_codes} codes from {xml_path} to {args.output}")
 
 
 if __name__ == "__main__":
-    codes = main()
-    write_json(codes, "icd10_data_files/icd10_codes_with_metadata.json")
+    main()
@@ -0,0 +1,186 @@
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+from .backends import DEFAULT_MODEL
+from .utils import setup_loggers
+
+logger = setup_loggers()
+
+# Columns used to list candidate codes from the retriever
+CANDIDATE_COLUMNS = ("code", "description", "is_billable")
+
+# Rough characters per token, used when no local tokenizer is available
+CHARS_PER_TOKEN = 4
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+@contextmanager
+def offline_tiktoken():
+    """
+    Makes tiktoken read encoding data only from its local cache (TIKTOKEN_CACHE_DIR),
+    raising instead of downloading it.
+    """
+    import tiktoken.load
+
+    read_file = tiktoken.load.read_file
+
+    def read_local_file(blobpath):
+        if "://" in blobpath:
+            raise FileNotFoundError(f"{blobpath} is not in the local tiktoken cache")
+        return read_file(blobpath)
+
+    tiktoken.load.read_file = read_local_file
+    try:
+        yield
+    finally:
+        tiktoken.load.read_file = read_file
+
+
+def get_encoding(model=DEFAULT_MODEL):
+    """
+    Load the tiktoken encoding for a model from the local tiktoken cache, or None if
+    tiktoken or its data is unavailable. Encoding data is never downloaded, so that
+    air-gapped deployments do not wait on the network.
+    """
+    with _encodings_lock:
+        if model not in _encodings:
+            try:
+                import tiktoken
+
+                with offline_tiktoken():
+                    _encodings[model] = tiktoken.encoding_for_model(model)
+            except Exception as e:
+                logger.warning(
+                    f"Local tokenizer for {model} unavailable ({e}). Estimating token counts from characters."
+                )
+                _encodings[model] = None
+        return _encodings[model]
+
+
+def count_tokens(text: str, model=DEFAULT_MODEL) -> int:
+    """
+    Count the tokens of a text with the model's local tokenizer.
+
+    Args:
+        text (str): Text to count.
+        model (str): Name of the model whose tokenizer is used.
+
+    Returns:
+        int: Number of tokens, estimated from the text length if no tokenizer is available.
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def format_value(value) -> str:
+    if isinstance(value, bool):
+        return "Y" if value else "N"
+    if hasattr(value, "value"):
+        value = value.value
+    return " ".join(str(value).replace("|", "/").split())
+
+
+def format_table(rows: Sequence[Dict], columns: Sequence[str]) -> str:
+    """
+    Encode records as a compact pipe-delimited table with a single header line.
+
+    Args:
+        rows (Sequence[Dict]): Records to encode.
+        columns (Sequence[str]): Fields to include, in order. Missing fields are left empty.
+
+    Returns:
+        str: The table, or "(none)" if there are no rows.
+    """
+    if not rows:
+        return "(none)"
+    lines = ["|".join(columns)]
+    lines.extend(format_row(row, columns) for row in rows)
+    return "\n".join(lines)
+
+
+def format_row(row: Dict, columns: Sequence[str]) -> str:
+    return "|".join(format_value(row.get(column, "")) for column in columns)
+
+
+def dedupe_candidates(candidates: Sequence[Dict], exclude=()) -> List[Dict]:
+    """
+    Drop repeated candidate codes, keeping the highest-ranked (first) occurrence.
+
+    Args:
+        candidates (Sequence[Dict]): Candidate codes, best first.
+        exclude (Iterable[str]): Codes to leave out, e.g. codes already assigned.
+
+    Returns:
+        List[Dict]: Unique candidates, best first.
+    """
+    seen = set(exclude)
+    unique = []
+    for candidate in candidates:
+        if candidate["code"] not in seen:
+            seen.add(candidate["code"])
+            unique.append(candidate)
+    return unique
+
+
+def build_prompt(
+    instructions: str,
+    sections: Sequence[Tuple[str, str]],
+    candidates: Sequence[Dict] = (),
+    candidate_title: str = "",
+    candidate_columns: Sequence[str] = CANDIDATE_COLUMNS,
+    token_budget: int = None,
+    model=DEFAULT_MODEL,
+) -> str:
+    """
+    Assemble a prompt from titled sections and a ranked table of candidate codes.
+
+    If the prompt exceeds the token budget, the lowest-ranked candidates are trimmed until
+    it fits. The other sections are never trimmed.
+
+    Args:
+        instructions (str): Task instructions placed first.
+        sections (Sequence[Tuple[str, str]]): (title, body) pairs placed after the instructions.
+        candidates (Sequence[Dict]): Candidate codes, best first, placed last.
+        candidate_title (str): Title of the candidate section.
+        candidate_columns (Sequence[str]): Fields of the candidates to include.
+        token_budget (int, optional): Maximum number of prompt tokens. Defaults to no limit.
+        model (str): Name of the model whose tokenizer is used.
+
+    Returns:
+        str: The prompt.
+    """
+    prompt = "\n\n".join(
+        [instructions] + [f"{title}:\n{body}" for title, body in sections]
+    )
+    if not candidates:
+        return prompt
+
+    rows = [format_row(candidate, candidate_columns) for candidate in candidates]
+    header = f"\n\n{candidate_title}:\n" + "|".join(candidate_columns)
+
+    num_rows = len(rows)
+    if token_budget is not None:
+        available = token_budget - count_tokens(prompt + header, model)
+        num_rows = 0
+        for row in rows:
+            available -= count_tokens("\n" + row, model)
+            if available < 0:
+                break
+            num_rows += 1
+        if num_rows < len(rows):
+            logger.info(
+                f"Trimmed {len(rows) - num_rows} of {len(rows)} candidate codes to fit a budget of {token_budget} tokens."
+            )
+        if num_rows == 0:
+            if count_tokens(prompt, model) > token_budget:
+                logger.warning(
+                    f"Prompt exceeds the budget of {token_budget} tokens without any candidate codes."
+                )
+            return prompt
+
+    return prompt + header + "".join("\n" + row for row in rows[:num_rows])
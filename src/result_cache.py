@@ -0,0 +1,180 @@
+import copy
+import time
+from typing import Dict, Optional
+
+from .cache import LRUCache, SQLiteCache, hash_key
+from .evidence import WHITESPACE, EvidenceMatcher
+from .metrics import NOTE_CACHE_LOOKUPS
+from .utils import setup_loggers
+
+logger = setup_loggers()
+
+
+def normalize_note(note: str) -> str:
+    """
+    Lowercases a note and collapses whitespace runs, so that resubmissions differing only
+    in case, line breaks or indentation share a cache entry.
+    """
+    return WHITESPACE.sub(" ", note).strip().lower()
+
+
+def pipeline_fingerprint(
+    agent_definitions: Dict, model: str, code_set_version: str, **settings
+) -> str:
+    """
+    Identifies everything besides the note that determines the result of the pipeline.
+
+    Args:
+        agent_definitions (Dict): Contents of agent_definitions.json.
+        model (str): Name of the model the agents call.
+        code_set_version (str): Version of the ICD-10-CM code set, e.g. CodeTable.fingerprint().
+        **settings: Other settings affecting the result, such as the evidence mode.
+
+    Returns:
+        str: Hash of the arguments.
+    """
+    return hash_key(agent_definitions, model, code_set_version, settings)
+
+
+class NoteResultCache:
+    """
+    Cache of the final codes of processed notes, in memory and optionally on disk.
+
+    Entries are keyed by a hash of the normalized note and the pipeline fingerprint (see
+    pipeline_fingerprint), so they are only reused by the same agent definitions, model and
+    code set. The on-disk store records the fingerprint it was filled with; when it is opened
+    with a different fingerprint, because agent_definitions.json or the ICD-10-CM release
+    changed, its entries are invalidated.
+
+    When a note only matches a cached one after normalization, the evidence spans of the
+    cached codes are located again in the new note.
+
+    Attributes:
+        fingerprint (str): Pipeline fingerprint of the cached results.
+        ttl (float): Seconds after which a result expires, or None to never expire.
+        memory (LRUCache): In-process cache of the most recently used results.
+        store (SQLiteCache): Persistent cache shared by the workers, or None.
+        hits (int): Number of lookups that found a result.
+        misses (int): Number of lookups that found no live result.
+    """
+
+    def __init__(
+        self,
+        fingerprint: str,
+        maxsize: int = 1024,
+        ttl: float = None,
+        path: str = None,
+        max_entries: int = 100_000,
+    ):
+        self.fingerprint = fingerprint
+        self.ttl = ttl
+        # Expiry is checked against the entries' own timestamps, which also holds for
+        # entries copied from the persistent store
+        self.memory = LRUCache(maxsize=maxsize)
+        self.store = SQLiteCache(path, max_entries=max_entries) if path else None
+        self.hits = 0
+        self.misses = 0
+
+        if self.store is not None and self.store.get_meta("fingerprint") != fingerprint:
+            stale = len(self.store)
+            if stale:
+                logger.info(
+                    f"Agent definitions, model or code set changed. Invalidating {stale} cached note results."
+                )
+            self.invalidate()
+
+    def key(self, note: str) -> str:
+        return hash_key(normalize_note(note), self.fingerprint)
+
+    def get(self, note: str) -> Optional[Dict]:
+        """
+        Looks up the result of a note.
+
+        Args:
+            note (str): Clinical note.
+
+        Returns:
+            Optional[Dict]: A copy of the cached result, or None.
+        """
+        key = self.key(note)
+        entry = self.memory.get(key)
+        if entry is None and self.store is not None:
+            entry = self.store.get(key)
+            if entry is not None:
+                self.memory.put(key, entry)
+
+        expires_at = entry and entry["expires_at"]
+        if expires_at is not None and expires_at <= time.time():
+            self.memory.delete(key)
+            if self.store is not None:
+                self.store.delete(key)
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            NOTE_CACHE_LOOKUPS.labels(result="miss").inc()
+            return None
+        self.hits += 1
+        NOTE_CACHE_LOOKUPS.labels(result="hit").inc()
+
+        result = copy.deepcopy(entry["result"])
+        if entry["note_hash"] != hash_key(note):
+            relocate_evidence(result, note)
+        return result
+
+    def put(self, note: str, result: Dict):
+        """
+        Stores the result of a note.
+
+        Args:
+            note (str): Clinical note.
+            result (Dict): Final codes of the note.
+        """
+        entry = {
+            "result": copy.deepcopy(result),
+            "note_hash": hash_key(note),
+            "expires_at": None if self.ttl is None else time.time() + self.ttl,
+        }
+        key = self.key(note)
+        self.memory.put(key, entry)
+        if self.store is not None:
+            self.store.put(key, entry)
+
+    def invalidate(self):
+        """
+        Removes all cached results. Other worker processes keep their in-memory results
+        until they expire or the worker restarts.
+        """
+        self.memory.clear()
+        if self.store is not None:
+            self.store.clear()
+            self.store.set_meta("fingerprint", self.fingerprint)
+
+    def stats(self) -> dict:
+        """
+        Returns hit/miss counters of this process and the sizes of both cache levels.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory": self.memory.stats(),
+            "store": self.store.stats() if self.store is not None else None,
+        }
+
+
+def relocate_evidence(result: Dict, note: str):
+    """
+    Replaces the evidence spans of a cached result with the spans of its evidence in `note`.
+    """
+    matcher = EvidenceMatcher(note)
+    for code in result.get("icd10_codes", []):
+        if "evidence_span" not in code:
+            continue
+        span = matcher.locate(code.get("evidence") or "")
+        if span is None:
+            del code["evidence_span"]
+            code["evidence_verified"] = False
+        else:
+            code["evidence_span"] = [span["start"], span["end"]]
@@ -1,51 +1,312 @@
 # Import necessary libraries
-from typing import List, Dict
+from typing import Callable, List, Dict
 from rapidfuzz import fuzz
-from rapidfuzz.process import extract
+from rapidfuzz.process import cdist, extract
 
-import faiss
 import numpy as np
 import json
 import os
-from sentence_transformers import SentenceTransformer
+from collections import defaultdict
+from .bm25 import BM25Index
+from .cache import LRUCache
+from .code_table import CodeTable, decode_code_ids, encode_code_ids
+from .embeddings import SentenceEmbedder
+from .fusion import fuse_results
 from .utils import setup_loggers
 
 logger = setup_loggers()
 
+# Version of the on-disk layout written by FaissDocumentRetriever.save. Version 3 keys
+# the index by code ids (see encode_code_ids) instead of table rows.
+CACHE_FORMAT_VERSION = 3
+SUPPORTED_CACHE_FORMAT_VERSIONS = (2, 3)
 
-# Updated code to include model_name saving/loading
+# Name of the file in a cache directory holding the name of the current cache version
+CURRENT_VERSION_FILE = "CURRENT"
+
+# Files written by FaissDocumentRetriever.save before the cache was versioned
+LEGACY_CACHE_FILES = ["documents.json", "model_name.txt", "index.faiss"]
+
+
+def faiss_mmap_flag() -> int:
+    """
+    Returns the read flag that maps the stored vectors of an index instead of copying them.
+    """
+    import faiss
+
+    return getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a query for caching by lowercasing and collapsing whitespace.
+    """
+    return " ".join(query.lower().split())
+
+
+# Default build and search parameters for each supported FAISS index type
+INDEX_DEFAULTS = {
+    "flat": {},
+    "hnsw": {"M": 32, "efConstruction": 200, "efSearch": 64},
+    "ivf": {"nlist": 1024, "nprobe": 16},
+}
+
+# Parameters that only affect search and may be changed on a built index
+SEARCH_PARAMS = {"hnsw": ["efSearch"], "ivf": ["nprobe"]}
+
+
+def resolve_index_params(index_type: str, index_params: Dict = None) -> Dict:
+    """
+    Merges user-provided index parameters with the defaults for an index type.
+
+    Args:
+        index_type (str): One of 'flat', 'hnsw' or 'ivf'.
+        index_params (Dict, optional): Overrides for the default parameters.
+
+    Returns:
+        Dict: The full parameter set for the index type.
+    """
+    if index_type not in INDEX_DEFAULTS:
+        raise ValueError(
+            f"Unknown index type '{index_type}'. Expected one of {list(INDEX_DEFAULTS)}."
+        )
+    params = dict(INDEX_DEFAULTS[index_type])
+    params.update(index_params or {})
+    unknown = set(params) - set(INDEX_DEFAULTS[index_type])
+    if unknown:
+        raise ValueError(f"Unknown parameters for '{index_type}' index: {unknown}")
+    return params
+
+
+def configure_index(index, index_type: str, index_params: Dict):
+    """
+    Applies search-time parameters (e.g. nprobe, efSearch) to a FAISS index.
+
+    Args:
+        index: The FAISS index to configure.
+        index_type (str): One of 'flat', 'hnsw' or 'ivf'.
+        index_params (Dict): Parameters for the index type.
+    """
+    import faiss
+
+    parameter_space = faiss.ParameterSpace()
+    for name in SEARCH_PARAMS.get(index_type, []):
+        if name in index_params:
+            parameter_space.set_index_parameter(index, name, index_params[name])
+
+
+def build_index(
+    embeddings: np.ndarray,
+    index_type: str = "flat",
+    index_params: Dict = None,
+    ids: np.ndarray = None,
+):
+    """
+    Builds a FAISS index of the requested type over a matrix of embeddings.
+
+    Args:
+        embeddings (np.ndarray): Matrix of document embeddings, one row per document.
+        index_type (str): One of 'flat' (exact), 'hnsw' or 'ivf' (approximate).
+        index_params (Dict, optional): Overrides for the default index parameters.
+        ids (np.ndarray, optional): int64 id of each document. If given, the index is wrapped
+            in an IndexIDMap2 and searches return these ids instead of row numbers.
+
+    Returns:
+        faiss.Index: The trained and populated index.
+    """
+    import faiss
+
+    params = resolve_index_params(index_type, index_params)
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    dim = embeddings.shape[1]
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, params["M"])
+        index.hnsw.efConstruction = params["efConstruction"]
+    elif index_type == "ivf":
+        nlist = min(params["nlist"], embeddings.shape[0])
+        index = faiss.index_factory(dim, f"IVF{nlist},Flat")
+        index.train(embeddings)
+
+    if ids is None:
+        index.add(embeddings)
+    else:
+        index = faiss.IndexIDMap2(index)
+        index.add_with_ids(embeddings, np.ascontiguousarray(ids, dtype=np.int64))
+    configure_index(index, index_type, params)
+    return index
+
+
+def current_cache_dir(cache_dir: str) -> str:
+    """
+    Returns the directory of the current cache version, as named in the CURRENT file of a
+    cache directory, or the cache directory itself if it is not versioned.
+    """
+    current_path = os.path.join(cache_dir, CURRENT_VERSION_FILE)
+    if not os.path.isfile(current_path):
+        return cache_dir
+    with open(current_path, "r") as f:
+        return os.path.join(cache_dir, "versions", f.read().strip())
+
+
+def publish_cache_version(
+    retriever, cache_dir: str, version: str, before_publish: Callable[[str], None] = None
+) -> str:
+    """
+    Saves a retriever as a new version of a cache directory and makes it the current one.
+
+    The version is written to versions/<version> first, then the CURRENT file is replaced
+    atomically, so a process starting at any time loads either the old or the new version
+    in full. Older versions are kept, and rolling back only rewrites CURRENT.
+
+    Args:
+        retriever (FaissDocumentRetriever): Retriever to save.
+        cache_dir (str): Cache directory.
+        version (str): Name of the new version, e.g. '2026'.
+        before_publish (Callable[[str], None], optional): Called with the version directory
+            after the retriever is saved and before the version becomes current, to save
+            further artifacts such as the BM25 index.
+
+    Returns:
+        str: Directory of the new version.
+    """
+    version_dir = os.path.join(cache_dir, "versions", version)
+    if os.path.exists(version_dir):
+        raise FileExistsError(f"Cache version {version_dir} already exists")
+    retriever.save(version_dir)
+    if before_publish is not None:
+        before_publish(version_dir)
+
+    current_path = os.path.join(cache_dir, CURRENT_VERSION_FILE)
+    tmp_path = f"{current_path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, current_path)
+    logger.info(f"Cache version {version} is now current in {cache_dir}")
+    return version_dir
 
 
 class FaissDocumentRetriever:
-    def __init__(self, documents: List[Dict], model_name: str, embed_docs=True):
+    def __init__(
+        self,
+        documents,
+        model_name: str,
+        embed_docs=True,
+        index_type: str = "flat",
+        index_params: Dict = None,
+        cache_size: int = 4096,
+        cache_ttl: float = None,
+        embedding_backend: str = "torch",
+        batch_size: int = 64,
+        num_workers: int = 0,
+    ):
         """
         Initializes the retriever with a set of documents and generates their embeddings.
 
         Args:
-            documents (List[Dict]): List of JSON objects with 'code', 'description', and 'is_billable' fields.
+            documents (List[Dict] | CodeTable): List of JSON objects with 'code', 'description', and 'is_billable'
+                fields, or an already built CodeTable.
             model_name (str): The name of the SentenceTransformer model to use.
+            index_type (str): FAISS index type: 'flat' (exact), 'hnsw' or 'ivf'.
+            index_params (Dict, optional): Overrides for the index build and search parameters,
+                e.g. {"M": 32, "efSearch": 64} for HNSW or {"nlist": 1024, "nprobe": 16} for IVF.
+            cache_size (int): Maximum number of query embeddings and of top-k results kept in memory.
+            cache_ttl (float, optional): Seconds after which cached queries expire. Defaults to never.
+            embedding_backend (str): Inference backend of the model: 'torch', 'int8' or 'onnx'
+                (see SentenceEmbedder).
+            batch_size (int): Number of texts per forward pass of the model.
+            num_workers (int): Number of processes embedding the documents when the index is
+                built, or 0 to embed them in this process.
         """
-        self.documents = {
-            doc["code"]: {
-                "description": doc["description"],
-                "is_billable": doc["is_billable"],
-            }
-            for doc in documents
-        }
-        self.codes = [doc["code"] for doc in documents]
+        if isinstance(documents, CodeTable):
+            self.table = documents
+        else:
+            self.table = CodeTable.from_records(documents)
         self.model_name = model_name
-
-        # Generate embeddings using SentenceTransformer
-        self.model = SentenceTransformer(model_name)
-        descriptions = [doc["description"] for doc in documents]
+        self.index_type = index_type
+        self.index_params = resolve_index_params(index_type, index_params)
+        self.embeddings = None
+        self.embedder = SentenceEmbedder(
+            model_name,
+            backend=embedding_backend,
+            batch_size=batch_size,
+            num_workers=num_workers,
+        )
+        # 'codes' if the index returns code ids (see encode_code_ids), 'rows' if it returns
+        # table rows, as in caches written before format version 3
+        self.index_ids = "codes"
+        self.embedding_cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self.result_cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
 
         if embed_docs:
             logger.info("Computing index of documents. This may take a minute.")
-            embeddings = self.model.encode(descriptions)
+            descriptions = [
+                self.table.description(idx) for idx in range(len(self.table))
+            ]
+            self.embeddings = self.embedder.encode_documents(descriptions)
+
+            # Create FAISS index, keyed by code so that it can be updated in place
+            self.index = build_index(
+                self.embeddings,
+                index_type,
+                self.index_params,
+                ids=encode_code_ids(self.table.codes),
+            )
+
+    @property
+    def model(self):
+        """
+        The SentenceTransformer used to embed queries, built on first use.
+        """
+        return self.embedder.model
+
+    def set_search_params(self, **search_params):
+        """
+        Updates search-time parameters (nprobe for IVF, efSearch for HNSW) on the loaded index.
+
+        Args:
+            **search_params: Parameter values keyed by name.
+        """
+        params = dict(self.index_params)
+        params.update(search_params)
+        self.index_params = resolve_index_params(self.index_type, params)
+        configure_index(self.index, self.index_type, self.index_params)
+        self.result_cache.clear()
+
+    def cache_info(self) -> Dict:
+        """
+        Returns hit/miss counters for the query embedding and retrieval result caches.
+        """
+        return {
+            "embeddings": self.embedding_cache.stats(),
+            "results": self.result_cache.stats(),
+        }
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        Embeds normalized query strings, encoding only those not already cached.
+
+        Args:
+            queries (List[str]): Normalized query strings.
 
-            # Create FAISS index
-            self.index = faiss.IndexFlatL2(embeddings.shape[1])
-            self.index.add(embeddings.astype(np.float32))
+        Returns:
+            np.ndarray: Query embedding matrix, one row per query.
+        """
+        embeddings = [
+            self.embedding_cache.get((self.model_name, query)) for query in queries
+        ]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            # Generate the missing query embeddings in one batch
+            encoded = self.embedder.encode([queries[i] for i in missing])
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = embedding
+                self.embedding_cache.put((self.model_name, queries[i]), embedding)
+        return np.ascontiguousarray(np.stack(embeddings), dtype=np.float32)
 
     def retrieve(self, query: str, k: int = 10) -> List[Dict]:
         """
@@ -56,103 +317,346 @@ class FaissDocumentRetriever:
             k (int): The number of top candidates to retrieve.
 
         Returns:
-            List[Dict]: A list of the top-k documents with their 'code', 'description', and 'is_billable' fields.
+            List[Dict]: A list of the top-k documents with their 'code', 'description', 'is_billable'
+                and 'distance' (squared L2 distance to the query, lower is closer) fields.
         """
-        # Generate query embedding
-        query_embedding = self.model.encode(query, convert_to_numpy=True)[np.newaxis, :]
+        return self.retrieve_batch([query], k=k)[0]
 
-        # Search for the top-k nearest neighbors
-        distances, indices = self.index.search(query_embedding.astype(np.float32), k)
+    def retrieve_batch(self, queries: List[str], k: int = 10) -> List[List[Dict]]:
+        """
+        Retrieves the top-k documents for each of several query strings.
 
-        # Map indices to document codes and descriptions
-        results = []
-        for idx in indices[0]:
-            code = self.codes[idx]
-            doc = self.documents[code]
-            results.append(
-                {
-                    "code": code,
-                    "description": doc["description"],
-                    "is_billable": doc["is_billable"],
-                }
-            )
+        Queries are normalized (case and whitespace) and looked up in the result cache.
+        The remaining queries are encoded in a single forward pass and searched with a
+        single FAISS call over the full query matrix.
 
-        return results
+        Args:
+            queries (List[str]): The query strings to search for similar documents.
+            k (int): The number of top candidates to retrieve per query.
+
+        Returns:
+            List[List[Dict]]: One list of top-k documents per query, in query order.
+        """
+        if not queries:
+            return []
+
+        normalized = [normalize_query(query) for query in queries]
+        results = [
+            self.result_cache.get((self.model_name, query, k)) for query in normalized
+        ]
+
+        # Positions of each distinct query that missed the result cache
+        missing = defaultdict(list)
+        for i, (query, cached) in enumerate(zip(normalized, results)):
+            if cached is None:
+                missing[query].append(i)
+
+        if missing:
+            missing_queries = list(missing)
+            query_embeddings = self.embed_queries(missing_queries)
+
+            # Search for the top-k nearest neighbors of every query at once
+            distances, ids = self.index.search(query_embeddings, k)
+            indices = self.rows_of_ids(ids)
+
+            # Map indices to document codes and descriptions
+            for query, distance_row, row in zip(missing_queries, distances, indices):
+                row_results = [
+                    {**self.table.record(idx), "distance": float(distance)}
+                    for distance, idx in zip(distance_row, row)
+                    if idx >= 0
+                ]
+                self.result_cache.put((self.model_name, query, k), row_results)
+                for i in missing[query]:
+                    results[i] = row_results
+
+        # Copy so that callers cannot modify cached results
+        return [[dict(doc) for doc in row_results] for row_results in results]
+
+    def rows_of_ids(self, ids: np.ndarray) -> np.ndarray:
+        """
+        Maps ids returned by an index search to code table rows, keeping -1 for missing
+        results.
+        """
+        if self.index_ids == "rows":
+            return ids
+        rows = np.full(ids.shape, -1, dtype=np.int64)
+        found = ids >= 0
+        rows[found] = self.table.find(decode_code_ids(ids[found]))
+        return rows
+
+    def reconstruct_embeddings(self) -> np.ndarray:
+        """
+        Reads the document vectors back from the index, for caches saved without
+        embeddings.npy. IVF indexes can only look up vectors by id once their direct map
+        is built.
+        """
+        import faiss
+
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+            ivf.make_direct_map()
+        return self.index.reconstruct_n(0, self.index.ntotal)
 
     def save(self, save_dir: str):
         """
-        Saves the documents, model_name, and FAISS index to a specified directory.
+        Saves the code table, embeddings and FAISS index to a specified directory.
 
         Args:
             save_dir (str): Directory where the objects will be saved. Files will be named:
-                           - documents.json
-                           - model_name.txt
+                           - manifest.json (format version, model name and index configuration)
+                           - code_table/ (see CodeTable.save)
+                           - embeddings.npy
                            - index.faiss
         """
+        import faiss
+
         os.makedirs(save_dir, exist_ok=True)
 
-        document_path = os.path.join(save_dir, "documents.json")
-        model_name_path = os.path.join(save_dir, "model_name.txt")
+        manifest_path = os.path.join(save_dir, "manifest.json")
         index_path = os.path.join(save_dir, "index.faiss")
         embedding_path = os.path.join(save_dir, "embeddings.npy")
 
-        with open(document_path, "w") as doc_file:
+        embeddings = self.embeddings
+        if embeddings is None:
+            embeddings = self.reconstruct_embeddings()
+
+        self.table.save(os.path.join(save_dir, "code_table"))
+        np.save(embedding_path, np.ascontiguousarray(embeddings, dtype=np.float32))
+        faiss.write_index(self.index, index_path)
+
+        # The manifest is written last so that a partially written cache is never loaded
+        with open(manifest_path, "w") as manifest_file:
             json.dump(
-                [
-                    {
-                        "code": code,
-                        "description": doc["description"],
-                        "is_billable": doc["is_billable"],
-                    }
-                    for code, doc in self.documents.items()
-                ],
-                doc_file,
+                {
+                    "format_version": CACHE_FORMAT_VERSION,
+                    "model_name": self.model_name,
+                    "embedding_backend": self.embedder.backend,
+                    "index_ids": self.index_ids,
+                    "index_type": self.index_type,
+                    "index_params": self.index_params,
+                    "num_documents": len(self.table),
+                    "embedding_dim": int(embeddings.shape[1]),
+                },
+                manifest_file,
+                indent=2,
             )
+        logger.info(f"Cached retriever saved to {save_dir}")
 
-        with open(model_name_path, "w") as model_file:
-            model_file.write(self.model_name)
+    @staticmethod
+    def cache_exists(save_dir: str) -> bool:
+        """
+        Checks whether a saved retriever (current or legacy format) exists in a directory.
+        """
+        return os.path.isfile(os.path.join(save_dir, "manifest.json")) or all(
+            os.path.isfile(os.path.join(save_dir, x)) for x in LEGACY_CACHE_FILES
+        )
 
-        faiss.write_index(self.index, index_path)
-        np.save(embedding_path, self.index.reconstruct_n(0, self.index.ntotal))
-        logger.info(f"Cached retriever saved to {save_dir}")
+    @staticmethod
+    def is_legacy_cache(save_dir: str) -> bool:
+        """
+        Checks whether a directory holds a cache written before the versioned format.
+        """
+        return not os.path.isfile(os.path.join(save_dir, "manifest.json"))
 
     @classmethod
-    def load(cls, save_dir: str):
+    def load(
+        cls,
+        save_dir: str,
+        search_params: Dict = None,
+        mmap: bool = True,
+        cache_size: int = 4096,
+        cache_ttl: float = None,
+        embedding_backend: str = None,
+    ):
         """
         Loads the retriever from the specified directory.
 
+        The code table, embeddings and index are memory-mapped, so loading does not copy
+        the vectors into memory and processes loading the same cache share its pages. The
+        SentenceTransformer is only built when the first query is encoded.
+
         Args:
-            save_dir (str): Directory containing the saved files:
-                           - documents.json
-                           - model_name.txt
-                           - index.faiss
+            save_dir (str): Directory containing the files written by `save`.
+            search_params (Dict, optional): Overrides for the saved search-time parameters.
+            mmap (bool): Memory-map the cache files instead of reading them into memory.
+            cache_size (int): Size of the query embedding and result caches.
+            cache_ttl (float, optional): Seconds after which cached queries expire.
+            embedding_backend (str, optional): Backend used to embed queries. Defaults to the
+                backend the index was built with.
 
         Returns:
             FaissDocumentRetriever: The loaded FaissDocumentRetriever instance.
         """
+        import faiss
+
         logger.info(f"Loading cached retriever from {save_dir}")
 
-        document_path = os.path.join(save_dir, "documents.json")
-        model_name_path = os.path.join(save_dir, "model_name.txt")
-        index_path = os.path.join(save_dir, "index.faiss")
-        embedding_path = os.path.join(save_dir, "embeddings.npy")
+        if cls.is_legacy_cache(save_dir):
+            return cls._load_legacy(
+                save_dir, search_params, cache_size, cache_ttl, embedding_backend
+            )
 
-        with open(document_path, "r") as doc_file:
+        with open(os.path.join(save_dir, "manifest.json"), "r") as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest["format_version"] not in SUPPORTED_CACHE_FORMAT_VERSIONS:
+            raise ValueError(
+                f"Unsupported retriever cache format version {manifest['format_version']} in {save_dir}. "
+                f"Delete the cache to rebuild it."
+            )
+
+        table = CodeTable.load(os.path.join(save_dir, "code_table"), mmap=mmap)
+        io_flags = faiss_mmap_flag() if mmap else 0
+        index = faiss.read_index(os.path.join(save_dir, "index.faiss"), io_flags)
+
+        retriever = cls(
+            table,
+            manifest["model_name"],
+            embed_docs=False,
+            index_type=manifest["index_type"],
+            index_params=manifest["index_params"],
+            cache_size=cache_size,
+            cache_ttl=cache_ttl,
+            embedding_backend=embedding_backend
+            or manifest.get("embedding_backend", "torch"),
+        )
+        retriever.index = index
+        retriever.index_ids = manifest.get("index_ids", "rows")
+        retriever.embeddings = np.load(
+            os.path.join(save_dir, "embeddings.npy"), mmap_mode="r" if mmap else None
+        )
+        retriever.set_search_params(**(search_params or {}))
+
+        return retriever
+
+    @classmethod
+    def _load_legacy(
+        cls,
+        save_dir: str,
+        search_params: Dict = None,
+        cache_size: int = 4096,
+        cache_ttl: float = None,
+        embedding_backend: str = None,
+    ):
+        """
+        Loads a cache written before the versioned format (documents.json, model_name.txt,
+        optional index_config.json and index.faiss). The saved index already holds every
+        vector, so embeddings.npy is not added to it again.
+        """
+        import faiss
+
+        logger.warning(
+            f"Retriever cache in {save_dir} uses the legacy format. Re-save it to enable memory-mapped loading."
+        )
+
+        with open(os.path.join(save_dir, "documents.json"), "r") as doc_file:
             documents = json.load(doc_file)
 
-        with open(model_name_path, "r") as model_file:
+        with open(os.path.join(save_dir, "model_name.txt"), "r") as model_file:
             model_name = model_file.read().strip()
 
-        index = faiss.read_index(index_path)
-        embeddings = np.load(embedding_path)
-
-        retriever = cls(documents, model_name, embed_docs=False)
-        retriever.index = index
-        retriever.index.add(embeddings.astype(np.float32))
+        index_config = {"index_type": "flat", "index_params": {}}
+        index_config_path = os.path.join(save_dir, "index_config.json")
+        if os.path.isfile(index_config_path):
+            with open(index_config_path, "r") as config_file:
+                index_config = json.load(config_file)
+
+        retriever = cls(
+            documents,
+            model_name,
+            embed_docs=False,
+            index_type=index_config["index_type"],
+            index_params=index_config["index_params"],
+            cache_size=cache_size,
+            cache_ttl=cache_ttl,
+            embedding_backend=embedding_backend or "torch",
+        )
+        retriever.index = faiss.read_index(os.path.join(save_dir, "index.faiss"))
+        retriever.index_ids = "rows"
+        retriever.set_search_params(**(search_params or {}))
 
         return retriever
 
 
+class HybridRetriever:
+    """
+    Combines dense retrieval with BM25 keyword retrieval over the same code table.
+
+    Dense embeddings capture paraphrases, while BM25 catches exact clinical terms such as
+    drug names and eponyms. For every query, both result lists are fused with reciprocal
+    rank fusion. BM25 lookups only touch the postings of the query terms, so the hybrid
+    mode adds little latency to dense retrieval.
+
+    Attributes:
+        dense (FaissDocumentRetriever): Dense retriever.
+        sparse (BM25Index): BM25 index over the descriptions of the dense retriever's table.
+        table (CodeTable): Table of the codes, shared by both retrievers.
+    """
+
+    def __init__(self, dense: FaissDocumentRetriever, sparse: BM25Index):
+        if sparse.num_documents != len(dense.table):
+            raise ValueError(
+                f"BM25 index has {sparse.num_documents} documents but the dense retriever has {len(dense.table)}."
+            )
+        self.dense = dense
+        self.sparse = sparse
+        self.table = dense.table
+
+    @classmethod
+    def from_dense(cls, dense: FaissDocumentRetriever, k1: float = 1.5, b: float = 0.75):
+        """
+        Builds the BM25 index over the descriptions of a dense retriever's code table.
+        """
+        descriptions = [dense.table.description(idx) for idx in range(len(dense.table))]
+        return cls(dense, BM25Index.build(descriptions, k1=k1, b=b))
+
+    def cache_info(self) -> Dict:
+        return self.dense.cache_info()
+
+    def retrieve_sparse(self, query: str, k: int = 10) -> List[Dict]:
+        """
+        Retrieves the top-k documents by BM25 score, with a 'bm25_score' field.
+        """
+        scores, indices = self.sparse.search(query, k)
+        return [
+            {**self.table.record(idx), "bm25_score": float(score)}
+            for score, idx in zip(scores, indices)
+        ]
+
+    def retrieve(self, query: str, k: int = 10) -> List[Dict]:
+        """
+        Retrieves the top-k documents for a given query string by fusing dense and BM25 results.
+
+        Args:
+            query (str): The query string to search for similar documents.
+            k (int): The number of top candidates to retrieve.
+
+        Returns:
+            List[Dict]: The top-k documents with their 'code', 'description', 'is_billable' and
+                fused 'score' fields, plus 'distance' and 'bm25_score' when found by the
+                respective retriever.
+        """
+        return self.retrieve_batch([query], k=k)[0]
+
+    def retrieve_batch(self, queries: List[str], k: int = 10) -> List[List[Dict]]:
+        """
+        Retrieves the top-k documents for each of several query strings. Dense results are
+        searched in a single batch (see FaissDocumentRetriever.retrieve_batch).
+
+        Args:
+            queries (List[str]): The query strings to search for similar documents.
+            k (int): The number of top candidates to retrieve per query.
+
+        Returns:
+            List[List[Dict]]: One list of top-k documents per query, in query order.
+        """
+        dense_results = self.dense.retrieve_batch(queries, k=k)
+        return [
+            fuse_results([dense, self.retrieve_sparse(query, k)], method="rrf", limit=k)
+            for query, dense in zip(queries, dense_results)
+        ]
+
+
 # Define the Document class
 class Doc:
     def __init__(self, text: str, metadata: Dict[str, str]):
@@ -162,23 +666,135 @@ class Doc:
 
 # Define the FuzzyDocumentRetriever class
 class FuzzyICD10Retriever:
-    def __init__(self, documents: List[Doc]):
+    """
+    Fuzzy string matching of queries against document texts.
+
+    A character n-gram index shortlists the documents sharing the most n-grams with a query,
+    so only those are scored by the (expensive) fuzzy scorer.
+
+    Attributes:
+        documents (List[Doc]): Documents to search.
+        ngram (int): Length of the character n-grams in the index.
+        max_candidates (int): Number of shortlisted documents scored per query, or None to
+            score every document.
+    """
+
+    def __init__(self, documents: List[Doc], ngram: int = 3, max_candidates: int = 256):
         self.documents = documents
         # self.text_to_index = {document.text:i for i, document in enumerate(self.documents)}
         self.doc_texts = [document.text for document in self.documents]
+        self.ngram = ngram
+        self.max_candidates = max_candidates
+
+        postings = defaultdict(list)
+        for doc_id, text in enumerate(self.doc_texts):
+            for gram in self.ngrams(text):
+                postings[gram].append(doc_id)
+        self.ngram_index = {
+            gram: np.array(doc_ids, dtype=np.int32) for gram, doc_ids in postings.items()
+        }
+
+    def ngrams(self, text: str) -> set:
+        """
+        Returns the distinct character n-grams of a lowercased text.
+        """
+        text = " ".join(text.lower().split())
+        return {text[i : i + self.ngram] for i in range(len(text) - self.ngram + 1)}
+
+    def shortlist(self, query: str) -> np.ndarray:
+        """
+        Returns the sorted ids of the documents sharing the most n-grams with a query, or of
+        all documents if prefiltering is disabled or the query is shorter than an n-gram.
+        """
+        grams = self.ngrams(query)
+        if (
+            self.max_candidates is None
+            or self.max_candidates >= len(self.doc_texts)
+            or not grams
+        ):
+            return np.arange(len(self.doc_texts))
+
+        postings = [self.ngram_index[gram] for gram in grams if gram in self.ngram_index]
+        if not postings:
+            return np.empty(0, dtype=np.int64)
+        overlap = np.bincount(np.concatenate(postings), minlength=len(self.doc_texts))
+        matched = np.flatnonzero(overlap)
+        if len(matched) <= self.max_candidates:
+            return matched
+        top = np.argpartition(-overlap[matched], self.max_candidates)[: self.max_candidates]
+        return np.sort(matched[top])
 
     def retrieve(
         self, query: str, top_k: int = 10, score_cutoff=50, scorer=fuzz.partial_ratio
     ) -> List[Doc]:
-        # Calculate similarity scores between the query and each document's text
+        # Calculate similarity scores between the query and each shortlisted document's text
+        candidates = self.shortlist(query)
         outputs = extract(
-            query, self.doc_texts, limit=top_k, score_cutoff=score_cutoff, scorer=scorer
+            query,
+            [self.doc_texts[i] for i in candidates],
+            limit=top_k,
+            score_cutoff=score_cutoff,
+            scorer=scorer,
         )
-        inds = [x[2] for x in outputs]
+        inds = [candidates[x[2]] for x in outputs]
 
         output_docs = [self.documents[ind] for ind in inds]
         return output_docs
 
+    def retrieve_batch(
+        self, queries: List[str], top_k: int = 10, score_cutoff=50, scorer=fuzz.partial_ratio
+    ) -> List[List[Doc]]:
+        """
+        Retrieves the top-k documents for each of several queries.
+
+        The union of the queries' shortlists is scored against all queries at once with
+        `rapidfuzz.process.cdist` on every CPU core, and each query then only ranks the
+        documents of its own shortlist, as `retrieve` does. When the shortlists barely
+        overlap, the full matrix costs more than the cores save, and each query is scored
+        against its own shortlist instead.
+
+        Args:
+            queries (List[str]): Query strings.
+            top_k (int): Number of documents to return per query.
+            score_cutoff (float): Minimum score of a returned document.
+            scorer: RapidFuzz scorer.
+
+        Returns:
+            List[List[Doc]]: One list of documents per query, best first.
+        """
+        if not queries:
+            return []
+        shortlists = [self.shortlist(query) for query in queries]
+        candidates = np.unique(np.concatenate(shortlists)).astype(np.int64)
+        if not len(candidates):
+            return [[] for _ in queries]
+
+        num_pairs = sum(len(shortlist) for shortlist in shortlists)
+        if len(queries) * len(candidates) > num_pairs * (os.cpu_count() or 1):
+            return [
+                self.retrieve(query, top_k=top_k, score_cutoff=score_cutoff, scorer=scorer)
+                for query in queries
+            ]
+
+        scores = cdist(
+            queries,
+            [self.doc_texts[i] for i in candidates],
+            scorer=scorer,
+            score_cutoff=score_cutoff,
+            workers=-1,
+        )
+
+        results = []
+        for row, shortlist in zip(scores, shortlists):
+            # Columns of the query's own shortlist, in document order like in `retrieve`
+            columns = np.searchsorted(candidates, shortlist)
+            own_scores = row[columns]
+            top = np.argsort(-own_scores, kind="stable")[:top_k]
+            # cdist reports scores below the cutoff as 0
+            top = top[(own_scores[top] >= score_cutoff) & (own_scores[top] > 0)]
+            results.append([self.documents[shortlist[i]] for i in top])
+        return results
+
     def get_code_by_id(
         self,
     ):
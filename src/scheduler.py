@@ -0,0 +1,248 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict
+
+from .metrics import SCHEDULER_QUEUED, SCHEDULER_REJECTED, SCHEDULER_RUNNING
+
+# Lanes in order of priority. Interactive requests come from a user waiting on the result,
+# bulk requests from batch and backfill jobs.
+LANES = ("interactive", "bulk")
+
+
+class Overloaded(Exception):
+    """
+    Raised when a lane's queue is full.
+
+    Attributes:
+        lane (str): Lane that rejected the request.
+        retry_after (int): Suggested number of seconds to wait before retrying.
+    """
+
+    def __init__(self, lane: str, retry_after: int):
+        super().__init__(f"The {lane} queue is full. Retry in {retry_after} s.")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class Reservation:
+    """
+    Queue slots reserved by a batch (see PriorityScheduler.reserve).
+
+    Attributes:
+        lane (str): Lane of the slots.
+        slots (int): Number of reserved slots.
+    """
+
+    def __init__(self, scheduler: "PriorityScheduler", lane: str, slots: int):
+        self.scheduler = scheduler
+        self.lane = lane
+        self.slots = slots
+        self.released = False
+
+    def release(self):
+        """
+        Returns the slots to the lane. Calling it again has no effect.
+        """
+        if not self.released:
+            self.released = True
+            self.scheduler.reserved[self.lane] -= self.slots
+
+
+class PriorityScheduler:
+    """
+    Admission control and priority scheduling of note processing on the event loop.
+
+    At most `max_concurrency` notes are processed at a time. When a slot frees up, waiting
+    interactive notes are started before bulk ones. Bulk notes may only use
+    `max_bulk_concurrency` of the slots, so the rest stay free for interactive notes even
+    while a backfill saturates its lane. Each lane queues at most `max_queue` waiting
+    notes; further requests are rejected with Overloaded, carrying a Retry-After estimate
+    based on the queue length and the recent processing time per note.
+
+    A batch reserves queue slots up front (see `reserve`) and never has more notes in
+    flight than it reserved, so its waiting notes stay within the lane's bound too. Each
+    reservation counts as fully occupied until it is released.
+
+    Attributes:
+        max_concurrency (int): Maximum number of notes processed at the same time.
+        max_bulk_concurrency (int): Maximum number of bulk notes processed at the same time.
+        max_queue (Dict[str, int]): Maximum number of waiting notes per lane.
+        running (Dict[str, int]): Number of notes being processed per lane.
+        reserved (Dict[str, int]): Number of queue slots reserved by batches per lane.
+        mean_seconds (float): Moving average of the processing time of a note.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        max_bulk_concurrency: int = None,
+        max_queue: int = 64,
+        max_bulk_queue: int = None,
+    ):
+        self.max_concurrency = max_concurrency
+        if max_bulk_concurrency is None:
+            max_bulk_concurrency = max(1, max_concurrency * 3 // 4)
+        self.max_bulk_concurrency = min(max_bulk_concurrency, max_concurrency)
+        self.max_queue = {
+            "interactive": max_queue,
+            "bulk": max_queue if max_bulk_queue is None else max_bulk_queue,
+        }
+        self.running = {lane: 0 for lane in LANES}
+        self.reserved = {lane: 0 for lane in LANES}
+        self.mean_seconds = None
+        # Futures of waiting notes, paired with whether a reservation covers them
+        self._waiting = {lane: deque() for lane in LANES}
+        self._reserved_waiting = {lane: 0 for lane in LANES}
+
+    def check_lane(self, lane: str):
+        if lane not in LANES:
+            raise ValueError(f"Unknown priority lane '{lane}'. Expected one of {LANES}.")
+
+    def retry_after(self, lane: str) -> int:
+        """
+        Estimates the seconds until a lane has room for another note.
+        """
+        seconds_per_note = self.mean_seconds or 1.0
+        limit = self.max_concurrency if lane == "interactive" else self.max_bulk_concurrency
+        return max(1, math.ceil(self.queue_length(lane) * seconds_per_note / limit))
+
+    def queue_length(self, lane: str) -> int:
+        """
+        Number of queue slots in use: waiting notes outside of reservations plus reserved slots.
+        """
+        unreserved = len(self._waiting[lane]) - self._reserved_waiting[lane]
+        return unreserved + self.reserved[lane]
+
+    def admit(self, lane: str):
+        """
+        Raises Overloaded if a lane cannot queue another note.
+        """
+        self.check_lane(lane)
+        if self.queue_length(lane) >= self.max_queue[lane] and (
+            self._waiting[lane] or not self._can_start(lane)
+        ):
+            self._reject(lane)
+
+    def reserve(self, lane: str, slots: int) -> Reservation:
+        """
+        Reserves queue slots for a batch, which then runs at most that many notes at a time
+        with `run(..., reserved=True)` and releases the reservation when done.
+
+        Args:
+            lane (str): 'interactive' or 'bulk'.
+            slots (int): Number of slots wanted, i.e. the batch's concurrency.
+
+        Returns:
+            Reservation: At least 1 and at most `slots` reserved slots.
+
+        Raises:
+            Overloaded: If the lane's queue has no free slot.
+        """
+        self.check_lane(lane)
+        free = self.max_queue[lane] - self.queue_length(lane)
+        if free < 1:
+            self._reject(lane)
+        granted = min(slots, free)
+        self.reserved[lane] += granted
+        return Reservation(self, lane, granted)
+
+    async def run(
+        self, fn: Callable[[], Awaitable], lane: str = "interactive", reserved: bool = False
+    ):
+        """
+        Runs a coroutine function once a slot of its lane is free.
+
+        Args:
+            fn (Callable[[], Awaitable]): Function returning the coroutine to run.
+            lane (str): 'interactive' or 'bulk'.
+            reserved (bool): The call is covered by a reservation (see `reserve`) and
+                therefore not checked against the queue bound.
+
+        Returns:
+            The result of the coroutine.
+
+        Raises:
+            Overloaded: If the call is not reserved and the lane's queue is full.
+        """
+        if reserved:
+            self.check_lane(lane)
+        else:
+            self.admit(lane)
+
+        if self._can_start(lane) and not self._waiting[lane]:
+            self._start(lane)
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            entry = (waiter, reserved)
+            self._waiting[lane].append(entry)
+            self._reserved_waiting[lane] += reserved
+            SCHEDULER_QUEUED.labels(lane=lane).inc()
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # The slot was already handed to this call
+                    self._finish(lane)
+                elif entry in self._waiting[lane]:
+                    self._waiting[lane].remove(entry)
+                    self._reserved_waiting[lane] -= reserved
+                    SCHEDULER_QUEUED.labels(lane=lane).dec()
+                raise
+
+        start = time.perf_counter()
+        try:
+            return await fn()
+        finally:
+            self._record(time.perf_counter() - start)
+            self._finish(lane)
+
+    def stats(self) -> Dict:
+        return {
+            lane: {
+                "running": self.running[lane],
+                "queued": len(self._waiting[lane]),
+                "reserved": self.reserved[lane],
+                "max_queue": self.max_queue[lane],
+            }
+            for lane in LANES
+        }
+
+    def _reject(self, lane: str):
+        SCHEDULER_REJECTED.labels(lane=lane).inc()
+        raise Overloaded(lane, self.retry_after(lane))
+
+    def _can_start(self, lane: str) -> bool:
+        if sum(self.running.values()) >= self.max_concurrency:
+            return False
+        return lane == "interactive" or self.running["bulk"] < self.max_bulk_concurrency
+
+    def _start(self, lane: str):
+        self.running[lane] += 1
+        SCHEDULER_RUNNING.labels(lane=lane).inc()
+
+    def _finish(self, lane: str):
+        self.running[lane] -= 1
+        SCHEDULER_RUNNING.labels(lane=lane).dec()
+        self._dispatch()
+
+    def _dispatch(self):
+        # Hand free slots to waiting notes, interactive first
+        for lane in LANES:
+            waiting = self._waiting[lane]
+            while waiting and self._can_start(lane):
+                waiter, reserved = waiting.popleft()
+                self._reserved_waiting[lane] -= reserved
+                SCHEDULER_QUEUED.labels(lane=lane).dec()
+                if waiter.done():
+                    # Cancelled while waiting
+                    continue
+                self._start(lane)
+                waiter.set_result(None)
+
+    def _record(self, seconds: float):
+        if self.mean_seconds is None:
+            self.mean_seconds = seconds
+        else:
+            self.mean_seconds = 0.9 * self.mean_seconds + 0.1 * seconds
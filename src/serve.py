@@ -0,0 +1,194 @@
+import argparse
+import gc
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+
+from .utils import setup_loggers
+
+logger = setup_loggers()
+
+# Retriever cache loaded by src/app.py
+RETRIEVER_CACHE_DIR = "retriever_cache"
+
+
+def setup_multiprocess_metrics() -> str:
+    """
+    Points prometheus_client at a directory where every worker writes its metrics, so that
+    /metrics aggregates all workers rather than reporting the one answering the scrape.
+    Must run before prometheus_client is imported.
+
+    Returns:
+        str: The directory if it was created here and should be removed on exit, else None.
+    """
+    metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        # Files left by a previous run would be aggregated with the new workers' metrics
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir)
+        return None
+    metrics_dir = tempfile.mkdtemp(prefix="icd10-metrics-")
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+    return metrics_dir
+
+
+def check_retriever_cache():
+    """
+    Exits if the retriever cache has not been built. Building it embeds every description,
+    which starts the thread pools of torch in this process, and forking a process after
+    that can deadlock the workers.
+    """
+    from .retrievers import FaissDocumentRetriever, current_cache_dir
+
+    if not FaissDocumentRetriever.cache_exists(current_cache_dir(RETRIEVER_CACHE_DIR)):
+        raise SystemExit(
+            f"No retriever cache in {RETRIEVER_CACHE_DIR}. Build it before serving with "
+            "forked workers, e.g. with `python -c 'import src.app'`."
+        )
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """
+    Opens the listening socket shared by all workers.
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket, log_level: str):
+    """
+    Serves the app on the inherited socket in a forked worker process.
+    """
+    import uvicorn
+
+    from .metrics import format_memory, record_process_memory
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    gc.enable()
+    logger.info(f"Worker {os.getpid()} memory: {format_memory(record_process_memory())}")
+
+    server = uvicorn.Server(uvicorn.Config(app, log_level=log_level))
+    server.run(sockets=[sock])
+
+
+def fork_worker(app, sock: socket.socket, log_level: str) -> int:
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            run_worker(app, sock, log_level)
+        except BaseException:
+            logger.exception(f"Worker {os.getpid()} failed")
+            status = 1
+        finally:
+            os._exit(status)
+    return pid
+
+
+def serve(host: str = "0.0.0.0", port: int = 8000, workers: int = 1, log_level: str = "info"):
+    """
+    Preload-then-fork server for the API.
+
+    The app (code table, index, embedding model, agents) is imported and fully loaded once
+    in this process, which then forks the workers. Workers share every page the parent
+    loaded until one of them writes to it, instead of each holding its own copy as with
+    `uvicorn --workers`. The garbage collector is disabled while loading and the loaded
+    objects are frozen before forking, so that collections in the workers do not touch
+    (and thereby copy) the preloaded objects. Workers that exit unexpectedly are replaced.
+    The retriever cache must already exist, as no inference may run before forking.
+
+    Args:
+        host (str): Address to listen on.
+        port (int): Port to listen on.
+        workers (int): Number of worker processes.
+        log_level (str): Log level of uvicorn.
+    """
+    check_retriever_cache()
+    created_metrics_dir = setup_multiprocess_metrics()
+
+    from prometheus_client import multiprocess
+
+    from .metrics import format_memory, record_process_memory
+
+    gc.disable()
+    from . import app as app_module
+
+    app_module.preload()
+    gc.collect()
+    gc.freeze()
+    logger.info(f"Preloaded app, memory: {format_memory(record_process_memory())}")
+
+    sock = bind_socket(host, port)
+    children = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        pid = fork_worker(app_module.app, sock, log_level)
+        children[pid] = time.monotonic()
+    logger.info(f"Serving on {host}:{port} with {workers} preforked workers")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = children.pop(pid, None)
+        if started is None:
+            continue
+        multiprocess.mark_process_dead(pid)
+        if stopping:
+            continue
+        logger.warning(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}")
+        # Avoid a tight restart loop when workers fail right after starting
+        if time.monotonic() - started < 1:
+            time.sleep(1)
+        new_pid = fork_worker(app_module.app, sock, log_level)
+        children[new_pid] = time.monotonic()
+
+    sock.close()
+    if created_metrics_dir:
+        shutil.rmtree(created_metrics_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve the API with workers forked from a single preloaded process."
+    )
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("WEB_CONCURRENCY", "1")),
+        help="Number of worker processes. Defaults to WEB_CONCURRENCY or 1.",
+    )
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.log_level)
+
+
+if __name__ == "__main__":
+    main()
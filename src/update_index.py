@@ -0,0 +1,190 @@
+import argparse
+import os
+import time
+from typing import Dict
+
+import numpy as np
+
+from .code_table import CodeTable, encode_code_ids
+from .retrievers import (
+    FaissDocumentRetriever,
+    HybridRetriever,
+    build_index,
+    current_cache_dir,
+    publish_cache_version,
+)
+from .utils import setup_loggers
+
+logger = setup_loggers()
+
+# Index types whose vectors can be removed and added in place. HNSW graphs do not support
+# removal, and IndexIDMap2 compacts its id map on removal as if the sub-index renumbered its
+# vectors like IndexFlat, which IVF lists do not, so both are rebuilt from the (mostly
+# reused) embeddings instead.
+IN_PLACE_INDEX_TYPES = ("flat",)
+
+
+def diff_code_tables(old: CodeTable, new: CodeTable) -> Dict:
+    """
+    Compares two releases of the code table.
+
+    Args:
+        old (CodeTable): Table of the previous release.
+        new (CodeTable): Table of the new release.
+
+    Returns:
+        Dict: 'added', 'removed' and 'changed' (same code, new description) code lists, and
+            'old_rows', the row of each new code in the old table (-1 if the code is added).
+    """
+    old_rows = old.find(new.codes)
+    added = [new.code(row) for row in np.flatnonzero(old_rows < 0)]
+    changed = [
+        new.code(row)
+        for row in np.flatnonzero(old_rows >= 0)
+        if new.description(row) != old.description(old_rows[row])
+    ]
+    removed_rows = np.flatnonzero(new.find(old.codes) < 0)
+    removed = [old.code(row) for row in removed_rows]
+    return {"added": added, "removed": removed, "changed": changed, "old_rows": old_rows}
+
+
+def update_retriever(retriever: FaissDocumentRetriever, new_table: CodeTable):
+    """
+    Builds the retriever of a new release from the retriever of the previous one, embedding
+    only the added and changed descriptions.
+
+    For flat and IVF indexes keyed by code, the vectors of removed and changed codes are
+    removed from the index and those of added and changed codes are added. Otherwise the
+    index is rebuilt from the reused and new embeddings. Legacy caches hold no embeddings
+    to reuse, so every description is embedded again.
+
+    Args:
+        retriever (FaissDocumentRetriever): Retriever of the previous release, loaded
+            without memory-mapping so that its index can be modified.
+        new_table (CodeTable): Table of the new release.
+
+    Returns:
+        Tuple[FaissDocumentRetriever, Dict]: The updated retriever and the diff of the two
+            releases (see diff_code_tables).
+    """
+    diff = diff_code_tables(retriever.table, new_table)
+    if retriever.embeddings is None:
+        logger.info("The cache holds no embeddings (legacy format). Rebuilding the index.")
+        updated = FaissDocumentRetriever(
+            new_table,
+            retriever.model_name,
+            index_type=retriever.index_type,
+            index_params=retriever.index_params,
+            embedding_backend=retriever.embedder.backend,
+            batch_size=retriever.embedder.batch_size,
+            num_workers=retriever.embedder.num_workers,
+        )
+        return updated, diff
+
+    stale = set(diff["changed"])
+    reembed_rows = np.array(
+        [
+            row
+            for row, old_row in enumerate(diff["old_rows"])
+            if old_row < 0 or new_table.code(row) in stale
+        ],
+        dtype=np.int64,
+    )
+
+    old_embeddings = np.asarray(retriever.embeddings, dtype=np.float32)
+    embeddings = np.empty((len(new_table), old_embeddings.shape[1]), dtype=np.float32)
+    kept = diff["old_rows"] >= 0
+    embeddings[kept] = old_embeddings[diff["old_rows"][kept]]
+    if len(reembed_rows):
+        logger.info(f"Embedding {len(reembed_rows)} added or changed descriptions.")
+        embeddings[reembed_rows] = retriever.embedder.encode_documents(
+            [new_table.description(row) for row in reembed_rows]
+        )
+
+    if retriever.index_ids == "codes" and retriever.index_type in IN_PLACE_INDEX_TYPES:
+        index = retriever.index
+        stale_ids = encode_code_ids(diff["removed"] + diff["changed"])
+        if len(stale_ids):
+            index.remove_ids(stale_ids)
+        if len(reembed_rows):
+            index.add_with_ids(
+                np.ascontiguousarray(embeddings[reembed_rows]),
+                encode_code_ids(new_table.codes[reembed_rows]),
+            )
+    else:
+        logger.info(f"Rebuilding the {retriever.index_type} index from the updated embeddings.")
+        index = build_index(
+            embeddings,
+            retriever.index_type,
+            retriever.index_params,
+            ids=encode_code_ids(new_table.codes),
+        )
+
+    updated = FaissDocumentRetriever(
+        new_table,
+        retriever.model_name,
+        embed_docs=False,
+        index_type=retriever.index_type,
+        index_params=retriever.index_params,
+        embedding_backend=retriever.embedder.backend,
+        batch_size=retriever.embedder.batch_size,
+        num_workers=retriever.embedder.num_workers,
+    )
+    updated.embedder = retriever.embedder
+    updated.index = index
+    updated.embeddings = embeddings
+    updated.set_search_params()
+    return updated, diff
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Update the retriever cache to a new ICD-10-CM release, embedding only changed codes."
+    )
+    parser.add_argument(
+        "--new-tsv",
+        default="icd10_data/icd10_all_codes.tsv",
+        help="icd10_all_codes.tsv of the new release.",
+    )
+    parser.add_argument("--cache-dir", default="retriever_cache")
+    parser.add_argument(
+        "--version",
+        default=time.strftime("%Y%m%d%H%M%S"),
+        help="Name of the new cache version. Defaults to the current time.",
+    )
+    parser.add_argument("--embedding-workers", type=int, default=0)
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only print the changes between the releases."
+    )
+    args = parser.parse_args()
+
+    old_dir = current_cache_dir(args.cache_dir)
+    retriever = FaissDocumentRetriever.load(old_dir, mmap=False)
+    retriever.embedder.num_workers = args.embedding_workers
+    new_table = CodeTable.from_tsv(args.new_tsv)
+
+    if args.dry_run:
+        diff = diff_code_tables(retriever.table, new_table)
+    else:
+        start = time.perf_counter()
+        updated, diff = update_retriever(retriever, new_table)
+
+        def save_bm25(version_dir):
+            # Keep the keyword index of hybrid retrieval in step with the new code table
+            if os.path.isdir(os.path.join(old_dir, "bm25")):
+                HybridRetriever.from_dense(updated).sparse.save(os.path.join(version_dir, "bm25"))
+
+        publish_cache_version(updated, args.cache_dir, args.version, before_publish=save_bm25)
+        logger.info(f"Updated retriever cache in {time.perf_counter() - start:.1f} s")
+
+    print(
+        f"{len(diff['added'])} added, {len(diff['removed'])} removed and "
+        f"{len(diff['changed'])} changed codes between {old_dir} and {args.new_tsv}"
+    )
+    for kind in ("added", "removed", "changed"):
+        for code in diff[kind]:
+            print(f"{kind}\t{code}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,104 @@
-from typing import List
+from typing import Dict, List
+
+import numpy as np
+
+from .code_table import CodeTable
 
 
 class ICD10Validator:
-    def __init__(self, codes: List[dict]):
-        for code in codes:
-            assert "is_billable" in code
-            assert "description" in code
-        self.codes = {x["code"]: x for x in codes}
+    """
+    Looks up the validity, billability and description of ICD-10 codes.
 
-    def check_code_validity(self, code):
-        if code in self.codes:
-            return True
+    Codes are kept in a CodeTable (fixed-width code array, billable bitmask and a single
+    description buffer) and found by binary search over the sorted codes, so a validator
+    can share the memory-mapped table of the retriever instead of holding a dict of
+    records per code.
+
+    Attributes:
+        table (CodeTable): Table of all known codes.
+    """
+
+    def __init__(self, codes):
+        """
+        Args:
+            codes (List[dict] | CodeTable): Records with 'code', 'description' and
+                'is_billable' fields, or an already built CodeTable.
+        """
+        if isinstance(codes, CodeTable):
+            self.table = codes
         else:
-            return False
+            for code in codes:
+                assert "is_billable" in code
+                assert "description" in code
+            self.table = CodeTable.from_records(codes)
+
+    def validate_many(self, codes: List[str]) -> Dict:
+        """
+        Validates several codes in one vectorized lookup.
+
+        Args:
+            codes (List[str]): Codes to validate.
+
+        Returns:
+            Dict: 'is_valid' and 'is_billable' boolean arrays and a 'description' list (None
+                for invalid codes), each aligned with `codes`.
+        """
+        rows = self.table.find(codes)
+        is_valid = rows >= 0
+        is_billable = np.zeros(len(rows), dtype=bool)
+        is_billable[is_valid] = self.table.billable_mask(rows[is_valid])
+        descriptions = [
+            self.table.description(row) if row >= 0 else None for row in rows
+        ]
+        return {
+            "is_valid": is_valid,
+            "is_billable": is_billable,
+            "description": descriptions,
+        }
+
+    def billable_descendants(self, code: str, limit: int = None) -> List[str]:
+        """
+        Returns the billable codes below a code, e.g. 'R51' -> ['R51.0', 'R51.9'].
+
+        Args:
+            code (str): Category or other non-billable code.
+            limit (int, optional): Maximum number of codes to return.
+
+        Returns:
+            List[str]: Billable descendants in code order, excluding the code itself.
+        """
+        rows = self.table.prefix_rows(code)
+        rows = rows[self.table.billable_mask(rows)]
+        descendants = [self.table.code(row) for row in rows]
+        descendants = [x for x in descendants if x != code]
+        return descendants[:limit] if limit is not None else descendants
+
+    def nearest_valid_prefix(self, code: str):
+        """
+        Returns the longest prefix of an invalid code that is a valid code, e.g.
+        'E11.99' -> 'E11.9', or None if there is none.
+        """
+        prefix = code[:-1].rstrip(".")
+        while prefix:
+            if self.check_code_validity(prefix):
+                return prefix
+            prefix = prefix[:-1].rstrip(".")
+        return None
+
+    def find(self, code) -> int:
+        row = self.table.find([code])[0]
+        if row < 0:
+            raise KeyError(code)
+        return row
+
+    def check_code_validity(self, code):
+        return bool(self.table.find([code])[0] >= 0)
 
     def check_code_billable(self, code):
-        metadata = self.codes[code]
-        return metadata["is_billable"]
+        return self.table.is_billable(self.find(code))
 
     def get_description(self, code):
-        return self.codes[code]["description"]
+        return self.table.description(self.find(code))
 
     def get_all_data(self, code):
-        return self.codes[code]
+        return self.table.record(self.find(code))
@@ -0,0 +1,27 @@
+import asyncio
+
+from src.backends import async_openai_structured_output, response_cache_key
+from src.cache import SQLiteCache
+from src.schemas import CodeOutput
+
+
+class FailingClient:
+    @property
+    def beta(self):
+        raise AssertionError("The API must not be called for cached responses")
+
+
+def test_async_structured_output_serves_cached_response(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "responses.sqlite"))
+    output = {"icd10_codes": []}
+    key = response_cache_key("model", "system", "prompt", CodeOutput, {})
+    cache.put(key, output)
+
+    result = asyncio.run(
+        async_openai_structured_output(
+            FailingClient(), "system", "prompt", CodeOutput, {}, model="model", cache=cache
+        )
+    )
+
+    assert result == output
+    assert cache.hits == 1
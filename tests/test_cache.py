@@ -0,0 +1,85 @@
+import time
+
+from src.cache import LRUCache, SQLiteCache, hash_key
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(maxsize=2, ttl=0.01)
+    cache.put("a", 1)
+    time.sleep(0.02)
+
+    assert cache.get("a") is None
+
+
+def test_hash_key_ignores_dict_order():
+    assert hash_key({"a": 1, "b": 2}) == hash_key({"b": 2, "a": 1})
+    assert hash_key("a", 1) != hash_key("a", 2)
+
+
+def test_sqlite_cache_caps_entries(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), max_entries=3)
+    for i in range(5):
+        cache.put(f"key{i}", {"value": i})
+        # Distinct access times
+        time.sleep(0.001)
+
+    assert len(cache) == 3
+    assert cache.get("key0") is None
+    assert cache.get("key4") == {"value": 4}
+
+
+def test_sqlite_cache_caps_bytes(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), max_entries=None, max_bytes=100)
+    for i in range(10):
+        cache.put(f"key{i}", "x" * 30)
+        time.sleep(0.001)
+
+    assert cache.stats()["bytes"] <= 100
+    assert cache.get("key9") == "x" * 30
+
+
+def test_sqlite_cache_tracks_totals_across_replace_and_delete(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), max_entries=10)
+    cache.put("a", "x" * 10)
+    cache.put("a", "x" * 20)
+    cache.put("b", "y")
+    cache.delete("b")
+
+    stats = cache.stats()
+    assert (cache._num_entries, cache._total_bytes) == (stats["size"], stats["bytes"])
+
+
+def test_sqlite_cache_recounts_writes_of_other_processes(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = SQLiteCache(path, max_entries=4, recount_interval=2)
+    other = SQLiteCache(path, max_entries=None)
+    cache.put("a", 1)
+    for i in range(5):
+        other.put(f"other{i}", i)
+    cache.put("b", 2)
+    # The second write since the last recount counts the entries again
+    cache.put("c", 3)
+
+    assert len(cache) == 4
+
+
+def test_sqlite_cache_metadata_survives_clear(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"))
+    cache.set_meta("version", {"n": 1})
+    cache.put("a", 1)
+    cache.clear()
+
+    assert len(cache) == 0
+    assert cache.get_meta("version") == {"n": 1}
@@ -0,0 +1,60 @@
+import numpy as np
+
+from src.code_table import CodeTable
+from src.validator import ICD10Validator
+
+RECORDS = [
+    {"code": "E11", "description": "Type 2 diabetes mellitus", "is_billable": False},
+    {"code": "E11.9", "description": "Type 2 diabetes mellitus without complications", "is_billable": True},
+    {"code": "A00", "description": "Cholera", "is_billable": False},
+    {"code": "A00.0", "description": "Cholera due to Vibrio cholerae 01, biovar cholerae", "is_billable": True},
+    {"code": "J20.9", "description": "Acute bronchitis, unspecified", "is_billable": True},
+]
+
+
+def test_find_returns_rows_in_original_order():
+    table = CodeTable.from_records(RECORDS)
+
+    rows = table.find(["J20.9", "E11", "Z99.9", "A00.0"])
+
+    assert rows.tolist() == [4, 0, -1, 3]
+
+
+def test_find_accepts_fixed_width_bytes():
+    table = CodeTable.from_records(RECORDS)
+
+    assert table.find(np.array([b"E11.9", b"X00"])).tolist() == [1, -1]
+
+
+def test_save_and_load_memory_mapped(tmp_path):
+    table = CodeTable.from_records(RECORDS)
+    table.save(str(tmp_path))
+    loaded = CodeTable.load(str(tmp_path), mmap=True)
+
+    assert loaded.records() == table.records()
+
+
+def test_validate_many():
+    validator = ICD10Validator(CodeTable.from_records(RECORDS))
+
+    result = validator.validate_many(["E11", "E11.9", "E11.99"])
+
+    assert result["is_valid"].tolist() == [True, True, False]
+    assert result["is_billable"].tolist() == [False, True, False]
+    assert result["description"][2] is None
+
+
+def test_prefix_rows_returns_subtree_in_code_order():
+    table = CodeTable.from_records(RECORDS)
+
+    assert [table.code(row) for row in table.prefix_rows("A00")] == ["A00", "A00.0"]
+    assert len(table.prefix_rows("B")) == 0
+
+
+def test_billable_descendants_and_nearest_valid_prefix():
+    validator = ICD10Validator(CodeTable.from_records(RECORDS))
+
+    assert validator.billable_descendants("E11") == ["E11.9"]
+    assert validator.billable_descendants("E11.9") == []
+    assert validator.nearest_valid_prefix("E11.99") == "E11.9"
+    assert validator.nearest_valid_prefix("Z99.9") is None
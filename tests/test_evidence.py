@@ -0,0 +1,61 @@
+from src.evidence import normalize_text, verify_evidence
+
+
+def test_normalize_text_maps_offsets_to_the_original():
+    text, offsets = normalize_text("Acute  Bronchitis\n")
+
+    assert text == "acute bronchitis "
+    assert len(offsets) == len(text)
+    assert offsets[6] == 7
+
+
+def test_normalize_text_with_length_changing_lowercase():
+    note = "İ Dx: acute bronchitis"
+
+    text, offsets = normalize_text(note)
+
+    assert len(offsets) == len(text)
+    start = text.index("acute")
+    assert note[offsets[start] :].startswith("acute")
+
+
+def test_verify_evidence_span_after_length_changing_lowercase():
+    note = "Dx: acute bronchitis İ"
+
+    verified = verify_evidence([{"code": "J20.9", "evidence": "bronchitis i̇"}], note)
+
+    start, end = verified[0]["evidence_span"]
+    assert note[start:end] == "bronchitis İ"
+
+
+def test_verify_evidence_drops_or_flags_missing_evidence():
+    codes = [
+        {"code": "J20.9", "evidence": "Acute  bronchitis"},
+        {"code": "E11.9", "evidence": "type 2 diabetes"},
+    ]
+    note = "Patient presents with acute bronchitis."
+
+    dropped = verify_evidence(codes, note, mode="drop")
+    flagged = verify_evidence(codes, note, mode="flag")
+
+    assert [code["code"] for code in dropped] == ["J20.9"]
+    start, end = dropped[0]["evidence_span"]
+    assert note[start:end] == "acute bronchitis"
+    assert [code["evidence_verified"] for code in flagged] == [True, False]
+
+
+def test_verify_evidence_tolerates_small_edits():
+    note = "Patient presents with acute bronchitis, worse at night."
+
+    verified = verify_evidence([{"code": "J20.9", "evidence": "acute bronchitis worse"}], note)
+
+    assert verified[0]["evidence_verified"]
+
+
+def test_verify_evidence_rejects_snippet_longer_than_note():
+    evidence = "history of poorly controlled hypertension and CKD stage 4"
+
+    flagged = verify_evidence([{"code": "I12.9", "evidence": evidence}], "Hypertension.", mode="flag")
+
+    assert flagged[0]["evidence_verified"] is False
+    assert "evidence_span" not in flagged[0]
@@ -0,0 +1,18 @@
+from src.hierarchy import in_range, parse_code_ranges
+
+
+def test_parse_code_ranges():
+    note = "intestinal infections (A00-A09), gastritis (K29.-) and fracture (S72.001A)"
+
+    assert parse_code_ranges(note) == [("A00", "A09"), ("K29", "K29"), ("S72.001A", "S72.001A")]
+
+
+def test_parse_code_ranges_ignores_tokens_that_are_not_codes():
+    note = "influenza due to identified virus (H1N1) or diabetes (T2DM) (J09.X2, E11)"
+
+    assert parse_code_ranges(note) == [("J09.X2", "J09.X2"), ("E11", "E11")]
+
+
+def test_in_range():
+    assert in_range("A05.1", ("A00", "A09"))
+    assert not in_range("A10", ("A00", "A09"))
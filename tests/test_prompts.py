@@ -0,0 +1,15 @@
+import requests
+
+from src import prompts
+
+
+def test_get_encoding_falls_back_without_downloading(tmp_path, monkeypatch):
+    def no_network(*args, **kwargs):
+        raise AssertionError("Encoding data must not be downloaded")
+
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(requests, "get", no_network)
+    monkeypatch.setattr(prompts, "_encodings", {})
+
+    assert prompts.get_encoding("gpt-4o") is None
+    assert prompts.count_tokens("x" * 40, "gpt-4o") == 40 // prompts.CHARS_PER_TOKEN + 1
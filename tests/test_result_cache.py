@@ -0,0 +1,84 @@
+import time
+
+from src.cache import hash_file
+from src.result_cache import NoteResultCache, normalize_note, pipeline_fingerprint
+
+RESULT = {
+    "icd10_codes": [
+        {
+            "code": "I10",
+            "evidence": "essential hypertension",
+            "evidence_span": [8, 30],
+            "evidence_verified": True,
+        }
+    ]
+}
+
+
+def test_normalize_note_collapses_case_and_whitespace():
+    assert normalize_note("  Patient has\n\tEssential  Hypertension ") == (
+        "patient has essential hypertension"
+    )
+
+
+def test_hit_after_normalization_relocates_evidence():
+    cache = NoteResultCache("fp")
+    cache.put("Patient essential hypertension.", RESULT)
+
+    result = cache.get("PATIENT  essential\nhypertension.")
+
+    assert result["icd10_codes"][0]["evidence_span"] == [9, 31]
+    assert cache.get("Patient has essential hypertension.") is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_cached_result_is_a_copy():
+    cache = NoteResultCache("fp")
+    cache.put("note", RESULT)
+    cache.get("note")["icd10_codes"].clear()
+
+    assert cache.get("note") == RESULT
+
+
+def test_expired_entries_are_removed_from_both_levels(tmp_path):
+    cache = NoteResultCache("fp", ttl=0.01, path=str(tmp_path / "notes.sqlite"))
+    cache.put("note", RESULT)
+    time.sleep(0.02)
+
+    assert cache.get("note") is None
+    assert len(cache.memory) == 0
+    assert len(cache.store) == 0
+
+
+def test_store_is_invalidated_when_fingerprint_changes(tmp_path):
+    path = str(tmp_path / "notes.sqlite")
+    NoteResultCache("fp", path=path).put("note", RESULT)
+
+    assert NoteResultCache("fp", path=path).get("note") == RESULT
+    assert NoteResultCache("other", path=path).get("note") is None
+    assert NoteResultCache("fp", path=path).get("note") is None
+
+
+def test_pipeline_fingerprint_covers_retriever_and_hierarchy(tmp_path):
+    hierarchy = tmp_path / "hierarchy.jsonl"
+    hierarchy.write_text('{"code": "I10"}\n')
+    settings = dict(
+        embedding_backend="torch",
+        index_type="ivf",
+        index_params={"nlist": 64, "nprobe": 8},
+        hierarchy=hash_file(str(hierarchy)),
+    )
+    fingerprint = pipeline_fingerprint({"coder": {}}, "gpt-4o", "v1", **settings)
+
+    assert fingerprint == pipeline_fingerprint({"coder": {}}, "gpt-4o", "v1", **settings)
+    for name, value in [
+        ("embedding_backend", "onnx"),
+        ("index_type", "hnsw"),
+        ("index_params", {"nlist": 64, "nprobe": 16}),
+    ]:
+        changed = dict(settings, **{name: value})
+        assert pipeline_fingerprint({"coder": {}}, "gpt-4o", "v1", **changed) != fingerprint
+
+    hierarchy.write_text('{"code": "I11"}\n')
+    changed = dict(settings, hierarchy=hash_file(str(hierarchy)))
+    assert pipeline_fingerprint({"coder": {}}, "gpt-4o", "v1", **changed) != fingerprint
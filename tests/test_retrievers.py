@@ -0,0 +1,60 @@
+import numpy as np
+
+from src.retrievers import Doc, FaissDocumentRetriever, FuzzyICD10Retriever, build_index
+
+
+def make_records(n):
+    return [
+        {"code": f"A{i:03d}", "description": f"description {i}", "is_billable": True}
+        for i in range(n)
+    ]
+
+
+def test_save_legacy_ivf_index_without_embeddings(tmp_path):
+    embeddings = np.random.default_rng(0).random((400, 16), dtype=np.float32)
+    retriever = FaissDocumentRetriever(
+        make_records(400),
+        "model",
+        embed_docs=False,
+        index_type="ivf",
+        index_params={"nlist": 8},
+    )
+    # Legacy caches hold an IVF index keyed by row and no embeddings
+    retriever.index = build_index(embeddings, "ivf", {"nlist": 8})
+    retriever.index_ids = "rows"
+
+    retriever.save(str(tmp_path))
+    loaded = FaissDocumentRetriever.load(str(tmp_path), mmap=False)
+
+    np.testing.assert_allclose(loaded.embeddings, embeddings)
+    assert loaded.index.ntotal == 400
+
+
+def make_fuzzy_retriever(max_candidates):
+    words = ["acute", "chronic", "bronchitis", "asthma", "diabetes", "type", "kidney", "disease"]
+    rng = np.random.default_rng(0)
+    documents = [
+        Doc(" ".join(rng.choice(words, size=4)), {"code": f"A{i:03d}"}) for i in range(300)
+    ]
+    return FuzzyICD10Retriever(documents, max_candidates=max_candidates)
+
+
+def test_fuzzy_retrieve_batch_matches_retrieve(monkeypatch):
+    # Force the cdist path regardless of the number of cores
+    monkeypatch.setattr("os.cpu_count", lambda: 10_000)
+    retriever = make_fuzzy_retriever(max_candidates=20)
+    queries = ["acute bronchitis", "type 2 diabetes", "chronic kidney disease", "asthma"]
+
+    batch = retriever.retrieve_batch(queries, top_k=5)
+
+    for query, docs in zip(queries, batch):
+        assert [doc.metadata for doc in docs] == [
+            doc.metadata for doc in retriever.retrieve(query, top_k=5)
+        ]
+
+
+def test_fuzzy_short_query_scans_all_documents():
+    retriever = make_fuzzy_retriever(max_candidates=20)
+
+    assert len(retriever.shortlist("ty")) == 300
+    assert retriever.retrieve("ty", top_k=3, score_cutoff=50)
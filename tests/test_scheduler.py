@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+from src.scheduler import Overloaded, PriorityScheduler
+
+
+async def hold(event, order=None, name=None):
+    if order is not None:
+        order.append(name)
+    await event.wait()
+
+
+def test_interactive_notes_start_before_waiting_bulk_notes():
+    async def main():
+        scheduler = PriorityScheduler(max_concurrency=1, max_bulk_concurrency=1)
+        release = asyncio.Event()
+        order = []
+        first = asyncio.create_task(scheduler.run(lambda: hold(release), lane="bulk"))
+        await asyncio.sleep(0)
+        bulk = asyncio.create_task(scheduler.run(lambda: hold(release, order, "bulk"), lane="bulk"))
+        interactive = asyncio.create_task(
+            scheduler.run(lambda: hold(release, order, "interactive"))
+        )
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(first, bulk, interactive)
+        return order
+
+    assert asyncio.run(main()) == ["interactive", "bulk"]
+
+
+def test_bulk_notes_leave_slots_for_interactive_notes():
+    async def main():
+        scheduler = PriorityScheduler(max_concurrency=4, max_bulk_concurrency=3)
+        release = asyncio.Event()
+        tasks = [
+            asyncio.create_task(scheduler.run(lambda: hold(release), lane="bulk"))
+            for _ in range(5)
+        ]
+        tasks.append(asyncio.create_task(scheduler.run(lambda: hold(release))))
+        await asyncio.sleep(0)
+        stats = scheduler.stats()
+        release.set()
+        await asyncio.gather(*tasks)
+        return stats
+
+    stats = asyncio.run(main())
+    assert stats["bulk"]["running"] == 3
+    assert stats["bulk"]["queued"] == 2
+    assert stats["interactive"]["running"] == 1
+
+
+def test_full_queue_rejects_with_retry_after():
+    async def main():
+        scheduler = PriorityScheduler(max_concurrency=1, max_queue=1)
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(scheduler.run(lambda: hold(release))) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as error:
+            await scheduler.run(lambda: hold(release))
+        release.set()
+        await asyncio.gather(*tasks)
+        return error.value
+
+    error = asyncio.run(main())
+    assert error.lane == "interactive"
+    assert error.retry_after >= 1
+
+
+def test_empty_queue_admits_when_a_slot_is_free():
+    scheduler = PriorityScheduler(max_concurrency=1, max_queue=0)
+
+    scheduler.admit("interactive")
+
+
+def test_unknown_lane():
+    with pytest.raises(ValueError):
+        PriorityScheduler().admit("urgent")
+
+
+def test_reservations_bound_the_queue():
+    scheduler = PriorityScheduler(max_queue=4, max_bulk_queue=3)
+
+    first = scheduler.reserve("bulk", 2)
+    second = scheduler.reserve("bulk", 8)
+    with pytest.raises(Overloaded):
+        scheduler.reserve("bulk", 1)
+    first.release()
+    first.release()
+
+    assert (first.slots, second.slots) == (2, 1)
+    assert scheduler.reserved["bulk"] == 1
+    assert scheduler.queue_length("bulk") == 1
+
+
+def test_reserved_notes_do_not_count_twice():
+    async def main():
+        scheduler = PriorityScheduler(max_concurrency=1, max_bulk_concurrency=1, max_bulk_queue=3)
+        release = asyncio.Event()
+        reservation = scheduler.reserve("bulk", 3)
+        tasks = [
+            asyncio.create_task(scheduler.run(lambda: hold(release), lane="bulk", reserved=True))
+            for _ in range(3)
+        ]
+        await asyncio.sleep(0)
+        length = scheduler.queue_length("bulk")
+        release.set()
+        await asyncio.gather(*tasks)
+        reservation.release()
+        return length, scheduler.queue_length("bulk")
+
+    assert asyncio.run(main()) == (3, 0)
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def main():
+        scheduler = PriorityScheduler(max_concurrency=1)
+        release = asyncio.Event()
+        running = asyncio.create_task(scheduler.run(lambda: hold(release)))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(scheduler.run(lambda: hold(release)))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.sleep(0)
+        stats = scheduler.stats()["interactive"]
+        release.set()
+        await running
+        return stats, scheduler.stats()["interactive"]
+
+    during, after = asyncio.run(main())
+    assert during["queued"] == 0
+    assert after["running"] == 0
@@ -0,0 +1,22 @@
+import os
+
+import pytest
+
+from src import serve
+
+
+def test_serve_refuses_to_fork_without_retriever_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    with pytest.raises(SystemExit, match="No retriever cache"):
+        serve.check_retriever_cache()
+
+
+def test_setup_multiprocess_metrics_empties_given_directory(tmp_path, monkeypatch):
+    metrics_dir = tmp_path / "metrics"
+    metrics_dir.mkdir()
+    (metrics_dir / "counter_123.db").write_bytes(b"stale")
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(metrics_dir))
+
+    assert serve.setup_multiprocess_metrics() is None
+    assert os.listdir(metrics_dir) == []
@@ -0,0 +1,123 @@
+import hashlib
+import os
+
+import numpy as np
+import pytest
+
+from src.code_table import CodeTable, decode_code_ids, encode_code_ids
+from src.embeddings import SentenceEmbedder
+from src.retrievers import (
+    FaissDocumentRetriever,
+    build_index,
+    current_cache_dir,
+    publish_cache_version,
+)
+from src.update_index import diff_code_tables, update_retriever
+
+OLD_RECORDS = [
+    {"code": "A00.0", "description": "Cholera due to Vibrio cholerae", "is_billable": True},
+    {"code": "E11.9", "description": "Type 2 diabetes mellitus", "is_billable": True},
+    {"code": "J20.9", "description": "Acute bronchitis", "is_billable": True},
+]
+NEW_RECORDS = [
+    {"code": "A00.0", "description": "Cholera due to Vibrio cholerae", "is_billable": True},
+    {"code": "E11.9", "description": "Type 2 diabetes mellitus without complications", "is_billable": True},
+    {"code": "U07.1", "description": "COVID-19", "is_billable": True},
+]
+
+# Codes kept by both releases, stored after the removed and changed ones in the index
+UNCHANGED_RECORDS = [
+    {"code": f"Z{i:02d}.0", "description": f"Unchanged condition {i}", "is_billable": True}
+    for i in range(20)
+]
+
+
+def fake_embedding(text):
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return np.frombuffer(digest, dtype=np.uint8)[:16].astype(np.float32)
+
+
+@pytest.fixture
+def embedded(monkeypatch):
+    """
+    Replaces the embedding model with a hash of each text and records the embedded texts.
+    """
+    texts = []
+
+    def encode_documents(self, batch):
+        texts.extend(batch)
+        return np.stack([fake_embedding(text) for text in batch])
+
+    monkeypatch.setattr(SentenceEmbedder, "encode_documents", encode_documents)
+    return texts
+
+
+def make_retriever(records, index_type="flat"):
+    return FaissDocumentRetriever(records, "model", index_type=index_type)
+
+
+def search_codes(retriever, text):
+    _, ids = retriever.index.search(fake_embedding(text)[None], 1)
+    return decode_code_ids(ids[0])[0].decode("ascii")
+
+
+def test_code_ids_round_trip():
+    codes = [record["code"] for record in OLD_RECORDS]
+
+    ids = encode_code_ids(codes)
+
+    assert [code.decode("ascii") for code in decode_code_ids(ids)] == codes
+
+
+def test_diff_code_tables():
+    diff = diff_code_tables(CodeTable.from_records(OLD_RECORDS), CodeTable.from_records(NEW_RECORDS))
+
+    assert diff["added"] == ["U07.1"]
+    assert diff["removed"] == ["J20.9"]
+    assert diff["changed"] == ["E11.9"]
+    assert diff["old_rows"].tolist() == [0, 1, -1]
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw", "ivf"])
+def test_update_retriever_embeds_only_added_and_changed_codes(embedded, index_type):
+    new_records = NEW_RECORDS + UNCHANGED_RECORDS
+    retriever = make_retriever(OLD_RECORDS + UNCHANGED_RECORDS, index_type)
+    embedded.clear()
+
+    updated, _ = update_retriever(retriever, CodeTable.from_records(new_records))
+
+    assert sorted(embedded) == ["COVID-19", "Type 2 diabetes mellitus without complications"]
+    assert updated.index.ntotal == len(new_records)
+    for record in new_records:
+        assert search_codes(updated, record["description"]) == record["code"]
+
+
+def test_update_retriever_rebuilds_legacy_cache_without_embeddings(embedded):
+    retriever = FaissDocumentRetriever(OLD_RECORDS, "model", embed_docs=False)
+    retriever.index = build_index(np.stack([fake_embedding(r["description"]) for r in OLD_RECORDS]))
+    retriever.index_ids = "rows"
+
+    updated, diff = update_retriever(retriever, CodeTable.from_records(NEW_RECORDS))
+
+    assert diff["added"] == ["U07.1"]
+    assert updated.index.ntotal == len(NEW_RECORDS)
+    assert search_codes(updated, "COVID-19") == "U07.1"
+
+
+def test_publish_cache_version_saves_artifacts_before_switching(embedded, tmp_path):
+    cache_dir = str(tmp_path)
+    publish_cache_version(make_retriever(OLD_RECORDS), cache_dir, "1")
+    seen = []
+
+    def before_publish(version_dir):
+        seen.append(current_cache_dir(cache_dir))
+        open(os.path.join(version_dir, "extra"), "w").close()
+
+    version_dir = publish_cache_version(
+        make_retriever(NEW_RECORDS), cache_dir, "2", before_publish=before_publish
+    )
+
+    assert seen == [os.path.join(cache_dir, "versions", "1")]
+    assert current_cache_dir(cache_dir) == version_dir
+    assert os.path.isfile(os.path.join(version_dir, "extra"))
+    assert len(FaissDocumentRetriever.load(version_dir).table) == len(NEW_RECORDS)